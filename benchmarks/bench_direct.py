@@ -0,0 +1,172 @@
+"""Бенчмарк личной рассылки подписчикам
+
+Создает временную базу с заданным числом подписчиков (случайные наборы
+категорий, часть из них заблокировала бота), ставит в рассылку несколько
+новостей и рассылает их через заглушку Bot API (benchmarks/fakes.py) с
+ограничением частоты бота:
+
+    python benchmarks/bench_direct.py
+    python benchmarks/bench_direct.py --subscribers 2000 --rate 30 --stories 3
+
+Кроме фактической скорости выводится время рассылки тех же сообщений при
+стандартном лимите Telegram (GLOBAL_RATE сообщений в секунду).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from functools import partial
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from telegram import Bot  # noqa: E402
+from telegram.request import HTTPXRequest  # noqa: E402
+
+import bot  # noqa: E402
+import database  # noqa: E402
+from bench_pipeline import git_revision, peak_rss_mb  # noqa: E402
+from dispatcher import GLOBAL_RATE, TokenBucket  # noqa: E402
+from fakes import FakeBotApi  # noqa: E402
+from fanout import CONCURRENCY, DirectFanout  # noqa: E402
+from media import MediaCache  # noqa: E402
+from subscribers import SubscriberCache  # noqa: E402
+
+FIRST_CHAT_ID = 10_000
+
+
+def make_subscribers(count, seed):
+    """Подписчики (chat_id, категории): у каждого от одной до трех категорий"""
+    rng = random.Random(seed)
+    categories = list(bot.CHANNELS)
+    return [(FIRST_CHAT_ID + number, rng.sample(categories, rng.randint(1, 3))) for number in range(count)]
+
+
+def make_stories(count, seed):
+    """Строки direct_jobs: у каждой новости одна-две категории, у первой - фото"""
+    rng = random.Random(f"stories-{seed}")
+    categories = list(bot.CHANNELS)
+    rows = []
+    for number in range(count):
+        mask = 0
+        for category in rng.sample(categories, rng.randint(1, 2)):
+            mask |= 1 << categories.index(category)
+        link = f"https://bench.example/news/{number}"
+        title = f"Новость номер {number}"
+        summary = "Текст новости для личной рассылки. " * 20
+        photo_url = "https://bench.example/media/photo.jpg" if number == 0 else None
+        rows.append((link, mask, bot.format_news(title, summary, link, 1500),
+                     bot.format_news(title, summary, link, bot.DIGEST_SUMMARY_LENGTH), photo_url, None))
+    return rows
+
+
+async def main_async(args):
+    subscribers = make_subscribers(args.subscribers, args.seed)
+    blocked = [chat_id for chat_id, _ in random.Random(f"blocked-{args.seed}").sample(
+        subscribers, int(len(subscribers) * args.blocked))]
+    stories = make_stories(args.stories, args.seed)
+
+    bot_api = await FakeBotApi(latency=args.api_latency, blocked=blocked, record_calls=False).start()
+    tg_bot = Bot("123:bench", base_url=bot_api.base_url,
+                 request=HTTPXRequest(connection_pool_size=args.concurrency))
+    await tg_bot.initialize()
+    bot.media_cache = MediaCache()
+
+    with tempfile.TemporaryDirectory() as directory:
+        await database.connect(os.path.join(directory, "bench.db"))
+        try:
+            async with database.batch():
+                for chat_id, filters in subscribers:
+                    await database.add_subscriber(chat_id, None, "User", None, filters)
+            cache = SubscriberCache(bot.CHANNELS)
+            start = time.perf_counter()
+            await cache.load()
+            load_s = time.perf_counter() - start
+
+            union = 0
+            for _, mask, *_ in stories:
+                union |= mask
+            start = time.perf_counter()
+            recipients = cache.recipients(union)
+            recipients_ms = (time.perf_counter() - start) * 1000
+            await database.enqueue_direct_jobs(stories)
+
+            fanout = DirectFanout(cache, partial(bot.send_direct, tg_bot), TokenBucket(args.rate, args.rate),
+                                  owner="bench", concurrency=args.concurrency)
+            start = time.perf_counter()
+            fanout.start()
+            await fanout.wait_idle()
+            elapsed = time.perf_counter() - start
+            await fanout.stop()
+
+            sends = sum(count for method, count in bot_api.methods.items() if method.startswith("send"))
+            still_active = len(await database.get_active_subscribers())
+            async with database._reader.execute("SELECT SUM(delivered) FROM direct_jobs") as cursor:
+                story_deliveries = (await cursor.fetchone())[0] or 0
+        finally:
+            await database.close()
+            await tg_bot.shutdown()
+            await bot_api.stop()
+
+    return {
+        "revision": git_revision(),
+        "python": sys.version.split()[0],
+        "settings": {
+            "subscribers": args.subscribers,
+            "stories": args.stories,
+            "blocked": args.blocked,
+            "rate": args.rate,
+            "api_latency": args.api_latency,
+            "concurrency": args.concurrency,
+        },
+        "recipients": len(recipients),
+        "index_load_s": load_s,
+        "recipients_lookup_ms": recipients_ms,
+        "elapsed_s": elapsed,
+        "api_sends": sends,
+        "sends_per_s": sends / elapsed if elapsed else None,
+        "rate_utilization": sends / elapsed / args.rate if elapsed else None,
+        "story_deliveries": story_deliveries,
+        "forbidden": bot_api.forbidden,
+        "deactivated": args.subscribers - still_active,
+        "api_methods": dict(bot_api.methods),
+        "api_media_sources": dict(bot_api.media_sources),
+        "minutes_at_global_rate": sends / GLOBAL_RATE / 60,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--subscribers", type=int, default=100_000, help="число подписчиков")
+    parser.add_argument("--stories", type=int, default=3, help="новостей в рассылке")
+    parser.add_argument("--blocked", type=float, default=0.02, help="доля подписчиков, заблокировавших бота")
+    parser.add_argument("--rate", type=float, default=1000,
+                        help="лимит сообщений в секунду (30 - обычный лимит бота, 1000 - платная рассылка)")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="задержка ответа Bot API, с")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="отправок одновременно")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="файл для JSON-результата (по умолчанию stdout)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    result = asyncio.run(main_async(args))
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
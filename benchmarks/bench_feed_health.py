@@ -0,0 +1,136 @@
+"""Бенчмарк циклов опроса лент при недоступных хостах
+
+Поднимает заглушку RSS-лент (benchmarks/fakes.py), в которой часть лент
+работает, часть не отвечает вовсе (зависший хост), часть отвечает 404, а
+часть указывает на закрытый порт, и прогоняет несколько циклов
+fetch_all_rss_entries подряд:
+
+    python benchmarks/bench_feed_health.py
+    python benchmarks/bench_feed_health.py --cycles 8 --stalled 5 --no-breaker
+
+Выводятся длительности циклов и число запросов к недоступным лентам.
+С --no-breaker выключатель не срабатывает (порог ошибок бесконечен).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bot  # noqa: E402
+import database  # noqa: E402
+from bench_pipeline import git_revision, peak_rss_mb, percentile  # noqa: E402
+from breaker import FeedBreaker  # noqa: E402
+from dedup import SentLinkCache  # noqa: E402
+from fakes import FakeFeedServer, make_rss  # noqa: E402
+from fetcher import FeedFetcher  # noqa: E402
+
+
+def closed_port():
+    """Порт, на котором никто не слушает (соединение отклоняется)"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def main_async(args):
+    good = {f"good{number}": make_rss(f"good{number}", args.items) for number in range(args.feeds)}
+    stalled = [f"stalled{number}" for number in range(args.stalled)]
+    missing = [f"missing{number}" for number in range(args.missing)]
+    feed_server = await FakeFeedServer(good, stalled=stalled).start()
+    port = closed_port()
+    refused = [f"http://127.0.0.1:{port}/refused{number}.xml" for number in range(args.refused)]
+    bad_urls = [feed_server.url(name) for name in stalled + missing] + refused
+    urls = [feed_server.url(name) for name in good] + bad_urls
+
+    # Все ленты заглушки на одном хосте; лимит на хост снят, чтобы ленты вели себя как разные хосты
+    bot.feed_fetcher = FeedFetcher(max_per_host=len(urls), deadline=args.deadline)
+    bot.feed_breaker = (FeedBreaker(threshold=10 ** 9) if args.no_breaker
+                        else FeedBreaker(base_seconds=args.open_seconds, max_seconds=args.open_seconds * 8))
+    bot.sent_links = SentLinkCache(bot.NEWS_RETENTION_DAYS)
+
+    cycles = []
+    with tempfile.TemporaryDirectory() as directory:
+        await database.connect(os.path.join(directory, "bench.db"))
+        try:
+            await database.add_feeds(urls, bot.CHECK_INTERVAL)
+            for _ in range(args.cycles):
+                start = time.perf_counter()
+                validators = []
+                async with database.batch():
+                    results = await bot.fetch_all_rss_entries(urls, validators)
+                    await database.save_feed_caches(validators)
+                cycles.append(time.perf_counter() - start)
+                if args.pause:
+                    await asyncio.sleep(args.pause)
+            health = {url: failures for url, failures, *_ in await database.get_feed_health(urls)}
+        finally:
+            await database.close()
+            await bot.feed_fetcher.close()
+            await feed_server.stop()
+
+    bad_requests = sum(feed_server.requests[name] for name in stalled + missing)
+    ordered = sorted(cycles)
+    return {
+        "revision": git_revision(),
+        "python": sys.version.split()[0],
+        "settings": {
+            "feeds": args.feeds,
+            "stalled": args.stalled,
+            "missing": args.missing,
+            "refused": args.refused,
+            "cycles": args.cycles,
+            "deadline": args.deadline,
+            "breaker": not args.no_breaker,
+            "open_seconds": args.open_seconds,
+            "pause": args.pause,
+        },
+        "cycle_ms": [round(cycle * 1000, 1) for cycle in cycles],
+        "cycle_p50_ms": percentile(ordered, 50) * 1000,
+        "cycle_max_ms": ordered[-1] * 1000,
+        "total_s": sum(cycles),
+        "good_feeds_ok": sum(1 for name in good if results[feed_server.url(name)] is not None),
+        "bad_feed_requests": bad_requests,
+        "bad_feed_failures": {url: health.get(url) for url in bad_urls},
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--feeds", type=int, default=20, help="работающих лент")
+    parser.add_argument("--items", type=int, default=30, help="записей в работающей ленте")
+    parser.add_argument("--stalled", type=int, default=3, help="лент, хост которых не отвечает")
+    parser.add_argument("--missing", type=int, default=3, help="лент, отвечающих 404")
+    parser.add_argument("--refused", type=int, default=2, help="лент на закрытом порту")
+    parser.add_argument("--cycles", type=int, default=6, help="циклов опроса")
+    parser.add_argument("--deadline", type=float, default=2.0, help="срок на запрос ленты, с")
+    parser.add_argument("--open-seconds", type=float, default=600, help="первое отключение ленты, с")
+    parser.add_argument("--pause", type=float, default=0.0, help="пауза между циклами, с")
+    parser.add_argument("--no-breaker", action="store_true", help="не отключать недоступные ленты")
+    parser.add_argument("--output", help="файл для JSON-результата (по умолчанию stdout)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    result = asyncio.run(main_async(args))
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
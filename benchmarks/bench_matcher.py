@@ -0,0 +1,103 @@
+"""Микробенчмарк классификатора категорий
+
+Сравнивает прежнюю реализацию check_filter_match (поиск подстрок по
+каждому синониму каждой категории) с CategoryMatcher на словарях
+разного размера. Запуск из корня репозитория:
+
+    python benchmarks/bench_matcher.py
+"""
+import json
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from matcher import CategoryMatcher  # noqa: E402
+
+SYNONYMS = {
+    "спорт": ["спорт", "футбол", "хоккей", " теннис", "баскетбол", "олимпиада", "лыжи", "мяч",
+              "шайба", "бокс"],
+    "экономика": ["экономика", "финансы", "бизнес", "рынок", "инвестиции", "деньги", "банк"],
+    "технологии": ["технологии", "гаджеты", "it", "программирование", "искусственный интеллект", "ai"],
+    "политика": ["политика", "правительство", "президент", "выборы", "парламент", "власть", "губернатор"],
+    "разное": ["красота", "косметика", "артисты", "кино", "шоу", "театр", "здоровье", "жена",
+               "измена", "рецепты", "макияж", "крем", "укладка", "морщины", "прыщи", "глаза", "муж", "нос"]
+}
+
+FILLER = ("в петербурге прошло заседание по вопросам городского хозяйства и транспорта, "
+          "участники обсудили планы на следующий год и подвели итоги работы ").split()
+ALPHABET = "абвгдежзиклмнопрстуфхцчшщэюя"
+
+
+def check_filter_match(text, filter_name, synonyms):
+    """Прежняя реализация из bot.py для сравнения"""
+    text_lower = text.lower()
+
+    if filter_name.lower() in text_lower:
+        return True
+
+    if filter_name in synonyms:
+        for synonym in synonyms[filter_name]:
+            if synonym in text_lower:
+                return True
+
+    return False
+
+
+def scaled_synonyms(keywords_per_category, rng):
+    """Словарь синонимов, дополненный случайными словами до нужного размера"""
+    result = {}
+    for category, words in SYNONYMS.items():
+        words = list(words)
+        while len(words) < keywords_per_category:
+            words.append("".join(rng.choice(ALPHABET) for _ in range(rng.randint(5, 10))))
+        result[category] = words
+    return result
+
+
+def make_texts(count, rng):
+    """Тексты новостей примерно той же длины, что заголовок с анонсом"""
+    keywords = [word.strip() for words in SYNONYMS.values() for word in words]
+    texts = []
+    for _ in range(count):
+        words = [rng.choice(FILLER) for _ in range(rng.randint(40, 120))]
+        for _ in range(rng.randint(0, 3)):
+            words.insert(rng.randrange(len(words)), rng.choice(keywords))
+        texts.append(" ".join(words))
+    return texts
+
+
+def run(keywords_per_category, texts, repeat, rng):
+    """Замер обеих реализаций на одном наборе текстов"""
+    synonyms = scaled_synonyms(keywords_per_category, rng)
+    matcher = CategoryMatcher(synonyms, synonyms.keys())
+
+    def legacy():
+        for text in texts:
+            [name for name in synonyms if check_filter_match(text, name, synonyms)]
+
+    def compiled():
+        matcher.match_many(texts)
+
+    legacy_time = min(timeit.repeat(legacy, number=1, repeat=repeat))
+    compiled_time = min(timeit.repeat(compiled, number=1, repeat=repeat))
+    return {
+        "keywords_per_category": keywords_per_category,
+        "texts": len(texts),
+        "legacy_us_per_text": legacy_time / len(texts) * 1e6,
+        "matcher_us_per_text": compiled_time / len(texts) * 1e6,
+        "speedup": legacy_time / compiled_time if compiled_time else None,
+    }
+
+
+def main():
+    rng = random.Random(42)
+    texts = make_texts(2000, rng)
+    results = [run(size, texts, repeat=5, rng=rng) for size in (10, 50, 100, 300)]
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
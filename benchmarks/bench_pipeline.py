@@ -0,0 +1,338 @@
+"""Сквозной бенчмарк конвейера загрузка -> очистка -> классификация -> дедупликация -> отправка
+
+Поднимает локальные заглушки RSS-лент и Bot API (benchmarks/fakes.py),
+прогоняет news_checker_job на синтетических лентах до опустошения outbox
+и выводит результаты в JSON, чтобы их можно было сравнивать между коммитами:
+
+    python benchmarks/bench_pipeline.py --output bench.json
+    python benchmarks/bench_pipeline.py --scenario large_text --api-latency 0.05 --error-rate 0.02
+
+Каждый сценарий выполняется дважды: холодный прогон с пустой базой и
+повторный прогон по неизменившимся лентам.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from telegram import Bot  # noqa: E402
+from telegram.request import HTTPXRequest  # noqa: E402
+
+import bot  # noqa: E402
+import database  # noqa: E402
+import html_text  # noqa: E402
+import metrics  # noqa: E402
+from dedup import SentLinkCache  # noqa: E402
+from dispatcher import ChannelDispatcher  # noqa: E402
+from fakes import FakeBotApi, FakeFeedServer, make_rss  # noqa: E402
+from fetcher import FeedFetcher  # noqa: E402
+from media import MediaCache  # noqa: E402
+from outbox import Outbox  # noqa: E402
+from parse_pool import FeedParsePool  # noqa: E402
+from similarity import NearDuplicateIndex  # noqa: E402
+
+SCENARIOS = {
+    "small_text": {"feeds": 3, "items": 20, "summary_words": 40},
+    "large_text": {"feeds": 3, "items": 500, "summary_words": 200},
+    "media": {"feeds": 3, "items": 100, "summary_words": 60, "media": True},
+    "high_duplicate": {"feeds": 4, "items": 200, "summary_words": 60, "duplicate": True},
+    "near_duplicate": {"feeds": 3, "items": 200, "summary_words": 60, "rewrite": True},
+    "digest": {"feeds": 3, "items": 100, "summary_words": 60, "media": True, "batch_window": 2},
+}
+
+
+class StageTimer:
+    """Сбор длительностей этапов конвейера"""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    def wrap(self, stage, func):
+        samples = self.samples[stage]
+        if asyncio.iscoroutinefunction(func):
+            async def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    samples.append(time.perf_counter() - start)
+        else:
+            def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    samples.append(time.perf_counter() - start)
+        return timed
+
+    def report(self):
+        result = {}
+        for stage, samples in self.samples.items():
+            if not samples:
+                continue
+            ordered = sorted(samples)
+            result[stage] = {
+                "count": len(ordered),
+                "total_ms": sum(ordered) * 1000,
+                "p50_ms": percentile(ordered, 50) * 1000,
+                "p90_ms": percentile(ordered, 90) * 1000,
+                "p99_ms": percentile(ordered, 99) * 1000,
+                "max_ms": ordered[-1] * 1000,
+            }
+        return result
+
+
+def percentile(ordered, percent):
+    """Процентиль по отсортированному списку (ближайший ранг)"""
+    index = max(0, min(len(ordered) - 1, round(percent / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb():
+    """Пиковый размер резидентной памяти процесса"""
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # В Linux значение в килобайтах, в macOS - в байтах
+    return usage / 1024 / (1024 if sys.platform == "darwin" else 1)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_feeds(config, media_base):
+    feeds = {}
+    for number in range(config["feeds"]):
+        name = f"feed{number}"
+        duplicate_of = "feed0" if config.get("duplicate") and number else None
+        rewrite_of = "feed0" if config.get("rewrite") and number else None
+        feeds[name] = make_rss(name, config["items"], config["summary_words"], media=config.get("media", False),
+                               duplicate_of=duplicate_of, rewrite_of=rewrite_of, media_base=media_base)
+    return feeds
+
+
+def instrument(timer):
+    """Подмена функций конвейера обертками с замером времени"""
+    bot.fetch_rss_entries = timer.wrap("fetch", bot.fetch_rss_entries)
+    bot.parse_feed = timer.wrap("parse", bot.parse_feed)
+    if bot.parse_pool is not None:
+        bot.parse_pool.parse = timer.wrap("parse", bot.parse_pool.parse)
+    bot.clean_html = timer.wrap("clean_html", bot.clean_html)
+    bot.category_matcher.match_mask = timer.wrap("classify", bot.category_matcher.match_mask)
+    bot.sent_links.filter_unsent = timer.wrap("dedup", bot.sent_links.filter_unsent)
+    bot.near_duplicates.find = timer.wrap("similarity", bot.near_duplicates.find)
+    bot.send_to_channel = timer.wrap("send", bot.send_to_channel)
+
+
+class LoopLagProbe:
+    """Задержка цикла событий: насколько позже срока просыпается короткий sleep"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(time.perf_counter() - start - self.interval)
+
+    def start(self):
+        self.samples = []
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        ordered = sorted(self.samples) or [0.0]
+        return {"p50_ms": percentile(ordered, 50) * 1000, "p99_ms": percentile(ordered, 99) * 1000,
+                "max_ms": ordered[-1] * 1000}
+
+
+class WriteCounter:
+    """Подсчет фиксаций транзакций на соединении записи"""
+
+    def __init__(self, connection):
+        self.commits = 0
+        self._commit = connection.commit
+        connection.commit = self.commit
+
+    async def commit(self):
+        self.commits += 1
+        await self._commit()
+
+
+async def run_scenario(name, config, args):
+    feed_server = await FakeFeedServer(latency=args.feed_latency).start()
+    feed_server.feeds.update(build_feeds(config, feed_server.base_url))
+    bot_api = await FakeBotApi(latency=args.api_latency, error_rate=args.error_rate,
+                               retry_after=args.retry_after).start()
+    tg_bot = Bot("123:bench", base_url=bot_api.base_url, request=HTTPXRequest(connection_pool_size=64))
+    await tg_bot.initialize()
+    context = types.SimpleNamespace(application=types.SimpleNamespace(bot=tg_bot))
+
+    originals = {name: getattr(bot, name) for name in
+                 ("fetch_rss_entries", "parse_feed", "clean_html", "send_to_channel")}
+    bot.feed_fetcher = FeedFetcher()
+    bot.sent_links = SentLinkCache(bot.NEWS_RETENTION_DAYS)
+    bot.near_duplicates = NearDuplicateIndex(bot.NEWS_RETENTION_DAYS)
+    bot.media_cache = MediaCache()
+    bot.channel_dispatcher = (ChannelDispatcher() if args.telegram_limits
+                              else ChannelDispatcher(global_rate=1e6, chat_rate=1e6, chat_burst=1e6))
+    html_text._cache.clear()
+    if args.parse_processes:
+        bot.parse_pool = FeedParsePool(args.parse_processes)
+        await bot.parse_pool.start()
+    batch_windows = {channel_name: channel.get("batch_window") for channel_name, channel in bot.CHANNELS.items()}
+    for channel in bot.CHANNELS.values():
+        channel["batch_window"] = config.get("batch_window", 0)
+
+    runs = []
+    with tempfile.TemporaryDirectory() as directory:
+        await database.connect(os.path.join(directory, "bench.db"))
+        await database.add_feeds([feed_server.url(feed) for feed in feed_server.feeds], bot.CHECK_INTERVAL)
+        writes = WriteCounter(database._writer)
+        bot.outbox = Outbox(bot.channel_dispatcher, lambda row: bot.outbox_send(tg_bot, row),
+                            on_commit=bot.outbox_committed, group=bot.group_outbox_rows,
+                            make_group_send=lambda rows: bot.outbox_group_send(tg_bot, rows))
+        bot.outbox.start()
+        try:
+            for run_name in ("cold", "warm"):
+                timer = StageTimer()
+                instrument(timer)
+                calls_before = len(bot_api.calls)
+                changes_before = database._writer.total_changes
+                commits_before = writes.commits
+                similar_before = metrics.DEDUP_HITS.value("similar")
+
+                lag = LoopLagProbe()
+                lag.start()
+                start = time.perf_counter()
+                await bot.news_checker_job(context)
+                await bot.outbox.wait_idle()
+                # Отправки каналов с batch_window становятся доступны только в конце окна
+                while (await database.get_outbox_counts()).get("pending"):
+                    await asyncio.sleep(0.1)
+                    await bot.outbox.wait_idle()
+                elapsed = time.perf_counter() - start
+                loop_lag = await lag.stop()
+
+                items = timer.samples["classify"]
+                sends = [call for call in bot_api.calls[calls_before:] if call[0].startswith("send")]
+                runs.append({
+                    "run": run_name,
+                    "elapsed_s": elapsed,
+                    "items_processed": len(items),
+                    "items_per_s": len(items) / elapsed if elapsed else None,
+                    "api_sends": len(sends),
+                    "sends_per_s": len(sends) / elapsed if elapsed else None,
+                    "stages": timer.report(),
+                    "loop_lag": loop_lag,
+                    "db_rows_written": database._writer.total_changes - changes_before,
+                    "db_commits": writes.commits - commits_before,
+                    "similar_skipped": metrics.DEDUP_HITS.value("similar") - similar_before,
+                    "similarity_index_entries": len(bot.near_duplicates),
+                    "similarity_index_kb": bot.near_duplicates.memory_bytes() / 1024,
+                    "peak_rss_mb": peak_rss_mb(),
+                })
+                for attribute, value in originals.items():
+                    setattr(bot, attribute, value)
+                bot.category_matcher.__dict__.pop("match_mask", None)
+                bot.sent_links.__dict__.pop("filter_unsent", None)
+                bot.near_duplicates.__dict__.pop("find", None)
+                if bot.parse_pool is not None:
+                    bot.parse_pool.__dict__.pop("parse", None)
+        finally:
+            await bot.channel_dispatcher.close()
+            await bot.outbox.stop()
+            await bot.feed_fetcher.close()
+            await database.close()
+            await tg_bot.shutdown()
+            if bot.parse_pool is not None:
+                bot.parse_pool.close()
+                bot.parse_pool = None
+            for channel_name, window in batch_windows.items():
+                if window is None:
+                    bot.CHANNELS[channel_name].pop("batch_window", None)
+                else:
+                    bot.CHANNELS[channel_name]["batch_window"] = window
+            await bot_api.stop()
+            await feed_server.stop()
+
+    return {
+        "scenario": name,
+        "config": config,
+        "feed_bytes_sent": feed_server.bytes_sent,
+        "feed_not_modified": feed_server.not_modified,
+        "api_rate_limited": bot_api.rate_limited,
+        "api_media_sources": dict(bot_api.media_sources),
+        "api_methods": dict(bot_api.methods),
+        "media_probes": dict(feed_server.media_requests),
+        "runs": runs,
+    }
+
+
+async def main_async(args):
+    names = args.scenario or list(SCENARIOS)
+    results = [await run_scenario(name, SCENARIOS[name], args) for name in names]
+    return {
+        "revision": git_revision(),
+        "python": sys.version.split()[0],
+        "settings": {
+            "api_latency": args.api_latency,
+            "feed_latency": args.feed_latency,
+            "error_rate": args.error_rate,
+            "telegram_limits": args.telegram_limits,
+            "parse_processes": args.parse_processes,
+        },
+        "scenarios": results,
+        "summary": {result["scenario"]: result["runs"][0]["items_per_s"] for result in results},
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="сценарий (можно указать несколько раз, по умолчанию все)")
+    parser.add_argument("--api-latency", type=float, default=0.01, help="задержка ответа Bot API, с")
+    parser.add_argument("--feed-latency", type=float, default=0.05, help="задержка ответа RSS-ленты, с")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 429 от Bot API")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after в ответах 429, с")
+    parser.add_argument("--parse-processes", type=int, default=0,
+                        help="разбирать ленты в пуле из N процессов (по умолчанию в пуле потоков)")
+    parser.add_argument("--telegram-limits", action="store_true",
+                        help="соблюдать реальные лимиты Telegram (по умолчанию отключены)")
+    parser.add_argument("--output", help="файл для JSON-результата (по умолчанию stdout)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    result = asyncio.run(main_async(args))
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
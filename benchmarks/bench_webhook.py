@@ -0,0 +1,185 @@
+"""Бенчмарк задержки ответа на команды: long polling против вебхука
+
+Поднимает заглушку Bot API (benchmarks/fakes.py) и отправляет боту пачки
+команд /start от разных пользователей: в режиме polling - через getUpdates,
+в режиме webhook - POST-запросами на встроенный HTTP-сервер, как это делает
+Telegram. Задержка считается от появления обновления до вызова sendMessage
+с ответом:
+
+    python benchmarks/bench_webhook.py
+    python benchmarks/bench_webhook.py --users 1000 --api-latency 0.05 --batch 10
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from telegram import Bot  # noqa: E402
+from telegram.ext import Application  # noqa: E402
+from telegram.request import HTTPXRequest  # noqa: E402
+
+import bot  # noqa: E402
+from bench_pipeline import git_revision, percentile  # noqa: E402
+from fakes import FakeBotApi, make_command_update  # noqa: E402
+from http_server import server_port  # noqa: E402
+from webhook import MAX_CONNECTIONS, SECRET_HEADER, ChatOrderedUpdateProcessor, start_webhook_server  # noqa: E402
+
+MODES = ("polling", "webhook")
+WEBHOOK_PATH = "/telegram"
+SECRET = "bench-secret"
+FIRST_CHAT_ID = 1000
+
+
+def make_bot(bot_api):
+    return Bot("123:bench", base_url=bot_api.base_url, request=HTTPXRequest(connection_pool_size=32),
+               get_updates_request=HTTPXRequest())
+
+
+async def wait_replies(bot_api, chat_ids, sent_after, timeout=120):
+    """Время первого ответа каждому чату после sent_after"""
+    pending = {str(chat_id) for chat_id in chat_ids}
+    replies = {}
+    checked = 0
+    deadline = time.monotonic() + timeout
+    while pending and time.monotonic() < deadline:
+        for method, params, at in bot_api.calls[checked:]:
+            chat_id = str(params.get("chat_id"))
+            if method == "sendMessage" and at >= sent_after and chat_id in pending:
+                pending.discard(chat_id)
+                replies[chat_id] = at
+        checked = len(bot_api.calls)
+        await asyncio.sleep(0.005)
+    return replies
+
+
+async def post_updates(client, url, updates, batch):
+    """Доставка обновлений как у Telegram: не больше MAX_CONNECTIONS запросов одновременно"""
+    semaphore = asyncio.Semaphore(MAX_CONNECTIONS)
+
+    async def post(chunk):
+        async with semaphore:
+            body = chunk[0] if batch == 1 else chunk
+            response = await client.post(url, json=body, headers={SECRET_HEADER: SECRET})
+            response.raise_for_status()
+
+    await asyncio.gather(*(post(updates[start:start + batch]) for start in range(0, len(updates), batch)))
+
+
+async def run_mode(mode, args):
+    bot_api = await FakeBotApi(latency=args.api_latency).start()
+    builder = Application.builder().bot(make_bot(bot_api))
+    if mode == "webhook":
+        builder = builder.updater(None).concurrent_updates(ChatOrderedUpdateProcessor(args.concurrency))
+    application = builder.build()
+    bot.add_handlers(application)
+
+    await application.initialize()
+    server = client = None
+    if mode == "webhook":
+        server = await start_webhook_server(application, "127.0.0.1", 0, WEBHOOK_PATH, SECRET)
+        client = httpx.AsyncClient(limits=httpx.Limits(max_connections=MAX_CONNECTIONS))
+        url = f"http://127.0.0.1:{server_port(server)}{WEBHOOK_PATH}"
+    else:
+        await application.updater.start_polling(poll_interval=0.0, timeout=10)
+    await application.start()
+
+    latencies = []
+    update_id = 0
+    start = time.perf_counter()
+    try:
+        for _ in range(args.bursts):
+            chat_ids = range(FIRST_CHAT_ID, FIRST_CHAT_ID + args.users)
+            updates = []
+            for chat_id in chat_ids:
+                update_id += 1
+                updates.append(make_command_update(update_id, chat_id))
+            sent_at = time.monotonic()
+            if mode == "webhook":
+                await post_updates(client, url, updates, args.batch)
+            else:
+                bot_api.push_updates(updates)
+            replies = await wait_replies(bot_api, chat_ids, sent_at)
+            latencies.extend(at - sent_at for at in replies.values())
+    finally:
+        elapsed = time.perf_counter() - start
+        if mode == "polling":
+            await application.updater.stop()
+        await application.stop()
+        await application.shutdown()
+        if server is not None:
+            server.close()
+            await client.aclose()
+        await bot_api.stop()
+
+    ordered = sorted(latencies)
+    expected = args.users * args.bursts
+    return {
+        "mode": mode,
+        "elapsed_s": elapsed,
+        "updates": expected,
+        "replied": len(ordered),
+        "updates_per_s": len(ordered) / elapsed if elapsed else None,
+        "latency_ms": {
+            "p50": percentile(ordered, 50) * 1000,
+            "p90": percentile(ordered, 90) * 1000,
+            "p99": percentile(ordered, 99) * 1000,
+            "max": ordered[-1] * 1000,
+        } if ordered else None,
+        "api_calls": dict(bot_api.methods),
+    }
+
+
+async def main_async(args):
+    results = [await run_mode(mode, args) for mode in args.mode or MODES]
+    return {
+        "revision": git_revision(),
+        "python": sys.version.split()[0],
+        "settings": {
+            "users": args.users,
+            "bursts": args.bursts,
+            "api_latency": args.api_latency,
+            "batch": args.batch,
+            "concurrency": args.concurrency,
+        },
+        "modes": results,
+        "summary": {result["mode"]: result["latency_ms"] and result["latency_ms"]["p50"] for result in results},
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", action="append", choices=MODES,
+                        help="режим (можно указать несколько раз, по умолчанию оба)")
+    parser.add_argument("--users", type=int, default=300, help="пользователей в одной пачке команд")
+    parser.add_argument("--bursts", type=int, default=3, help="число пачек")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="задержка ответа Bot API, с")
+    parser.add_argument("--batch", type=int, default=1, help="обновлений в одном POST-запросе вебхука")
+    parser.add_argument("--concurrency", type=int, default=bot.WEBHOOK_CONCURRENCY,
+                        help="обновлений в обработке одновременно в режиме webhook")
+    parser.add_argument("--output", help="файл для JSON-результата (по умолчанию stdout)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    result = asyncio.run(main_async(args))
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+"""Локальные заглушки RSS-лент и Telegram Bot API для бенчмарков
+
+Обе заглушки работают поверх http_server и не требуют доступа в сеть.
+"""
+import asyncio
+import hashlib
+import json
+import random
+import time
+from collections import Counter
+from urllib.parse import parse_qs
+
+from http_server import Response, server_port, start_http_server
+
+CATEGORY_WORDS = ["футбол", "хоккей", "банк", "инвестиции", "гаджеты", "программирование",
+                  "президент", "выборы", "театр", "косметика"]
+FILLER_WORDS = ("в городе прошло заседание комиссии по вопросам транспорта участники обсудили "
+                "планы на следующий год и подвели итоги работы за прошедший период").split()
+
+
+LETTERS = "абвгдежзиклмнопрстуфхцчшэюя"
+UNIQUE_WORDS = 20  # собственных слов в каждой записи, чтобы тексты разных историй различались
+
+
+def _item_text(feed_name, number, summary_words, seed):
+    """Заголовок и слова текста записи; зависят только от ленты, номера и seed"""
+    rng = random.Random(f"{feed_name}-{number}-{seed}")
+    vocabulary = FILLER_WORDS + ["".join(rng.choice(LETTERS) for _ in range(rng.randint(5, 10)))
+                                 for _ in range(UNIQUE_WORDS)]
+    words = [rng.choice(vocabulary) for _ in range(summary_words)]
+    words.insert(rng.randrange(len(words)), rng.choice(CATEGORY_WORDS))
+    title = " ".join(rng.choice(vocabulary) for _ in range(6)) + " " + rng.choice(CATEGORY_WORDS)
+    return title, words
+
+
+def make_rss(feed_name, items, summary_words=60, media=False, duplicate_of=None, rewrite_of=None,
+             media_base=None, seed=0):
+    """Синтетическая RSS-лента
+
+    duplicate_of - имя другой ленты, ссылки которой повторяются в этой
+    (для сценария с большим числом дублей). rewrite_of - имя ленты, истории
+    которой повторяются здесь под своими ссылками с переставленными и
+    частично замененными словами (пересказы). media_base - адрес
+    FakeFeedServer, который раздает медиа; каждое седьмое медиа - битая ссылка.
+    """
+    rng = random.Random(f"{feed_name}-{seed}")
+    parts = ['<?xml version="1.0" encoding="utf-8"?>',
+             '<rss version="2.0" xmlns:media="http://search.yahoo.com/mrss/"><channel>',
+             f"<title>{feed_name}</title>"]
+    for number in range(items):
+        link_feed = duplicate_of if duplicate_of and number % 2 == 0 else feed_name
+        if rewrite_of and number % 2 == 0:
+            title, words = _item_text(rewrite_of, number, summary_words, seed)
+            rng.shuffle(words)
+            for _ in range(max(1, len(words) // 30)):
+                words[rng.randrange(len(words))] = rng.choice(FILLER_WORDS)
+        else:
+            title, words = _item_text(link_feed, number, summary_words, seed)
+        parts.append("<item>")
+        parts.append(f"<title>{title}</title>")
+        parts.append(f"<link>https://{link_feed}.example/news/{number}</link>")
+        parts.append(f"<description>&lt;p&gt;{' '.join(words)}&lt;/p&gt;</description>")
+        parts.append(f"<pubDate>Mon, 12 Oct 2026 {number % 24:02d}:00:00 +0300</pubDate>")
+        if media:
+            base = media_base or f"https://{feed_name}.example"
+            name = f"missing-{feed_name}-{number}" if number % 7 == 3 else f"{feed_name}-{number}"
+            if number % 3 == 0:
+                parts.append(f'<enclosure url="{base}/media/{name}.jpg" type="image/jpeg"/>')
+            elif number % 3 == 1:
+                parts.append(f'<media:content url="{base}/media/{name}.mp4" type="video/mp4"/>')
+        parts.append("</item>")
+    parts.append("</channel></rss>")
+    return "\n".join(parts).encode("utf-8")
+
+
+class FakeFeedServer:
+    """Раздача RSS-лент с поддержкой ETag и ответа 304
+
+    По адресам /media/<имя> отдаются медиафайлы размером media_size;
+    файлы с именем, начинающимся на missing-, отвечают 404. Ленты из
+    stalled не отвечают вовсе (зависший хост).
+    """
+
+    def __init__(self, feeds=None, latency=0.0, media_size=200 * 1024, stalled=()):
+        self.feeds = dict(feeds or {})
+        self.latency = latency
+        self.stalled = set(stalled)
+        self.media_size = media_size
+        self.requests = Counter()
+        self.media_requests = Counter()
+        self.not_modified = 0
+        self.bytes_sent = 0
+        self._server = None
+        self.port = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def url(self, name):
+        return f"{self.base_url}/{name}.xml"
+
+    def _media(self, request):
+        name = request.path.rsplit("/", 1)[-1]
+        self.media_requests[request.method] += 1
+        if name.startswith("missing-"):
+            return Response(404, "Not Found")
+        content_type = "video/mp4" if name.endswith(".mp4") else "image/jpeg"
+        if request.method == "HEAD":
+            return Response(200, headers={"Content-Length": str(self.media_size)}, content_type=content_type)
+        return Response(200, bytes(self.media_size), content_type=content_type)
+
+    async def _handle(self, request):
+        if request.path.startswith("/media/"):
+            return self._media(request)
+        name = request.path.strip("/").removesuffix(".xml")
+        self.requests[name] += 1
+        if name in self.stalled:
+            await asyncio.Event().wait()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        body = self.feeds.get(name)
+        if body is None:
+            return Response(404, "Not Found")
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        if request.headers.get("if-none-match") == etag:
+            self.not_modified += 1
+            return Response(304, headers={"ETag": etag})
+        self.bytes_sent += len(body)
+        return Response(200, body, headers={"ETag": etag}, content_type="application/rss+xml; charset=utf-8")
+
+    async def start(self):
+        self._server = await start_http_server(self._handle)
+        self.port = server_port(self._server)
+        return self
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+
+def make_command_update(update_id, chat_id, text="/start"):
+    """Обновление Telegram с командой от пользователя в личном чате"""
+    command = text.split()[0]
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private", "first_name": "User"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "User"},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}],
+        },
+    }
+
+
+class FakeBotApi:
+    """Заглушка Telegram Bot API с настраиваемой задержкой и ответами 429
+
+    Bot подключается к ней через base_url=fake.base_url. Все вызовы
+    сохраняются в calls как (метод, параметры, время). Обновления,
+    добавленные push_updates, отдаются через getUpdates (long polling).
+    Отправки в чаты из blocked отвечают 403, как для пользователя,
+    заблокировавшего бота. При record_calls=False вызовы только считаются
+    в methods (для рассылок на сотни тысяч сообщений).
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, retry_after=1, seed=0, blocked=(), record_calls=True):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.blocked = {str(chat_id) for chat_id in blocked}
+        self.forbidden = 0
+        self.record_calls = record_calls
+        self.calls = []
+        self.methods = Counter()
+        self.media_sources = Counter()  # фото и видео, отправленные по url и по file_id
+        self.rate_limited = 0
+        self._rng = random.Random(seed)
+        self._message_id = 0
+        self._updates = []
+        self._new_updates = asyncio.Event()
+        self._server = None
+        self.port = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    @staticmethod
+    def _params(request):
+        content_type = request.headers.get("content-type", "")
+        if content_type.startswith("application/json"):
+            return json.loads(request.body or b"{}")
+        if content_type.startswith("multipart/form-data"):
+            # Файлы в бенчмарках не отправляются, поэтому разбираем только текстовые поля
+            params = {}
+            for part in request.body.split(b"--" + content_type.split("boundary=")[-1].encode()):
+                head, _, value = part.partition(b"\r\n\r\n")
+                if b'name="' in head:
+                    name = head.split(b'name="')[1].split(b'"')[0].decode()
+                    params[name] = value.rstrip(b"\r\n").decode("utf-8", "replace")
+            return params
+        return {key: values[-1] for key, values in parse_qs(request.body.decode("utf-8")).items()}
+
+    def _message(self, params):
+        self._message_id += 1
+        chat_id = params.get("chat_id", "0")
+        numeric_id = int(chat_id) if str(chat_id).lstrip("-").isdigit() else -abs(hash(chat_id)) % 10 ** 12
+        message = {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": numeric_id, "type": "channel" if numeric_id < 0 else "private"},
+        }
+        file_id = f"file-{self._message_id}"
+        if "photo" in params:
+            message["photo"] = [{"file_id": file_id, "file_unique_id": file_id, "width": 1, "height": 1}]
+        if "video" in params:
+            message["video"] = {"file_id": file_id, "file_unique_id": file_id, "width": 1, "height": 1,
+                                "duration": 1}
+        if "text" in params:
+            message["text"] = params["text"]
+        return message
+
+    def push_updates(self, updates):
+        """Обновления для следующего getUpdates"""
+        self._updates.extend(updates)
+        self._new_updates.set()
+
+    async def _get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        self._updates = [update for update in self._updates if update["update_id"] >= offset]
+        if not self._updates:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout=float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:limit]
+
+    @staticmethod
+    def _album(params):
+        media = params.get("media", [])
+        return json.loads(media) if isinstance(media, str) else media
+
+    def _result(self, method, params):
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        if method == "sendMediaGroup":
+            return [self._message({"chat_id": params.get("chat_id"), item["type"]: item["media"]})
+                    for item in self._album(params)]
+        if method.startswith("send"):
+            return self._message(params)
+        return True
+
+    async def _handle(self, request):
+        method = request.path.rsplit("/", 1)[-1]
+        params = self._params(request)
+        self.methods[method] += 1
+        if self.record_calls:
+            self.calls.append((method, params, time.monotonic()))
+        items = self._album(params) if method == "sendMediaGroup" else [params]
+        for item in items:
+            media = item.get("media") if method == "sendMediaGroup" else item.get("photo", item.get("video"))
+            if media is not None:
+                self.media_sources["url" if str(media).startswith("http") else "file_id"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if method.startswith("send") and self.error_rate and self._rng.random() < self.error_rate:
+            self.rate_limited += 1
+            payload = {"ok": False, "error_code": 429,
+                       "description": f"Too Many Requests: retry after {self.retry_after}",
+                       "parameters": {"retry_after": self.retry_after}}
+            return Response(429, json.dumps(payload), content_type="application/json")
+
+        if method.startswith("send") and str(params.get("chat_id")) in self.blocked:
+            self.forbidden += 1
+            payload = {"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"}
+            return Response(403, json.dumps(payload), content_type="application/json")
+
+        if method == "getUpdates":
+            payload = {"ok": True, "result": await self._get_updates(params)}
+        else:
+            payload = {"ok": True, "result": self._result(method, params)}
+        return Response(200, json.dumps(payload, ensure_ascii=False), content_type="application/json")
+
+    async def start(self):
+        self._server = await start_http_server(self._handle)
+        self.port = server_port(self._server)
+        return self
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
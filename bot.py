@@ -1,20 +1,45 @@
+import argparse
 import logging
-import sqlite3
-import feedparser
 import asyncio
-import re
-from datetime import datetime, timedelta
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import html
+import math
+import signal
+import socket
+import time
+from functools import partial
+from urllib.parse import urlsplit
+from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto, InputMediaVideo
 from telegram.constants import ParseMode
+from telegram.error import BadRequest
 from telegram.ext import Application, CommandHandler, ContextTypes, CallbackQueryHandler
-from bs4 import BeautifulSoup
 from dotenv import load_dotenv
 import os
 
-
-
-# Конфигурация
-load_dotenv()
+import database
+import metrics
+from breaker import PROBE_DEADLINE, FeedBreaker, FeedHealth, describe_error
+from dedup import SentLinkCache
+from dispatcher import GLOBAL_RATE, ChannelDispatcher, TokenBucket
+from fanout import DirectFanout, is_chat_gone
+from feed_stream import parse_entries, parse_feed
+from fetcher import FeedFetcher, body_hash
+from html_text import clean_html
+from matcher import CategoryMatcher
+from media import MediaCache
+from outbox import Outbox
+from parse_pool import FeedParsePool
+from profiling import MAX_RUNS, MAX_SECONDS, MODES, TARGETS, Profiler
+from scheduler import FeedScheduler
+from similarity import NearDuplicateIndex, simhash
+from subscribers import SelectionStore, SubscriberCache
+from webhook import UPDATE_CONCURRENCY, ChatOrderedUpdateProcessor, run_webhook
+
+
+
+# Конфигурация. .env читается только при запуске бота: процессы разбора лент
+# (spawn импортирует этот модуль как __mp_main__), тесты и бенчмарки его не трогают
+if __name__ == "__main__":
+    load_dotenv()
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 RSS_FEED_URLS = [
     "https://spbnews78.ru/rss.xml",
@@ -24,11 +49,48 @@ RSS_FEED_URLS = [
     "https://www.woman.ru/rss-feeds/rss.xml"
 ]
 
-CHECK_INTERVAL = 3800  # секунд
-CLEANUP_INTERVAL = 86400  # очистка каждые 24 часа
+CHECK_INTERVAL = 3800  # секунд (начальный интервал опроса новой ленты)
+ADAPTIVE_SCHEDULER = True  # свой интервал опроса для каждой ленты вместо общего CHECK_INTERVAL
+NEAR_DUPLICATE_CHECK = True  # пропуск пересказов уже отправленных новостей из других лент
+STREAMING_PARSE = True  # потоковый разбор лент с остановкой на уже отправленных записях
+# Процессов для разбора лент (0 - разбор в пуле потоков) и запуск их заранее
+PARSE_PROCESSES = int(os.getenv("PARSE_PROCESSES", "0"))
+PARSE_WARMUP = os.getenv("PARSE_WARMUP", "1") != "0"
+CLEANUP_INTERVAL = 3600  # очистка каждый час небольшими порциями
 DATABASE_FILE = "news_bot.db"
 NEWS_RETENTION_DAYS = 20
-
+# Ограничения Telegram для альбомов и дайджестов
+MESSAGE_LIMIT = 4096  # символов в сообщении
+ALBUM_SIZE = 10  # медиа в одном альбоме
+DIGEST_SUMMARY_LENGTH = 300  # символов описания новости в альбоме или дайджесте (подпись к медиа - до 1024)
+DIGEST_HEADER_RESERVE = 64  # символов под заголовок дайджеста
+# Порт HTTP-сервера метрик Prometheus (если не задан, сервер не запускается)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# Число процессов доставки (--role deliver): общий лимит Telegram делится между ними
+DELIVER_WORKERS = max(1, int(os.getenv("DELIVER_WORKERS", "1")))
+DELIVER_MAX_CHATS = int(os.getenv("DELIVER_MAX_CHATS", "1000"))  # чатов на один процесс доставки
+# Личная рассылка новостей подписчикам по их категориям (дополнительно к каналам)
+DIRECT_DELIVERY = os.getenv("DIRECT_DELIVERY", "0") != "0"
+# Режим вебхука (--webhook): публичный адрес, по которому Telegram присылает обновления,
+# локальный адрес встроенного HTTP-сервера и секрет из заголовка X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", UPDATE_CONCURRENCY))  # обновлений в обработке одновременно
+# Пользователи, которым доступны служебные команды (/profile), через запятую
+ADMIN_IDS = {int(user_id) for user_id in os.getenv("ADMIN_IDS", "").replace(",", " ").split()}
+# Профилирование по запросу: каталог профилей и что включает сигнал SIGUSR1
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_SIGNAL_MODE = os.getenv("PROFILE_SIGNAL_MODE", "sample")
+PROFILE_SIGNAL_RUNS = int(os.getenv("PROFILE_SIGNAL_RUNS", "1"))  # циклов проверки лент
+PROFILE_SIGNAL_SECONDS = int(os.getenv("PROFILE_SIGNAL_SECONDS", "60"))  # окно для обработчиков команд
+FEED_HEALTH_LIST = 5  # отключенных лент, перечисляемых в /stats
+# Имя процесса в арендах лент и чатов
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# "batch_window": N - собирать новости канала за N секунд и отправлять альбомом или дайджестом
 CHANNELS = {
     "спорт": {
         "link": "https://t.me/spgnovosti",
@@ -62,211 +124,64 @@ SYNONYMS = {
                 "измена", "рецепты", "макияж", "крем", "укладка", "морщины", "прыщи", "глаза", "муж", "нос"]
 }
 
-# Логирование
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO,
-    handlers=[
-        logging.FileHandler("bot.log", encoding="utf-8"),
-        logging.StreamHandler()
-    ]
-)
+# Единый классификатор по ключевым словам всех категорий
+category_matcher = CategoryMatcher(SYNONYMS, CHANNELS)
+
 logger = logging.getLogger(__name__)
 
 # Глобальный словарь для временного хранения выбранных категорий
-user_selections = {}
-
-
-def clean_html(text):
-    """Очистка текста от HTML тегов"""
-    if not text:
-        return ""
-
-    soup = BeautifulSoup(text, 'html.parser')
-    clean_text = soup.get_text()
-    clean_text = re.sub(r'&[a-z]+;', '', clean_text)
-    clean_text = re.sub(r'<[^>]+>', '', clean_text)
-    clean_text = re.sub(r'\s+', ' ', clean_text).strip()
-
-    return clean_text
-
-
-def init_db():
-    """Инициализация базы данных"""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS subscribers (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            chat_id INTEGER UNIQUE,
-            username TEXT,
-            first_name TEXT,
-            last_name TEXT,
-            filters TEXT,
-            subscribed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            is_active INTEGER DEFAULT 1
-        )
-    """)
-
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS sent_news (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            link TEXT UNIQUE,
-            title TEXT,
-            published_at TIMESTAMP,
-            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS stats (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            news_count INTEGER DEFAULT 0,
-            last_check TIMESTAMP,
-            subscribers_count INTEGER DEFAULT 0,
-            last_cleanup TIMESTAMP
-        )
-    """)
+user_selections = SelectionStore()
 
-    cursor.execute("SELECT COUNT(*) FROM stats")
-    if cursor.fetchone()[0] == 0:
-        cursor.execute(
-            "INSERT INTO stats (news_count, last_check, subscribers_count, last_cleanup) VALUES (0, CURRENT_TIMESTAMP, 0, CURRENT_TIMESTAMP)")
+# Активные подписчики и их категории в памяти
+subscriber_cache = SubscriberCache(CHANNELS)
 
-    conn.commit()
-    conn.close()
+# Общий HTTP-клиент для загрузки RSS-лент
+feed_fetcher = FeedFetcher()
 
+# Отключение лент, которые раз за разом не удается получить
+feed_breaker = FeedBreaker()
 
-async def add_subscriber(chat_id, username, first_name, last_name, filters):
-    """Добавление или обновление подписчика"""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    try:
-        cursor.execute("""
-            INSERT OR REPLACE INTO subscribers 
-            (chat_id, username, first_name, last_name, filters, is_active) 
-            VALUES (?, ?, ?, ?, ?, 1)
-        """, (chat_id, username, first_name, last_name, " ".join(filters)))
-        conn.commit()
-        logger.info(f"Добавлен подписчик: {chat_id} с фильтрами: {filters}")
-    except Exception as e:
-        logger.error(f"Ошибка при добавлении подписчика: {e}")
-    finally:
-        conn.close()
+# Пул процессов разбора лент (создается при запуске, если задан PARSE_PROCESSES)
+parse_pool = None
 
+# Отпечатки отправленных новостей для поиска пересказов из других лент
+near_duplicates = NearDuplicateIndex(NEWS_RETENTION_DAYS)
+metrics.SIMILARITY_INDEX_ENTRIES.collect = lambda: {(): len(near_duplicates)}
+metrics.SIMILARITY_INDEX_BYTES.collect = lambda: {(): near_duplicates.memory_bytes()}
 
-async def remove_subscriber(chat_id):
-    """Удаление подписчика"""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    try:
-        cursor.execute("UPDATE subscribers SET is_active = 0 WHERE chat_id = ?", (chat_id,))
-        conn.commit()
-        logger.info(f"Удален подписчик: {chat_id}")
-    except Exception as e:
-        logger.error(f"Ошибка при удалении подписчика: {e}")
-    finally:
-        conn.close()
-
-
-def get_subscriber_filters(chat_id):
-    """Получение фильтров подписчика"""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT filters FROM subscribers WHERE chat_id = ? AND is_active = 1", (chat_id,))
-    result = cursor.fetchone()
-    conn.close()
-    if result and result[0]:
-        return result[0].split()
-    return []
-
-
-def get_active_subscribers():
-    """Получение активных подписчиков"""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT chat_id, filters FROM subscribers WHERE is_active = 1")
-    subscribers = cursor.fetchall()
-    conn.close()
-    return subscribers
-
-
-def is_news_sent(link):
-    """Проверка, была ли новость уже отправлена"""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(*) FROM sent_news WHERE link = ?", (link,))
-    result = cursor.fetchone()[0] > 0
-    conn.close()
-    return result
+# Очередь доставки (создается при запуске)
+outbox = None
 
+# file_id загруженных в Telegram фото и видео
+media_cache = MediaCache()
 
-def mark_news_as_sent(link, title, published_at):
-    """Пометить новость как отправленную"""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    try:
-        cursor.execute("""
-            INSERT OR IGNORE INTO sent_news (link, title, published_at)
-            VALUES (?, ?, ?)
-        """, (link, title, published_at))
-        conn.commit()
-    except Exception as e:
-        logger.error(f"Ошибка при сохранении отправленной новости: {e}")
-    finally:
-        conn.close()
+# Общий лимит частоты бота для каналов и личной рассылки
+telegram_bucket = TokenBucket(GLOBAL_RATE / DELIVER_WORKERS, GLOBAL_RATE / DELIVER_WORKERS)
 
+# Очереди отправки в каналы с ограничением частоты
+channel_dispatcher = ChannelDispatcher(global_bucket=telegram_bucket)
+metrics.SEND_QUEUE_DEPTH.collect = lambda: {
+    (chat_id,): size for chat_id, size in channel_dispatcher.queue_sizes().items()
+}
 
-def cleanup_old_news():
-    """Очистка старых новостей из базы данных"""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
+# Личная рассылка подписчикам (создается при запуске, если включен DIRECT_DELIVERY)
+direct_fanout = None
 
-    try:
-        cutoff_date = (datetime.now() - timedelta(days=NEWS_RETENTION_DAYS)).strftime('%Y-%m-%d %H:%M:%S')
-        cursor.execute("DELETE FROM sent_news WHERE published_at < ? OR sent_at < ?",
-                       (cutoff_date, cutoff_date))
-        deleted_count = cursor.rowcount
-        conn.commit()
-        logger.info(f"🧹 Очистка базы: удалено {deleted_count} старых новостей")
-        cursor.execute("UPDATE stats SET last_cleanup = CURRENT_TIMESTAMP")
-        conn.commit()
-        return deleted_count
-    except Exception as e:
-        logger.error(f"❌ Ошибка при очистке старых новостей: {e}")
-        return 0
-    finally:
-        conn.close()
+# HTTP-сервер метрик (запускается, если задан METRICS_PORT)
+metrics_server = None
 
+# Планировщик опроса лент (создается при запуске, если включен ADAPTIVE_SCHEDULER)
+feed_scheduler = None
 
-def update_stats(news_count=0, subscribers_count=0):
-    """Обновление статистики"""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    try:
-        if news_count > 0:
-            cursor.execute("UPDATE stats SET news_count = news_count + ?, last_check = CURRENT_TIMESTAMP",
-                           (news_count,))
-        if subscribers_count > 0:
-            cursor.execute("UPDATE stats SET subscribers_count = ?", (subscribers_count,))
-        conn.commit()
-    except Exception as e:
-        logger.error(f"Ошибка при обновлении статистики: {e}")
-    finally:
-        conn.close()
+# Роль процесса: all - все в одном процессе, остальные запускаются отдельно
+ROLES = ("all", "ingest", "deliver", "commands")
+role = "all"
 
+# Недавно отправленные ссылки для проверки дублей без обращения к базе
+sent_links = SentLinkCache(NEWS_RETENTION_DAYS)
 
-def get_stats():
-    """Получение статистики"""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT news_count, last_check, subscribers_count, last_cleanup FROM stats")
-    stats = cursor.fetchall()
-    conn.close()
-    if stats:
-        return stats[0]
-    return (0, None, 0, None)
+# Профилирование циклов проверки лент и обработчиков команд по запросу
+profiler = Profiler(PROFILE_DIR)
 
 
 def create_subscription_keyboard(current_filters=None):
@@ -294,10 +209,11 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
     chat_id = update.effective_chat.id
-    current_filters = get_subscriber_filters(chat_id)
+    await subscriber_cache.refresh()
+    current_filters = subscriber_cache.get_filters(chat_id)
 
     # Сохраняем текущий выбор пользователя
-    user_selections[chat_id] = current_filters.copy()
+    user_selections.set(chat_id, current_filters)
 
     keyboard = create_subscription_keyboard(current_filters)
 
@@ -313,32 +229,34 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     data = query.data
 
     # Инициализируем выбор пользователя, если его еще нет
-    if chat_id not in user_selections:
-        user_selections[chat_id] = get_subscriber_filters(chat_id).copy()
+    selection = user_selections.get(chat_id)
+    if selection is None:
+        await subscriber_cache.refresh()
+        selection = user_selections.set(chat_id, subscriber_cache.get_filters(chat_id))
 
     if data.startswith("toggle_"):
         # Переключение категории
         category = data.replace("toggle_", "")
 
-        if category in user_selections[chat_id]:
-            user_selections[chat_id].remove(category)
+        if category in selection:
+            selection.remove(category)
         else:
-            user_selections[chat_id].append(category)
+            selection.append(category)
 
         # Обновляем сообщение с новым состоянием кнопок
-        keyboard = create_subscription_keyboard(user_selections[chat_id])
+        keyboard = create_subscription_keyboard(selection)
         await query.edit_message_reply_markup(reply_markup=keyboard)
 
     elif data == "subscribe_confirm":
         # Подтверждение подписки
-        current_filters = user_selections.get(chat_id, [])
+        current_filters = selection
 
         if not current_filters:
             await query.message.reply_text("❌ Пожалуйста, выберите хотя бы одну категорию!")
             return
 
         user = query.from_user
-        await add_subscriber(
+        await subscriber_cache.subscribe(
             chat_id,
             user.username,
             user.first_name,
@@ -356,35 +274,36 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"📰 Читайте новости в следующих каналах:\n{links_msg}\n\n"
             "🔔 Новые новости будут публиковаться в этих каналах автоматически!"
         )
+        if DIRECT_DELIVERY:
+            response_message += "\n📨 Новости по выбранным темам также будут приходить вам в личные сообщения."
 
         await query.message.reply_text(response_message)
-        update_stats(subscribers_count=len(get_active_subscribers()))
+        await database.update_stats(subscribers_count=subscriber_cache.active_count)
 
         # Очищаем временные данные
-        if chat_id in user_selections:
-            del user_selections[chat_id]
+        user_selections.pop(chat_id)
 
     elif data == "unsubscribe_all":
         # Отписка от всех категорий
-        await remove_subscriber(chat_id)
+        await subscriber_cache.unsubscribe(chat_id)
         await query.message.reply_text(
             "❌ Вы отписались от всех новостей.\n"
             "Чтобы подписаться снова, используйте /start"
         )
-        update_stats(subscribers_count=len(get_active_subscribers()))
+        await database.update_stats(subscribers_count=subscriber_cache.active_count)
 
         # Очищаем временные данные
-        if chat_id in user_selections:
-            del user_selections[chat_id]
+        user_selections.pop(chat_id)
 
 
 async def subscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда подписки (альтернатива через команду)"""
     chat_id = update.effective_chat.id
-    current_filters = get_subscriber_filters(chat_id)
+    await subscriber_cache.refresh()
+    current_filters = subscriber_cache.get_filters(chat_id)
 
     # Сохраняем текущий выбор пользователя
-    user_selections[chat_id] = current_filters.copy()
+    user_selections.set(chat_id, current_filters)
 
     keyboard = create_subscription_keyboard(current_filters)
 
@@ -397,22 +316,22 @@ async def subscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def unsubscribe(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда отписки"""
     chat_id = update.effective_chat.id
-    await remove_subscriber(chat_id)
+    await subscriber_cache.unsubscribe(chat_id)
     await update.message.reply_text(
         "❌ Вы отписались от всех новостей.\n"
         "Чтобы подписаться снова, используйте /start"
     )
-    update_stats(subscribers_count=len(get_active_subscribers()))
+    await database.update_stats(subscribers_count=subscriber_cache.active_count)
 
     # Очищаем временные данные
-    if chat_id in user_selections:
-        del user_selections[chat_id]
+    user_selections.pop(chat_id)
 
 
 async def my_filters(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать текущие фильтры пользователя"""
     chat_id = update.effective_chat.id
-    current_filters = get_subscriber_filters(chat_id)
+    await subscriber_cache.refresh()
+    current_filters = subscriber_cache.get_filters(chat_id)
 
     if current_filters:
         filters_list = "\n".join([f"• {f.capitalize()}" for f in current_filters])
@@ -433,18 +352,48 @@ async def filters_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(message)
 
 
+def feed_health_text(rows, now):
+    """Доступность лент для /stats: сводка и отключенные ленты с последней ошибкой"""
+    healths = [FeedHealth(*row) for row in rows]
+    states = [health.state(now, feed_breaker.threshold) for health in healths]
+    failing = sum(1 for health, state in zip(healths, states) if state == "closed" and health.failures)
+    disabled = [health for health, state in zip(healths, states) if state != "closed"]
+    lines = [f"🩺 Ленты: в работе {len(healths) - len(disabled)} (с ошибками {failing}), "
+             f"отключены {len(disabled)}"]
+    for health in disabled[:FEED_HEALTH_LIST]:
+        host = urlsplit(health.url).hostname or health.url
+        retry = time.strftime("%H:%M", time.localtime(health.open_until)) if health.open_until else "сейчас"
+        lines.append(f"  • {host}: ошибок подряд {health.failures}, проверка в {retry} ({health.last_error})")
+    return "\n".join(lines)
+
+
 async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда просмотра статистики"""
-    stats_data = get_stats()
+    stats_data = await database.get_stats()
+    await subscriber_cache.refresh()
     if stats_data:
-        news_count, last_check, subscribers_count, last_cleanup = stats_data
+        news_count, last_check, _, last_cleanup = stats_data
         last_check_str = last_check if last_check else "никогда"
         last_cleanup_str = last_cleanup if last_cleanup else "никогда"
+        outbox_counts = await database.get_outbox_counts()
+        direct_line = ""
+        if DIRECT_DELIVERY:
+            direct_line = f"📨 Ожидают личной рассылки: {await database.get_direct_pending_count()}\n"
+        feeds_text = feed_health_text(await database.get_feed_health(), time.time())
+        category_counts = "\n".join(
+            f"  • {category.capitalize()}: {count}"
+            for category, count in subscriber_cache.category_counts().items()
+        )
 
         message = (
             "📊 Статистика бота:\n\n"
             f"📰 Отправлено новостей: {news_count}\n"
-            f"👥 Активных подписчиков: {subscribers_count}\n"
+            f"👥 Активных подписчиков: {subscriber_cache.active_count}\n"
+            f"{category_counts}\n"
+            f"📬 Ожидают отправки: {outbox_counts.get('pending', 0)}, "
+            f"не доставлено: {outbox_counts.get('failed', 0)}\n"
+            f"{direct_line}"
+            f"{feeds_text}\n"
             f"⏰ Последняя проверка: {last_check_str}\n"
             f"🧹 Последняя очистка: {last_cleanup_str}\n"
             f"🗑️ Новости хранятся: {NEWS_RETENTION_DAYS} дней"
@@ -457,7 +406,7 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def cleanup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Ручная команда очистки базы данных"""
-    deleted_count = cleanup_old_news()
+    deleted_count = await database.cleanup_old_news(NEWS_RETENTION_DAYS)
     await update.message.reply_text(
         f"🧹 Очистка базы данных завершена!\n"
         f"Удалено старых новостей: {deleted_count}\n"
@@ -465,6 +414,79 @@ async def cleanup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+async def send_profile_summary(bot, chat_id, summary):
+    """Отправка сводки профиля в чат, из которого его запросили"""
+    try:
+        await bot.send_message(chat_id=chat_id, text=summary)
+    except Exception as e:
+        logger.error(f"❌ Не удалось отправить сводку профиля: {e}")
+
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Служебная команда профилирования: /profile feeds|handlers [число] [cprofile|sample], /profile stop"""
+    user = update.effective_user
+    if user is None or user.id not in ADMIN_IDS:
+        await update.message.reply_text("⛔ Команда доступна только администраторам")
+        return
+
+    args = [arg.lower() for arg in context.args or []]
+    if args[:1] == ["stop"]:
+        if profiler.session is None:
+            await update.message.reply_text("ℹ️ Профилирование не запущено")
+        else:
+            profiler.stop()
+        return
+
+    target = args[0] if args else None
+    amount = next((arg for arg in args[1:] if arg.isdigit()), None)
+    mode = next((arg for arg in args[1:] if arg in MODES), MODES[0])
+    if target not in TARGETS:
+        session = profiler.session
+        status = f"идет профилирование {session.target} ({session.mode})" if session else "выключено"
+        await update.message.reply_text(
+            f"🔬 Профилирование: {status}\n\n"
+            f"/profile feeds [циклов, до {MAX_RUNS}] [cprofile|sample] - следующие циклы проверки лент\n"
+            f"/profile handlers [секунд, до {MAX_SECONDS}] [cprofile|sample] - обработчики команд\n"
+            "/profile stop - завершить досрочно"
+        )
+        return
+    if target == "feeds" and role not in ("all", "ingest"):
+        await update.message.reply_text("ℹ️ Ленты опрашивает другой процесс: пошлите ему сигнал SIGUSR1")
+        return
+
+    on_done = partial(send_profile_summary, context.bot, update.effective_chat.id)
+    try:
+        if target == "feeds":
+            runs = min(int(amount or 1), MAX_RUNS)
+            profiler.start(target, mode, runs=runs, on_done=on_done)
+            description = f"следующих циклов проверки лент: {runs}"
+        else:
+            seconds = min(int(amount or 60), MAX_SECONDS)
+            profiler.start(target, mode, seconds=seconds, on_done=on_done)
+            description = f"обработчиков команд в течение {seconds} с"
+    except RuntimeError as e:
+        await update.message.reply_text(f"⚠️ Профилирование не включено: {e}")
+        return
+    await update.message.reply_text(f"🔬 Включено профилирование ({mode}) {description}. Сводка придет сюда.")
+
+
+def toggle_profiling():
+    """Обработчик SIGUSR1: включение профилирования (или его досрочное завершение)"""
+    if profiler.session is not None:
+        profiler.stop()
+    elif role in ("all", "ingest"):
+        profiler.start("feeds", PROFILE_SIGNAL_MODE, runs=PROFILE_SIGNAL_RUNS)
+    elif role == "commands":
+        profiler.start("handlers", PROFILE_SIGNAL_MODE, seconds=PROFILE_SIGNAL_SECONDS)
+    else:
+        logger.warning(f"⚠️ В процессе {role} нечего профилировать: нет циклов проверки лент и команд")
+
+
+def install_profile_signal():
+    if hasattr(signal, "SIGUSR1"):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, toggle_profiling)
+
+
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда помощи"""
     help_text = (
@@ -481,153 +503,433 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(help_text)
 
 
-async def fetch_rss_entries(url):
-    """Асинхронное получение RSS записей"""
-    loop = asyncio.get_event_loop()
+async def fetch_rss_entries(url, validators, probe=False):
+    """Асинхронное получение записей RSS-ленты (список NewsItem)
+
+    Возвращает пустой список, если лента не изменилась с прошлой проверки,
+    и None при ошибке загрузки. Новые валидаторы HTTP и хэш тела
+    добавляются в список validators строкой для database.save_feed_caches:
+    сохранять их можно только вместе с записями о новостях, иначе
+    неотправленные записи пропустит следующая проверка. probe - пробный
+    запрос к отключенной ленте с коротким сроком ожидания.
+    """
+    logger.info(f"📡 Получение новостей из: {url}")
     try:
-        feed = await loop.run_in_executor(None, feedparser.parse, url)
-        return feed.entries
+        etag, last_modified, cached_hash = await database.get_feed_cache(url)
+        deadline = min(PROBE_DEADLINE, feed_fetcher.deadline) if probe else None
+        response = await feed_fetcher.fetch_conditional(url, etag, last_modified, deadline=deadline)
+        if response.status_code == 304:
+            logger.info(f"ℹ️ Лента не изменилась (304): {url}")
+            feed_breaker.success(url, time.time())
+            return []
+
+        new_etag = response.headers.get("ETag")
+        new_last_modified = response.headers.get("Last-Modified")
+        content_hash = body_hash(response.content)
+        if content_hash == cached_hash:
+            if (new_etag, new_last_modified) != (etag, last_modified):
+                validators.append((url, new_etag, new_last_modified, content_hash))
+            logger.info(f"ℹ️ Лента не изменилась (совпадает хэш): {url}")
+            feed_breaker.success(url, time.time())
+            return []
+
+        loop = asyncio.get_running_loop()
+        parse_start = time.perf_counter()
+        if parse_pool is not None:
+            entries = await parse_pool.parse(response.content, dict(response.headers))
+        elif STREAMING_PARSE:
+            entries = await loop.run_in_executor(
+                None, parse_feed, response.content, dict(response.headers), sent_links.__contains__
+            )
+        else:
+            entries = await loop.run_in_executor(
+                None, parse_entries, response.content, dict(response.headers)
+            )
+        metrics.PARSE_SECONDS.observe(time.perf_counter() - parse_start, url)
+        validators.append((url, new_etag, new_last_modified, content_hash))
+        feed_breaker.success(url, time.time())
+        return entries
     except Exception as e:
-        logger.error(f"Ошибка при получении RSS ({url}): {e}")
-        return []
-
-
-async def fetch_all_rss_entries(urls):
-    """Получение новостей из всех RSS-каналов"""
-    all_entries = []
+        logger.error(f"Ошибка при получении RSS ({url}): {describe_error(e)}")
+        feed_breaker.failure(url, e, time.time())
+        return None
+
+
+async def fetch_all_rss_entries(urls, validators):
+    """Параллельное получение новостей из всех RSS-каналов
+
+    Возвращает словарь url -> список записей (None для недоступных лент);
+    валидаторы лент добавляются в validators (см. fetch_rss_entries).
+    Ленты, отключенные после ошибок, не опрашиваются до истечения срока.
+    """
+    await feed_breaker.load(urls)
+    now = time.time()
+    states = {url: feed_breaker.state(url, now) for url in urls}
+    polled = [url for url in urls if states[url] != "open"]
     for url in urls:
-        logger.info(f"📡 Получение новостей из: {url}")
-        entries = await fetch_rss_entries(url)
-        if entries:
-            all_entries.extend(entries)
-            logger.info(f"✅ Получено {len(entries)} новостей из {url}")
-        else:
-            logger.warning(f"⚠️ Не удалось получить новости из {url}")
-    return all_entries
-
+        if states[url] == "open":
+            metrics.FEED_SKIPS.inc(url)
+    if len(polled) < len(urls):
+        logger.info(f"🔌 Пропущено отключенных лент: {len(urls) - len(polled)}")
 
-def check_filter_match(text, filter_name):
-    """Проверка соответствия текста фильтру с использованием синонимов"""
-    text_lower = text.lower()
+    results = await asyncio.gather(*(fetch_rss_entries(url, validators, probe=states[url] == "half_open") for url in polled))
+    await feed_breaker.save()
 
-    if filter_name.lower() in text_lower:
-        return True
+    for url, entries in zip(polled, results):
+        if entries is None:
+            logger.warning(f"⚠️ Не удалось получить новости из {url}")
+        elif entries:
+            logger.info(f"✅ Получено {len(entries)} новостей из {url}")
+    feed_entries = dict.fromkeys(urls)
+    feed_entries.update(zip(polled, results))
+    return feed_entries
+
+
+async def send_media(bot, chat_id, kind, url, message):
+    """Отправка фото или видео по file_id из кэша либо по URL с сохранением file_id"""
+    send = bot.send_video if kind == "video" else bot.send_photo
+    file_id = media_cache.get(url)
+    if file_id is None:
+        # По URL файл загружает только один канал, остальные дожидаются file_id
+        try:
+            async with media_cache.lock(url):
+                file_id = media_cache.get(url)
+                if file_id is None:
+                    metrics.MEDIA_SENDS.inc("url")
+                    result = await send(chat_id, url, caption=message, parse_mode=ParseMode.HTML)
+                    uploaded = result.video if kind == "video" else (result.photo[-1] if result.photo else None)
+                    if uploaded:
+                        media_cache.store(url, kind, uploaded.file_id)
+                    return result
+        finally:
+            media_cache.release(url)
+    metrics.MEDIA_SENDS.inc("file_id")
+    return await send(chat_id, file_id, caption=message, parse_mode=ParseMode.HTML)
+
+
+def batch_window(filter_name):
+    """Окно накопления новостей канала в секундах (0 - отправка сразу)"""
+    return CHANNELS[filter_name].get("batch_window", 0)
+
+
+def format_news(title, summary, link, summary_limit):
+    """Текст новости для parse_mode=HTML"""
+    if len(summary) > summary_limit:
+        summary = summary[:summary_limit] + "..."
+    # После очистки сущности раскрыты, поэтому для parse_mode=HTML экранируем заново
+    return (
+        f"📰 <b>{html.escape(title, quote=False)}</b>\n\n"
+        f"{html.escape(summary, quote=False)}\n\n"
+        f"🔗 <a href='{html.escape(link)}'>Подробнее</a>"
+    )
 
-    if filter_name in SYNONYMS:
-        for synonym in SYNONYMS[filter_name]:
-            if synonym in text_lower:
-                return True
 
-    return False
+async def send_album(bot, filter_name, items):
+    """Отправка новостей с медиа одним альбомом; items - (message, photo_url, video_url)
 
+    Если Telegram не принял альбом, новости отправляются дайджестом без медиа.
+    """
+    chat_id = CHANNELS[filter_name]['chat_id']
+    media = []
+    for message, photo_url, video_url in items:
+        kind, url = ("video", video_url) if video_url else ("photo", photo_url)
+        file_id = media_cache.get(url)
+        metrics.MEDIA_SENDS.inc("file_id" if file_id else "url")
+        media_class = InputMediaVideo if kind == "video" else InputMediaPhoto
+        media.append(media_class(file_id or url, caption=message, parse_mode=ParseMode.HTML))
 
-def extract_media_from_entry(entry):
-    """Извлечение медиа (фото и видео) из RSS записи"""
-    photo_url = None
-    video_url = None
+    try:
+        messages = await bot.send_media_group(chat_id, media)
+    except BadRequest as e:
+        logger.warning(f"🖼️ Не удалось отправить альбом в канал {filter_name}: {e}, отправляем дайджест")
+        return await send_digest(bot, filter_name, [message for message, *_ in items])
+
+    for (_, photo_url, video_url), sent in zip(items, messages):
+        kind, url = ("video", video_url) if video_url else ("photo", photo_url)
+        uploaded = sent.video if kind == "video" else (sent.photo[-1] if sent.photo else None)
+        if uploaded and media_cache.get(url) is None:
+            media_cache.store(url, kind, uploaded.file_id)
+    metrics.GROUPED_NEWS.inc("album", amount=len(items))
+    logger.info(f"🖼️ Отправлен альбом из {len(items)} новостей в канал {filter_name}")
+    return messages
+
+
+def digest_texts(messages):
+    """Тексты дайджеста; если новости не помещаются в MESSAGE_LIMIT, он делится на части"""
+    parts, part, length = [], [], DIGEST_HEADER_RESERVE
+    for message in messages:
+        if part and length + len(message) + 2 > MESSAGE_LIMIT:
+            parts.append(part)
+            part, length = [], DIGEST_HEADER_RESERVE
+        part.append(message)
+        length += len(message) + 2
+    parts.append(part)
+    return [f"🗞️ <b>Подборка новостей: {len(part)}</b>\n\n" + "\n\n".join(part) for part in parts]
+
+
+async def send_digest(bot, filter_name, messages):
+    """Отправка нескольких новостей одним сообщением-дайджестом"""
+    chat_id = CHANNELS[filter_name]['chat_id']
+    result = None
+    for text in digest_texts(messages):
+        result = await bot.send_message(
+            chat_id=chat_id,
+            text=text,
+            parse_mode=ParseMode.HTML,
+            disable_web_page_preview=True
+        )
+    metrics.GROUPED_NEWS.inc("digest", amount=len(messages))
+    logger.info(f"🗞️ Отправлен дайджест из {len(messages)} новостей в канал {filter_name}")
+    return result
 
-    # Проверяем медиа контент
-    if hasattr(entry, 'media_content'):
-        for media in entry.media_content:
-            if hasattr(media, 'type'):
-                if 'image' in media.type:
-                    photo_url = media.get('url')
-                elif 'video' in media.type:
-                    video_url = media.get('url')
 
-    # Проверяем вложения
-    if hasattr(entry, 'enclosures'):
-        for enclosure in entry.enclosures:
-            if hasattr(enclosure, 'type'):
-                if 'image' in enclosure.type:
-                    photo_url = enclosure.get('url')
-                elif 'video' in enclosure.type:
-                    video_url = enclosure.get('url')
+async def send_to_channel(bot, filter_name, message, photo_url=None, video_url=None):
+    """Отправка одной новости в канал категории"""
+    chat_id = CHANNELS[filter_name]['chat_id']
+    if video_url or photo_url:
+        kind, url = ("video", video_url) if video_url else ("photo", photo_url)
+        try:
+            result = await send_media(bot, chat_id, kind, url, message)
+            if kind == "video":
+                logger.info(f"📹 Отправлено видео в канал {filter_name}")
+            else:
+                logger.info(f"📸 Отправлено фото в канал {filter_name}")
+            return result
+        except BadRequest as e:
+            # Telegram не смог получить файл: больше его не используем и отправляем текст
+            logger.warning(f"🖼️ Не удалось отправить медиа {url}: {e}, отправляем текст")
+            media_cache.forget(url)
+
+    # Отправляем просто текст
+    result = await bot.send_message(
+        chat_id=chat_id,
+        text=message,
+        parse_mode=ParseMode.HTML,
+        disable_web_page_preview=True
+    )
+    logger.info(f"📝 Отправлен текст в канал {filter_name}")
+    return result
 
-    # Проверяем дополнительные поля
-    if not photo_url and hasattr(entry, 'links'):
-        for link in entry.links:
-            if hasattr(link, 'type') and 'image' in link.type:
-                photo_url = link.get('href')
 
-    return photo_url, video_url
+async def send_direct(bot, chat_id, jobs):
+    """Личное сообщение подписчику: одна новость - с медиа, несколько - дайджестом
+
+    Ошибки недоступного чата передаются вызывающему, чтобы отключить подписчика.
+    """
+    if len(jobs) > 1:
+        result = None
+        for text in digest_texts([job.short_message for job in jobs]):
+            result = await bot.send_message(chat_id=chat_id, text=text, parse_mode=ParseMode.HTML,
+                                            disable_web_page_preview=True)
+        return result
+
+    job = jobs[0]
+    kind, url = ("video", job.video_url) if job.video_url else ("photo", job.photo_url)
+    if url and not media_cache.rejected(url):
+        try:
+            return await send_media(bot, chat_id, kind, url, job.message)
+        except BadRequest as e:
+            if is_chat_gone(e):
+                raise
+            logger.warning(f"🖼️ Не удалось отправить медиа {url}: {e}, отправляем текст")
+            media_cache.forget(url)
+    return await bot.send_message(chat_id=chat_id, text=job.message, parse_mode=ParseMode.HTML,
+                                  disable_web_page_preview=True)
 
 
 async def send_news_to_channels(application, entries):
-    """Отправка новостей в каналы с поддержкой фото и видео"""
-    sent_count = 0
-
-    for entry in entries:
-        link = entry.get('link', '')
-        title = entry.get('title', '')
-        summary = entry.get('summary', '')
-        published = entry.get('published', '')
-
-        if not link or not title:
-            continue
-
-        if is_news_sent(link):
-            continue
-
-        clean_title = clean_html(title)
-        clean_summary = clean_html(summary)
+    """Постановка новых новостей в очередь отправки outbox и в личную рассылку
+
+    entries - итерируемые записи NewsItem. Возвращает число поставленных
+    в очередь отправок (новость x канал) и новостей для личной рассылки, а
+    также список записанных новостей (ссылка, отпечаток или None). Записи
+    в базу идут в пакет вызывающего, поэтому кэши в памяти пополняет
+    remember_sent() после его фиксации: иначе при ошибке фиксации новости
+    считались бы отправленными и больше не разбирались.
+    """
+    # Проверяем дубли сразу для всего пакета: сначала в памяти, затем одним запросом к базе
+    candidates = {}
+    for item in entries:
+        if item.link and item.title:
+            candidates.setdefault(item.link, item)
+    new_links = await sent_links.filter_unsent(candidates)
+    near_duplicates.expire()
+    # Отпечатки новостей этого пакета: пересказы внутри пакета тоже пропускаются
+    batch_fingerprints = NearDuplicateIndex(NEWS_RETENTION_DAYS)
+
+    recorded = []
+    stories = []
+    for link in new_links:
+        item = candidates[link]
 
         max_summary_length = 1500
-        if len(clean_summary) > max_summary_length:
-            clean_summary = clean_summary[:max_summary_length] + "..."
-
-        message = (
-            f"📰 <b>{clean_title}</b>\n\n"
-            f"{clean_summary}\n\n"
-            f"🔗 <a href='{link}'>Подробнее</a>"
-        )
+        with metrics.CLEAN_HTML_SECONDS.time():
+            clean_title = clean_html(item.title)
+            clean_summary = clean_html(item.summary, limit=max_summary_length)
+
+        message = format_news(clean_title, clean_summary, link, max_summary_length)
+
+        full_text = f"{clean_title} {clean_summary}"
+
+        # Пересказ уже отправленной истории из другой ленты не отправляем
+        fingerprint = simhash(full_text) if NEAR_DUPLICATE_CHECK else None
+        if fingerprint is not None:
+            with metrics.SIMILARITY_LOOKUP_SECONDS.time():
+                duplicate_of = near_duplicates.find(fingerprint)
+                if duplicate_of is None:
+                    duplicate_of = batch_fingerprints.find(fingerprint)
+            if duplicate_of is not None:
+                logger.info(f"♻️ Пропущен пересказ уже отправленной новости: {clean_title}")
+                metrics.DEDUP_HITS.inc("similar")
+                await database.mark_news_as_sent(link, item.title, item.published, fingerprint, item.published_ts)
+                recorded.append((link, None))
+                continue
+            batch_fingerprints.add(fingerprint)
+
+        with metrics.CLASSIFY_SECONDS.time():
+            item.categories = category_matcher.match_mask(full_text)
+        categories = category_matcher.categories_for_mask(item.categories)
+
+        # Для каналов с накоплением и личной рассылки новость сокращается, чтобы поместиться в дайджест
+        if DIRECT_DELIVERY or any(batch_window(filter_name) for filter_name in categories):
+            short_message = format_news(clean_title, clean_summary, link, DIGEST_SUMMARY_LENGTH)
+        else:
+            short_message = message
+        stories.append((item, fingerprint, message, short_message, categories))
+
+    # Адреса медиа проверяются заранее и параллельно: недоступные заменяются текстом
+    media = [(url, kind) for item, *_, categories in stories if categories
+             for url, kind in ((item.video_url, "video"), (item.photo_url, "photo")) if url]
+    unusable_media = await media_cache.prepare(feed_fetcher, media) if media else set()
+
+    # Новость и ее отправки во все каналы сохраняются в одной транзакции пакета,
+    # доставкой занимается outbox, поэтому после перезапуска ничего не теряется и не дублируется
+    queued = []
+    direct = []
+    now = time.time()
+    for item, fingerprint, message, short_message, categories in stories:
+        photo_url = None if item.photo_url in unusable_media else item.photo_url
+        video_url = None if item.video_url in unusable_media else item.video_url
+        if DIRECT_DELIVERY and item.categories:
+            direct.append((item.link, item.categories, message, short_message, photo_url, video_url))
+        for filter_name in categories:
+            window = batch_window(filter_name)
+            if window:
+                # Новости одного окна становятся доступны для отправки одновременно, в его конце
+                queued.append((item.link, CHANNELS[filter_name]['chat_id'], filter_name, short_message,
+                               photo_url, video_url, math.ceil(now / window) * window))
+            else:
+                queued.append((item.link, CHANNELS[filter_name]['chat_id'], filter_name, message,
+                               photo_url, video_url, None))
+        # Новость без подходящих каналов тоже запоминаем, чтобы не разбирать ее повторно
+        await database.mark_news_as_sent(item.link, item.title, item.published, fingerprint, item.published_ts)
+        recorded.append((item.link, fingerprint))
+
+    await database.enqueue_outbox(queued)
+    if direct:
+        await database.enqueue_direct_jobs(direct)
+    return len(queued) + len(direct), recorded
+
+
+def remember_sent(recorded):
+    """Пополнение кэшей дублей записанными новостями (после фиксации транзакции)"""
+    for link, fingerprint in recorded:
+        sent_links.add(link)
+        if fingerprint is not None:
+            near_duplicates.add(fingerprint)
+
+
+def outbox_send(bot, row):
+    """Функция отправки для строки outbox"""
+    _, _, filter_name, message, photo_url, video_url, _ = row
+    return partial(send_to_channel, bot, filter_name, message, photo_url, video_url)
+
+
+def group_outbox_rows(chat_id, rows):
+    """Разбиение отправок канала на альбомы, дайджесты и одиночные сообщения
+
+    Группируются только каналы с batch_window: новости с медиа - в альбомы
+    до ALBUM_SIZE штук, текстовые - в дайджесты не длиннее MESSAGE_LIMIT.
+    """
+    if not batch_window(rows[0][2]):
+        return [[row] for row in rows]
+
+    media_rows = [row for row in rows if row[4] or row[5]]
+    groups = [media_rows[start:start + ALBUM_SIZE] for start in range(0, len(media_rows), ALBUM_SIZE)]
+    digest, length = [], DIGEST_HEADER_RESERVE
+    for row in rows:
+        if row[4] or row[5]:
+            continue
+        # Длина считается по HTML-разметке, а Telegram считает видимый текст, поэтому с запасом
+        size = len(row[3]) + 2
+        if digest and length + size > MESSAGE_LIMIT:
+            groups.append(digest)
+            digest, length = [], DIGEST_HEADER_RESERVE
+        digest.append(row)
+        length += size
+    if digest:
+        groups.append(digest)
+    return groups
+
+
+def outbox_group_send(bot, rows):
+    """Функция отправки для группы строк outbox: альбом или дайджест"""
+    filter_name = rows[0][2]
+    if rows[0][4] or rows[0][5]:
+        return partial(send_album, bot, filter_name, [row[3:6] for row in rows])
+    return partial(send_digest, bot, filter_name, [row[3] for row in rows])
+
+
+async def outbox_committed(delivered):
+    """Записи, сохраняемые вместе с результатами отправки"""
+    await media_cache.save()
+    if delivered:
+        await database.update_stats(news_count=delivered)
+
+
+async def direct_committed(sent):
+    """Записи, сохраняемые вместе с прогрессом личной рассылки"""
+    await media_cache.save()
+
+
+@profiler.profiled("feeds")
+async def process_feeds(application, urls):
+    """Проверка новостей в указанных лентах и отправка новых в каналы
+
+    Возвращает число новых записей по каждой ленте (None - лента недоступна).
+    """
+    if NEAR_DUPLICATE_CHECK and role == "ingest":
+        # Пересказы могли отправить другие процессы опроса
+        await near_duplicates.refresh()
+
+    # Все записи цикла сохраняются одной транзакцией
+    validators = []
+    async with database.batch():
+        feed_entries = await fetch_all_rss_entries(urls, validators)
+        new_counts = {
+            url: None if items is None else sum(1 for item in items if item.link not in sent_links)
+            for url, items in feed_entries.items()
+        }
+
+        has_entries = any(feed_entries.values())
+        # Записи всех лент передаются одним генератором, без промежуточного общего списка
+        entries = (item for items in feed_entries.values() if items for item in items)
+        queued_count, recorded = await send_news_to_channels(application, entries) if has_entries else (0, [])
+        # Валидаторы сохраняются после записей о новостях и в той же транзакции
+        await database.save_feed_caches(validators)
+    remember_sent(recorded)
+    if queued_count > 0:
+        if outbox is not None:
+            outbox.wake()
+        if direct_fanout is not None:
+            direct_fanout.wake()
+        logger.info(f"📬 В очередь поставлено {queued_count} отправок")
+    elif has_entries:
+        logger.info("ℹ️ Новых новостей не найдено")
+    else:
+        logger.info("ℹ️ Ленты не изменились или недоступны")
 
-        # Извлекаем медиа (фото и видео)
-        photo_url, video_url = extract_media_from_entry(entry)
-
-        full_text = f"{clean_title} {clean_summary}".lower()
-
-        for filter_name, channel_info in CHANNELS.items():
-            if check_filter_match(full_text, filter_name):
-                try:
-                    if video_url:
-                        # Отправляем видео с описанием
-                        await application.bot.send_video(
-                            chat_id=channel_info['chat_id'],
-                            video=video_url,
-                            caption=message,
-                            parse_mode=ParseMode.HTML
-                        )
-                        logger.info(f"📹 Отправлено видео в канал {filter_name}")
-                    elif photo_url:
-                        # Отправляем фото с описанием
-                        await application.bot.send_photo(
-                            chat_id=channel_info['chat_id'],
-                            photo=photo_url,
-                            caption=message,
-                            parse_mode=ParseMode.HTML
-                        )
-                        logger.info(f"📸 Отправлено фото в канал {filter_name}")
-                    else:
-                        # Отправляем просто текст
-                        await application.bot.send_message(
-                            chat_id=channel_info['chat_id'],
-                            text=message,
-                            parse_mode=ParseMode.HTML,
-                            disable_web_page_preview=True
-                        )
-                        logger.info(f"📝 Отправлен текст в канал {filter_name}")
-
-                    sent_count += 1
-                    await asyncio.sleep(1)
-
-                except Exception as e:
-                    logger.error(f"❌ Ошибка отправки в канал {channel_info['chat_id']}: {e}")
-
-        if sent_count > 0:
-            mark_news_as_sent(link, title, published)
-
-    return sent_count
+    return new_counts
 
 
 async def news_checker_job(context: ContextTypes.DEFAULT_TYPE):
@@ -635,17 +937,7 @@ async def news_checker_job(context: ContextTypes.DEFAULT_TYPE):
     logger.info("🔍 Проверка новых новостей...")
 
     try:
-        entries = await fetch_all_rss_entries(RSS_FEED_URLS)
-        if entries:
-            sent_count = await send_news_to_channels(context.application, entries)
-            if sent_count > 0:
-                update_stats(news_count=sent_count)
-                logger.info(f"✅ Отправлено {sent_count} новых новостей")
-            else:
-                logger.info("ℹ️ Новых новостей не найдено")
-        else:
-            logger.warning("⚠️ Не удалось получить новости из RSS-каналов")
-
+        await process_feeds(context.application, await database.get_feed_urls())
     except Exception as e:
         logger.error(f"❌ Ошибка в news_checker_job: {e}")
 
@@ -653,48 +945,202 @@ async def news_checker_job(context: ContextTypes.DEFAULT_TYPE):
 async def cleanup_job(context: ContextTypes.DEFAULT_TYPE):
     """Периодическая очистка старых новостей"""
     logger.info("🧹 Запуск автоматической очистка старых новостей...")
-    deleted_count = cleanup_old_news()
+    deleted_count = await database.cleanup_old_news(NEWS_RETENTION_DAYS)
     if deleted_count > 0:
         logger.info(f"✅ Автоматически удалено {deleted_count} старых новостей")
 
 
+async def start_ingest(application=None):
+    """Запуск опроса лент: загрузка кэшей дублей и планировщика"""
+    global feed_scheduler, parse_pool
+    if PARSE_PROCESSES:
+        parse_pool = FeedParsePool(PARSE_PROCESSES, warmup=PARSE_WARMUP)
+        await parse_pool.start()
+    await sent_links.load()
+    if NEAR_DUPLICATE_CHECK:
+        await near_duplicates.load()
+
+    if ADAPTIVE_SCHEDULER or application is None:
+        feed_scheduler = FeedScheduler(partial(process_feeds, application), CHECK_INTERVAL, owner=WORKER_ID,
+                                       breaker=feed_breaker)
+        await feed_scheduler.load(RSS_FEED_URLS)
+        feed_scheduler.start()
+    else:
+        await database.add_feeds(RSS_FEED_URLS, CHECK_INTERVAL)
+        application.job_queue.run_repeating(news_checker_job, interval=CHECK_INTERVAL, first=10)
+    logger.info(f"📡 Мониторинг RSS-каналов: {len(await database.get_feed_urls())}")
+
+
+async def start_delivery(bot):
+    """Запуск доставки из очереди outbox и личной рассылки"""
+    global outbox, direct_fanout
+    # Доставка продолжается с отправок, не завершенных до остановки
+    outbox = Outbox(channel_dispatcher, partial(outbox_send, bot), on_commit=outbox_committed,
+                    owner=WORKER_ID, max_chats=DELIVER_MAX_CHATS,
+                    group=group_outbox_rows, make_group_send=partial(outbox_group_send, bot))
+    outbox.start()
+    pending = (await database.get_outbox_counts()).get("pending", 0)
+    if pending:
+        logger.info(f"📬 В очереди доставки {pending} отправок")
+
+    if DIRECT_DELIVERY:
+        # Подписчики загружаются при первом проходе рассылки (в режиме all - уже загружены командами)
+        direct_fanout = DirectFanout(subscriber_cache, partial(send_direct, bot), telegram_bucket, owner=WORKER_ID,
+                                     on_commit=direct_committed)
+        direct_fanout.start()
+        logger.info(f"📨 Личная рассылка включена, ожидают новостей: {await database.get_direct_pending_count()}")
+
+
+async def start_commands():
+    """Подготовка обработчиков команд: подписчики в памяти"""
+    await subscriber_cache.load()
+    active_subscribers = subscriber_cache.active_count
+    await database.update_stats(subscribers_count=active_subscribers)
+    logger.info(f"📊 Активных подписчиков: {active_subscribers}")
+
+
+async def start_metrics():
+    global metrics_server
+    if METRICS_PORT:
+        metrics_server = await metrics.start_metrics_server(METRICS_HOST, METRICS_PORT)
+
+
+async def shutdown_services():
+    """Остановка запущенных служб и закрытие соединений"""
+    if feed_scheduler is not None:
+        await feed_scheduler.stop()
+    if metrics_server is not None:
+        metrics_server.close()
+    await channel_dispatcher.close()
+    if outbox is not None:
+        await outbox.stop()
+    if direct_fanout is not None:
+        await direct_fanout.stop()
+    if parse_pool is not None:
+        parse_pool.close()
+    await feed_fetcher.close()
+    await database.close()
+
+
+async def post_init(application: Application):
+    """Подготовка ресурсов перед запуском бота"""
+    await database.connect(DATABASE_FILE)
+    # Подписчики загружаются первыми: по ним идет личная рассылка
+    await start_commands()
+    if role == "all":
+        await start_ingest(application)
+        await start_delivery(application.bot)
+    await start_metrics()
+    install_profile_signal()
+
+
+async def post_shutdown(application: Application):
+    """Освобождение ресурсов при остановке бота"""
+    await shutdown_services()
+
+
+async def run_worker(worker_role):
+    """Процесс опроса лент (ingest) или доставки (deliver) без приема команд"""
+    await database.connect(DATABASE_FILE)
+    bot = None
+    try:
+        if worker_role == "ingest":
+            await start_ingest()
+        else:
+            bot = Bot(TOKEN)
+            await bot.initialize()
+            await start_delivery(bot)
+        await start_metrics()
+        install_profile_signal()
+        logger.info(f"🚀 Процесс {worker_role} ({WORKER_ID}) запущен")
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+        await stop.wait()
+        logger.info(f"🛑 Остановка процесса {worker_role}...")
+    finally:
+        await shutdown_services()
+        if bot is not None:
+            await bot.shutdown()
+
+
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик ошибок"""
     logger.error(f"Ошибка при обработке обновления: {context.error}")
 
 
-def main():
-    """Основная функция"""
-    init_db()
-
-    application = Application.builder().token(TOKEN).build()
+def add_handlers(application):
+    """Регистрация обработчиков команд и кнопок"""
     application.add_error_handler(error_handler)
-
-    # Добавляем обработчики
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("subscribe", subscribe_command))
-    application.add_handler(CommandHandler("unsubscribe", unsubscribe))
-    application.add_handler(CommandHandler("myfilters", my_filters))
-    application.add_handler(CommandHandler("filters", filters_list))
-    application.add_handler(CommandHandler("stats", stats))
-    application.add_handler(CommandHandler("cleanup", cleanup_command))
-    application.add_handler(CommandHandler("help", help_command))
+    # Обработчики профилируются командой /profile handlers
+    profiled = profiler.profiled("handlers")
+
+    application.add_handler(CommandHandler("start", profiled(start)))
+    application.add_handler(CommandHandler("subscribe", profiled(subscribe_command)))
+    application.add_handler(CommandHandler("unsubscribe", profiled(unsubscribe)))
+    application.add_handler(CommandHandler("myfilters", profiled(my_filters)))
+    application.add_handler(CommandHandler("filters", profiled(filters_list)))
+    application.add_handler(CommandHandler("stats", profiled(stats)))
+    application.add_handler(CommandHandler("cleanup", profiled(cleanup_command)))
+    application.add_handler(CommandHandler("help", profiled(help_command)))
+    application.add_handler(CommandHandler("profile", profile_command))
 
     # Обработчик callback-кнопок
-    application.add_handler(CallbackQueryHandler(handle_callback))
+    application.add_handler(CallbackQueryHandler(profiled(handle_callback)))
+
+
+def setup_logging():
+    """Логирование в bot.log и консоль (только в запущенном боте, не при импорте модуля)"""
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO,
+        handlers=[
+            logging.FileHandler("bot.log", encoding="utf-8"),
+            logging.StreamHandler()
+        ]
+    )
 
-    update_stats(subscribers_count=len(get_active_subscribers()))
 
-    application.job_queue.run_repeating(news_checker_job, interval=CHECK_INTERVAL, first=10)
+def main():
+    """Основная функция"""
+    global role
+    setup_logging()
+    parser = argparse.ArgumentParser(description="Telegram-бот новостей из RSS")
+    parser.add_argument(
+        "--role", choices=ROLES, default="all",
+        help="ingest - опрос лент, deliver - отправка из очереди, commands - команды бота, all - все сразу",
+    )
+    parser.add_argument("--webhook", action="store_true",
+                        help="принимать обновления через вебхук WEBHOOK_URL вместо long polling")
+    args = parser.parse_args()
+    role = args.role
+    if role in ("ingest", "deliver"):
+        asyncio.run(run_worker(role))
+        return
+    if args.webhook and not WEBHOOK_URL:
+        parser.error("для --webhook нужно задать WEBHOOK_URL")
+    if args.webhook and not WEBHOOK_SECRET:
+        parser.error("для --webhook нужно задать WEBHOOK_SECRET")
+
+    builder = Application.builder().token(TOKEN).post_init(post_init).post_shutdown(post_shutdown)
+    if args.webhook:
+        # Обновления приходят параллельно, поэтому и обрабатываются параллельно (по порядку внутри чата)
+        builder = builder.updater(None).concurrent_updates(ChatOrderedUpdateProcessor(WEBHOOK_CONCURRENCY))
+    application = builder.build()
+    add_handlers(application)
+
     application.job_queue.run_repeating(cleanup_job, interval=CLEANUP_INTERVAL, first=60)
 
-    logger.info("🚀 Бот запущен и готов к работе!")
-    logger.info(f"📊 Активных подписчиков: {len(get_active_subscribers())}")
-    logger.info(f"📡 Мониторинг RSS-каналов: {len(RSS_FEED_URLS)}")
+    logger.info(f"🚀 Бот запущен и готов к работе! Роль: {role}")
     logger.info(f"🧹 Очистка старых новостей каждые: {CLEANUP_INTERVAL / 3600} часов")
     logger.info(f"🗑️ Хранение новостей: {NEWS_RETENTION_DAYS} дней")
 
-    application.run_polling()
+    if args.webhook:
+        asyncio.run(run_webhook(application, WEBHOOK_URL, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SECRET))
+    else:
+        application.run_polling()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,128 @@
+import logging
+import random
+
+import database
+
+logger = logging.getLogger(__name__)
+
+FAILURE_THRESHOLD = 3  # ошибок подряд, после которых лента отключается
+BASE_OPEN_SECONDS = 600  # первое отключение ленты
+MAX_OPEN_SECONDS = 12 * 3600  # предел роста срока отключения
+PROBE_DEADLINE = 10.0  # секунд на пробный запрос к отключенной ленте
+MAX_BACKOFF_STEPS = 16  # удвоений срока, дальше рост не считается
+ERROR_TEXT_LIMIT = 200  # символов текста ошибки, сохраняемых в базе
+
+
+def describe_error(error):
+    """Краткий текст ошибки (у таймаутов asyncio и httpx он бывает пустым)"""
+    text = str(error) or type(error).__name__
+    return text[:ERROR_TEXT_LIMIT]
+
+
+class FeedHealth:
+    """Состояние доступности одной ленты"""
+
+    __slots__ = ("url", "failures", "open_until", "last_error", "last_success_at", "last_failure_at")
+
+    def __init__(self, url, failures=0, open_until=None, last_error=None, last_success_at=None,
+                 last_failure_at=None):
+        self.url = url
+        self.failures = failures
+        self.open_until = open_until
+        self.last_error = last_error
+        self.last_success_at = last_success_at
+        self.last_failure_at = last_failure_at
+
+    def state(self, now, threshold=FAILURE_THRESHOLD):
+        """closed - лента опрашивается, open - отключена, half_open - ждет пробного запроса"""
+        if self.failures < threshold:
+            return "closed"
+        if self.open_until is not None and self.open_until > now:
+            return "open"
+        return "half_open"
+
+    def as_row(self):
+        return (self.failures, self.open_until, self.last_error, self.last_success_at, self.last_failure_at,
+                self.url)
+
+
+class FeedBreaker:
+    """Автоматический выключатель для недоступных лент
+
+    После threshold ошибок подряд лента отключается на срок, который
+    удваивается с каждой следующей ошибкой (от base_seconds до
+    max_seconds) со случайным разбросом, чтобы отключенные одновременно
+    ленты не возвращались одной волной. Когда срок истекает, ленту
+    опрашивают один раз (пробный запрос): успех возвращает ее в работу,
+    ошибка отключает на следующий, более долгий срок.
+
+    Состояние хранится в таблице feeds. Перед циклом опроса вызывается
+    load(urls): ленты могли опрашивать другие процессы. После цикла
+    изменения сохраняются вызовом save().
+    """
+
+    def __init__(self, threshold=FAILURE_THRESHOLD, base_seconds=BASE_OPEN_SECONDS,
+                 max_seconds=MAX_OPEN_SECONDS):
+        self.threshold = threshold
+        self.base_seconds = base_seconds
+        self.max_seconds = max_seconds
+        self._health = {}
+        self._unsaved = {}
+
+    def get(self, url):
+        health = self._health.get(url)
+        if health is None:
+            health = self._health[url] = FeedHealth(url)
+        return health
+
+    async def load(self, urls):
+        """Чтение состояния лент из базы"""
+        for url, *fields in await database.get_feed_health(urls):
+            if url not in self._unsaved:
+                self._health[url] = FeedHealth(url, *fields)
+
+    def state(self, url, now):
+        """Состояние ленты перед опросом: closed, open (не опрашивать) или half_open (пробный запрос)"""
+        state = self.get(url).state(now, self.threshold)
+        if state == "half_open":
+            logger.info(f"🩺 Пробный запрос к отключенной ленте: {url}")
+        return state
+
+    def open_seconds(self, failures):
+        """Срок отключения после failures ошибок подряд, с разбросом от половины до полного"""
+        steps = min(failures - self.threshold, MAX_BACKOFF_STEPS)
+        seconds = min(self.max_seconds, self.base_seconds * 2 ** steps)
+        return seconds * random.uniform(0.5, 1.0)
+
+    def success(self, url, now):
+        health = self.get(url)
+        if health.failures >= self.threshold:
+            logger.info(f"✅ Лента снова доступна после {health.failures} ошибок: {url}")
+        health.failures = 0
+        health.open_until = None
+        health.last_success_at = now
+        self._unsaved[url] = health
+
+    def failure(self, url, error, now):
+        health = self.get(url)
+        health.failures += 1
+        health.last_error = describe_error(error)
+        health.last_failure_at = now
+        if health.failures >= self.threshold:
+            health.open_until = now + self.open_seconds(health.failures)
+            logger.warning(f"🔌 Лента отключена на {(health.open_until - now) / 60:.0f} мин после "
+                           f"{health.failures} ошибок подряд ({health.last_error}): {url}")
+        self._unsaved[url] = health
+
+    def retry_at(self, url):
+        """Время, раньше которого отключенную ленту не опрашивать (None - лента в работе)"""
+        health = self._health.get(url)
+        if health is None or health.failures < self.threshold:
+            return None
+        return health.open_until
+
+    async def save(self):
+        """Сохранение изменившихся состояний в базе"""
+        rows, self._unsaved = [health.as_row() for health in self._unsaved.values()], {}
+        if rows:
+            await database.update_feed_health(rows)
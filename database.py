@@ -1,144 +1,982 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from functools import wraps
+
 import aiosqlite
-import os
-from datetime import datetime
 
-DATABASE_PATH = "bot_database.db"
+import metrics
+from dates import to_epoch
+from links import link_key
+
+logger = logging.getLogger(__name__)
+
+DATABASE_PATH = "news_bot.db"
+CACHED_STATEMENTS = 256
+SQL_IN_CHUNK = 500  # параметров в одном запросе WHERE ... IN (...)
+CLEANUP_BATCH_SIZE = 500  # строк, удаляемых одной транзакцией
+CLEANUP_BATCH_PAUSE = 0.05  # пауза между транзакциями очистки, секунд
+MIGRATION_BATCH_SIZE = 5000  # строк, обрабатываемых за шаг миграции
+
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA busy_timeout = 5000",
+)
+
+# Долгоживущие соединения: запись идет через writer, чтение через reader.
+# aiosqlite выполняет запросы в отдельном потоке, поэтому цикл событий не блокируется.
+_writer = None
+_reader = None
+
+# Буфер отложенных записей текущей задачи (см. batch())
+_pending_writes: ContextVar = ContextVar("pending_writes", default=None)
+
+# Транзакции на writer не должны перемежаться: фиксация или откат одной
+# иначе затронет записи другой
+_write_lock = asyncio.Lock()
+
+
+def _timed(func):
+    """Учет времени запроса в метрике db_query_seconds с меткой по имени функции"""
+    name = func.__name__.lstrip("_")
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            metrics.DB_QUERY_SECONDS.observe(time.perf_counter() - start, name)
+
+    return wrapper
+
+
+async def _open(path: str) -> aiosqlite.Connection:
+    """Открытие соединения с настройками для WAL"""
+    conn = await aiosqlite.connect(path, cached_statements=CACHED_STATEMENTS)
+    for pragma in PRAGMAS:
+        await conn.execute(pragma)
+    return conn
+
+
+async def connect(path: str = DATABASE_PATH):
+    """Открытие соединений и инициализация схемы"""
+    global _writer, _reader
+    _writer = await _open(path)
+    try:
+        await init_db()
+    except Exception:
+        await _writer.close()
+        _writer = None
+        raise
+    _reader = await _open(path)
+
+
+async def close():
+    """Закрытие соединений"""
+    global _writer, _reader
+    for conn in (_reader, _writer):
+        if conn is not None:
+            await conn.close()
+    _writer = _reader = None
+
+
+async def _write(sql: str, params=()):
+    """Выполнение записи: сразу или в составе текущего пакета"""
+    pending = _pending_writes.get()
+    if pending is not None:
+        pending.append((sql, params))
+        return
+    async with _write_lock:
+        await _writer.execute(sql, params)
+        await _writer.commit()
+
+
+async def _write_many(sql: str, rows):
+    """Выполнение одного запроса для набора строк"""
+    rows = list(rows)
+    if not rows:
+        return
+    pending = _pending_writes.get()
+    if pending is not None:
+        pending.extend((sql, row) for row in rows)
+        return
+    async with _write_lock:
+        await _writer.executemany(sql, rows)
+        await _writer.commit()
+
+
+@asynccontextmanager
+async def batch():
+    """Группировка записей одного цикла в одну транзакцию
+
+    Записи внутри блока копятся в памяти и выполняются одной транзакцией
+    при выходе, поэтому блокировка на запись не удерживается во время
+    сетевых операций. Буфер привязан к текущей задаче asyncio, и записи
+    обработчиков команд, идущие параллельно, в него не попадают. Если блок
+    завершился исключением, накопленные записи отбрасываются; ошибка
+    фиксации передается вызывающему.
+    """
+    if _pending_writes.get() is not None:
+        yield
+        return
+
+    pending = []
+    token = _pending_writes.set(pending)
+    try:
+        yield
+    finally:
+        _pending_writes.reset(token)
+    if pending:
+        await _flush(pending)
+
+
+@_timed
+async def _flush(pending):
+    """Выполнение накопленных записей одной транзакцией"""
+    async with _write_lock:
+        try:
+            # Подряд идущие одинаковые запросы отправляются одним executemany
+            group_sql, group_rows = None, []
+            for sql, params in pending:
+                if sql != group_sql and group_rows:
+                    await _writer.executemany(group_sql, group_rows)
+                    group_rows = []
+                group_sql = sql
+                group_rows.append(params)
+            if group_rows:
+                await _writer.executemany(group_sql, group_rows)
+            await _writer.commit()
+        except Exception:
+            await _writer.rollback()
+            raise
+
+
+def _to_signed64(value):
+    """SQLite хранит INTEGER со знаком, поэтому 64-битные отпечатки сдвигаются в этот диапазон"""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+async def _add_column(table, column, definition):
+    """Добавление столбца, если его еще нет (миграцию можно выполнить повторно)"""
+    async with _writer.execute(f"PRAGMA table_info({table})") as cursor:
+        columns = {row[1] for row in await cursor.fetchall()}
+    if column not in columns:
+        await _writer.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+async def _migrate_epoch_timestamps():
+    """Числовые метки времени и индексы в sent_news
+
+    published_at хранит строку из ленты как есть, поэтому сравнивать ее
+    с датой нельзя. Рядом заводятся published_ts и sent_ts (секунды Unix),
+    по которым работают очистка и загрузка недавних ссылок.
+    """
+    for column in ("published_ts", "sent_ts"):
+        await _add_column("sent_news", column, "REAL")
+
+    last_id = 0
+    while True:
+        async with _writer.execute("""
+            SELECT id, published_at, sent_at FROM sent_news
+            WHERE id > ? ORDER BY id LIMIT ?
+        """, (last_id, MIGRATION_BATCH_SIZE)) as cursor:
+            rows = await cursor.fetchall()
+        if not rows:
+            break
+        await _writer.executemany(
+            "UPDATE sent_news SET published_ts = ?, sent_ts = ? WHERE id = ?",
+            [(to_epoch(published_at), to_epoch(sent_at) or time.time(), row_id)
+             for row_id, published_at, sent_at in rows]
+        )
+        last_id = rows[-1][0]
+
+    await _writer.execute("CREATE INDEX IF NOT EXISTS idx_sent_news_sent_ts ON sent_news (sent_ts)")
+    await _writer.execute("CREATE INDEX IF NOT EXISTS idx_sent_news_published_ts ON sent_news (published_ts)")
+
+
+async def _migrate_simhash():
+    """Отпечатки текста новостей в sent_news для поиска пересказов"""
+    await _add_column("sent_news", "simhash", "INTEGER")
+
+
+async def _migrate_media_cache():
+    """Таблица file_id загруженных в Telegram медиа"""
+    await _writer.execute("""
+        CREATE TABLE IF NOT EXISTS media_cache (
+            url TEXT PRIMARY KEY,
+            kind TEXT,
+            file_id TEXT,
+            stored_at REAL
+        )
+    """)
+    await _writer.execute("CREATE INDEX IF NOT EXISTS idx_media_cache_stored_at ON media_cache (stored_at)")
+
+
+async def _migrate_outbox():
+    """Очередь доставки outbox: строка на каждую пару (новость, канал)"""
+    await _writer.execute("""
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            link TEXT NOT NULL,
+            chat_id TEXT NOT NULL,
+            category TEXT,
+            message TEXT,
+            photo_url TEXT,
+            video_url TEXT,
+            state TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_retry_at REAL NOT NULL,
+            created_at REAL NOT NULL,
+            sent_at REAL,
+            last_error TEXT,
+            UNIQUE (link, chat_id)
+        )
+    """)
+    await _writer.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (state, next_retry_at)")
+    await _writer.execute("CREATE INDEX IF NOT EXISTS idx_outbox_created_at ON outbox (created_at)")
+
+
+async def _migrate_leases():
+    """Аренда лент и чатов для нескольких процессов ingest и deliver"""
+    await _add_column("feeds", "lease_owner", "TEXT")
+    await _add_column("feeds", "lease_until", "REAL")
+    await _writer.execute("""
+        CREATE TABLE IF NOT EXISTS chat_leases (
+            chat_id TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            lease_until REAL NOT NULL
+        )
+    """)
+    await _writer.execute("CREATE INDEX IF NOT EXISTS idx_chat_leases_owner ON chat_leases (owner)")
+
+
+async def _migrate_link_keys():
+    """Ключи канонических ссылок вместо уникального индекса по URL в sent_news
+
+    Таблица пересобирается: уникальным становится 64-битный link_key, а
+    индекс по полному тексту ссылки удаляется. Из новостей с одинаковой
+    канонической ссылкой остается первая.
+    """
+    await _writer.execute("DROP TABLE IF EXISTS sent_news_new")
+    await _writer.execute("""
+        CREATE TABLE sent_news_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            link TEXT,
+            link_key INTEGER NOT NULL UNIQUE,
+            title TEXT,
+            published_at TIMESTAMP,
+            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            published_ts REAL,
+            sent_ts REAL,
+            simhash INTEGER
+        )
+    """)
+    last_id = 0
+    while True:
+        async with _writer.execute("""
+            SELECT id, link, title, published_at, sent_at, published_ts, sent_ts, simhash FROM sent_news
+            WHERE id > ? ORDER BY id LIMIT ?
+        """, (last_id, MIGRATION_BATCH_SIZE)) as cursor:
+            rows = await cursor.fetchall()
+        if not rows:
+            break
+        await _writer.executemany("""
+            INSERT OR IGNORE INTO sent_news_new
+                (id, link, link_key, title, published_at, sent_at, published_ts, sent_ts, simhash)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, [(row_id, link, link_key(link or ""), *rest) for row_id, link, *rest in rows])
+        last_id = rows[-1][0]
+
+    await _writer.execute("DROP TABLE sent_news")
+    await _writer.execute("ALTER TABLE sent_news_new RENAME TO sent_news")
+    await _writer.execute("CREATE INDEX IF NOT EXISTS idx_sent_news_sent_ts ON sent_news (sent_ts)")
+    await _writer.execute("CREATE INDEX IF NOT EXISTS idx_sent_news_published_ts ON sent_news (published_ts)")
+
+
+async def _migrate_direct_jobs():
+    """Задания личной рассылки: строка на новость с курсором по chat_id подписчиков"""
+    await _writer.execute("""
+        CREATE TABLE IF NOT EXISTS direct_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            link TEXT NOT NULL UNIQUE,
+            categories INTEGER NOT NULL,
+            message TEXT,
+            short_message TEXT,
+            photo_url TEXT,
+            video_url TEXT,
+            state TEXT NOT NULL DEFAULT 'pending',
+            cursor INTEGER,
+            delivered INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            finished_at REAL,
+            lease_owner TEXT,
+            lease_until REAL
+        )
+    """)
+    await _writer.execute("CREATE INDEX IF NOT EXISTS idx_direct_jobs_state ON direct_jobs (state, id)")
+    await _writer.execute("CREATE INDEX IF NOT EXISTS idx_direct_jobs_created_at ON direct_jobs (created_at)")
+
+
+async def _migrate_feed_health():
+    """Состояние доступности лент для автоматического выключателя"""
+    await _add_column("feeds", "failures", "INTEGER NOT NULL DEFAULT 0")
+    await _add_column("feeds", "open_until", "REAL")
+    await _add_column("feeds", "last_error", "TEXT")
+    await _add_column("feeds", "last_success_at", "REAL")
+    await _add_column("feeds", "last_failure_at", "REAL")
+
+
+async def _migrate_subscribers_version():
+    """Номер версии подписчиков для сверки кэшей в памяти разных процессов"""
+    await _writer.execute("""
+        CREATE TABLE IF NOT EXISTS subscribers_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    """)
+    await _writer.execute("INSERT OR IGNORE INTO subscribers_version (id, version) VALUES (1, 0)")
+    await _add_column("subscribers", "version", "INTEGER NOT NULL DEFAULT 0")
+    await _writer.execute("CREATE INDEX IF NOT EXISTS idx_subscribers_version ON subscribers (version)")
+    # Любое изменение подписки увеличивает общий номер и помечает им строку подписчика
+    for name, event in (("insert", "INSERT"), ("update", "UPDATE OF filters, is_active")):
+        await _writer.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS subscribers_version_{name} AFTER {event} ON subscribers
+            BEGIN
+                UPDATE subscribers_version SET version = version + 1;
+                UPDATE subscribers SET version = (SELECT version FROM subscribers_version) WHERE id = NEW.id;
+            END
+        """)
+
+
+# Миграции схемы по порядку; номер последней примененной хранится в PRAGMA user_version
+MIGRATIONS = (
+    _migrate_epoch_timestamps,
+    _migrate_simhash,
+    _migrate_media_cache,
+    _migrate_outbox,
+    _migrate_leases,
+    _migrate_link_keys,
+    _migrate_direct_jobs,
+    _migrate_feed_health,
+    _migrate_subscribers_version,
+)
+
+
+async def _migrate():
+    """Применение недостающих миграций схемы
+
+    Каждая миграция вместе с номером версии выполняется в явной транзакции:
+    без BEGIN модуль sqlite3 фиксирует CREATE и ALTER сразу, и прерванная
+    миграция оставила бы схему наполовину измененной.
+    """
+    async with _writer.execute("PRAGMA user_version") as cursor:
+        version = (await cursor.fetchone())[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        try:
+            await _writer.execute("BEGIN IMMEDIATE")
+            await migration()
+            await _writer.execute(f"PRAGMA user_version = {number}")
+            await _writer.commit()
+        except Exception:
+            await _writer.rollback()
+            raise
+        logger.info(f"🗄️ Применена миграция базы №{number}: {migration.__doc__.splitlines()[0]}")
 
 
 async def init_db():
     """Инициализация базы данных"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS subscribers (
-                chat_id INTEGER PRIMARY KEY,
-                username TEXT,
-                first_name TEXT,
-                last_name TEXT,
-                subscribe_date TEXT,
-                filters TEXT
-            )
-        ''')
-
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS sent_entries (
-                entry_id TEXT PRIMARY KEY,
-                title TEXT,
-                link TEXT,
-                sent_date TEXT
-            )
-        ''')
+    await _writer.execute("""
+        CREATE TABLE IF NOT EXISTS subscribers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER UNIQUE,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            filters TEXT,
+            subscribed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_active INTEGER DEFAULT 1
+        )
+    """)
 
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS statistics (
-                id INTEGER PRIMARY KEY,
-                sent_count INTEGER DEFAULT 0,
-                last_update TEXT
-            )
-        ''')
+    await _writer.execute("""
+        CREATE TABLE IF NOT EXISTS sent_news (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            link TEXT UNIQUE,
+            title TEXT,
+            published_at TIMESTAMP,
+            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    await _writer.execute("""
+        CREATE TABLE IF NOT EXISTS stats (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            news_count INTEGER DEFAULT 0,
+            last_check TIMESTAMP,
+            subscribers_count INTEGER DEFAULT 0,
+            last_cleanup TIMESTAMP
+        )
+    """)
+
+    await _writer.execute("""
+        CREATE TABLE IF NOT EXISTS feed_cache (
+            url TEXT PRIMARY KEY,
+            etag TEXT,
+            last_modified TEXT,
+            body_hash TEXT,
+            checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    await _writer.execute("""
+        CREATE TABLE IF NOT EXISTS feeds (
+            url TEXT PRIMARY KEY,
+            enabled INTEGER DEFAULT 1,
+            poll_interval INTEGER,
+            next_poll_at REAL,
+            last_polled_at REAL,
+            items_rate REAL DEFAULT 0,
+            empty_polls INTEGER DEFAULT 0,
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
 
-        # Инициализация статистики
-        await db.execute('''
-            INSERT OR IGNORE INTO statistics (id, sent_count, last_update)
-            VALUES (1, 0, ?)
-        ''', (datetime.now().isoformat(),))
+    async with _writer.execute("SELECT COUNT(*) FROM stats") as cursor:
+        stats_rows = (await cursor.fetchone())[0]
+    if stats_rows == 0:
+        await _writer.execute(
+            "INSERT INTO stats (news_count, last_check, subscribers_count, last_cleanup) VALUES (0, CURRENT_TIMESTAMP, 0, CURRENT_TIMESTAMP)")
 
-        await db.commit()
+    await _writer.commit()
+    await _migrate()
 
 
-async def add_subscriber(chat_id: int, username: str = None, first_name: str = None,
-                         last_name: str = None, filters: str = None) -> bool:
-    """Добавление подписчика"""
+@_timed
+async def add_subscriber(chat_id, username, first_name, last_name, filters):
+    """Добавление или обновление подписчика"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            await db.execute('''
-                INSERT OR REPLACE INTO subscribers 
-                (chat_id, username, first_name, last_name, subscribe_date, filters)
-                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP, ?)
-            ''', (chat_id, username, first_name, last_name, filters))
-            await db.commit()
-            return True
+        await _write("""
+            INSERT OR REPLACE INTO subscribers
+            (chat_id, username, first_name, last_name, filters, is_active)
+            VALUES (?, ?, ?, ?, ?, 1)
+        """, (chat_id, username, first_name, last_name, " ".join(filters)))
+        logger.info(f"Добавлен подписчик: {chat_id} с фильтрами: {filters}")
+        return True
     except Exception as e:
-        print(f"Ошибка добавления подписчика: {e}")
+        logger.error(f"Ошибка при добавлении подписчика: {e}")
         return False
 
 
-async def remove_subscriber(chat_id: int) -> bool:
+@_timed
+async def remove_subscriber(chat_id):
     """Удаление подписчика"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            await db.execute('DELETE FROM subscribers WHERE chat_id = ?', (chat_id,))
-            await db.commit()
-            return True
-    except Exception:
+        await _write("UPDATE subscribers SET is_active = 0 WHERE chat_id = ?", (chat_id,))
+        logger.info(f"Удален подписчик: {chat_id}")
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка при удалении подписчика: {e}")
         return False
 
 
-async def get_all_subscribers():
-    """Получение всех подписчиков с фильтрами"""
-    try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            cursor = await db.execute('SELECT chat_id, username, first_name, last_name, filters FROM subscribers')
-            return await cursor.fetchall()
-    except Exception:
-        return []
+@_timed
+async def get_subscriber_filters(chat_id):
+    """Получение фильтров подписчика"""
+    async with _reader.execute("SELECT filters FROM subscribers WHERE chat_id = ? AND is_active = 1",
+                               (chat_id,)) as cursor:
+        result = await cursor.fetchone()
+    if result and result[0]:
+        return result[0].split()
+    return []
 
 
-async def is_subscriber(chat_id: int) -> bool:
-    """Проверка, является ли пользователь подписчиком"""
+@_timed
+async def get_active_subscribers():
+    """Получение активных подписчиков"""
+    async with _reader.execute("SELECT chat_id, filters FROM subscribers WHERE is_active = 1") as cursor:
+        return await cursor.fetchall()
+
+
+@_timed
+async def get_subscribers_version():
+    """Номер последнего изменения подписчиков (растет при каждой записи в subscribers)"""
+    async with _reader.execute("SELECT version FROM subscribers_version") as cursor:
+        return (await cursor.fetchone())[0]
+
+
+@_timed
+async def get_subscriber_changes(since_version):
+    """Подписчики, измененные после since_version: (chat_id, filters, is_active)"""
+    async with _reader.execute("SELECT chat_id, filters, is_active FROM subscribers WHERE version > ?",
+                               (since_version,)) as cursor:
+        return await cursor.fetchall()
+
+
+@_timed
+async def deactivate_subscribers(chat_ids):
+    """Отключение подписчиков, заблокировавших бота или удаливших аккаунт, одной транзакцией"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            cursor = await db.execute('SELECT 1 FROM subscribers WHERE chat_id = ?', (chat_id,))
-            result = await cursor.fetchone()
-            return result is not None
-    except Exception:
+        await _write_many("UPDATE subscribers SET is_active = 0 WHERE chat_id = ?",
+                          ((chat_id,) for chat_id in chat_ids))
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка при отключении подписчиков: {e}")
         return False
 
 
-async def mark_entry_as_sent(entry_id: str, title: str, link: str) -> bool:
-    """Пометить запись как отправленную"""
+@_timed
+async def find_sent_keys(keys):
+    """Поиск уже отправленных новостей по ключам ссылок (links.link_key) одним запросом"""
+    found = set()
+    keys = list(keys)
+    for start in range(0, len(keys), SQL_IN_CHUNK):
+        chunk = keys[start:start + SQL_IN_CHUNK]
+        placeholders = ",".join("?" * len(chunk))
+        async with _reader.execute(f"SELECT link_key FROM sent_news WHERE link_key IN ({placeholders})",
+                                   chunk) as cursor:
+            found.update(row[0] for row in await cursor.fetchall())
+    return found
+
+
+@_timed
+async def get_recent_sent_keys(max_age_seconds, limit):
+    """Ключи ссылок, отправленных за последние max_age_seconds секунд: (link_key, sent_ts)"""
+    async with _reader.execute("""
+        SELECT link_key, sent_ts FROM (
+            SELECT link_key, sent_ts FROM sent_news
+            WHERE sent_ts >= ?
+            ORDER BY sent_ts DESC
+            LIMIT ?
+        ) ORDER BY sent_ts
+    """, (time.time() - max_age_seconds, limit)) as cursor:
+        return await cursor.fetchall()
+
+
+@_timed
+async def get_recent_fingerprints(max_age_seconds):
+    """Отпечатки новостей, отправленных за последние max_age_seconds секунд: (simhash, sent_ts)"""
+    async with _reader.execute("""
+        SELECT simhash, sent_ts FROM sent_news
+        WHERE sent_ts >= ? AND simhash IS NOT NULL
+        ORDER BY sent_ts
+    """, (time.time() - max_age_seconds,)) as cursor:
+        return [(simhash & ((1 << 64) - 1), sent_ts) for simhash, sent_ts in await cursor.fetchall()]
+
+
+@_timed
+async def mark_news_as_sent(link, title, published_at, simhash=None, published_ts=None):
+    """Пометить новость как отправленную (published_ts вычисляется из published_at, если не передан)"""
+    if published_ts is None:
+        published_ts = to_epoch(published_at)
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            await db.execute('''
-                INSERT OR IGNORE INTO sent_entries (entry_id, title, link, sent_date)
-                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
-            ''', (entry_id, title, link))
-            await db.commit()
-            return True
-    except Exception:
-        return False
+        await _write("""
+            INSERT OR IGNORE INTO sent_news (link, link_key, title, published_at, published_ts, sent_ts, simhash)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (link, link_key(link), title, published_at, published_ts, time.time(),
+              None if simhash is None else _to_signed64(simhash)))
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении отправленной новости: {e}")
+
+
+@_timed
+async def get_feed_cache(url):
+    """Получение сохраненных валидаторов HTTP для ленты"""
+    async with _reader.execute("SELECT etag, last_modified, body_hash FROM feed_cache WHERE url = ?",
+                               (url,)) as cursor:
+        result = await cursor.fetchone()
+    if result:
+        return result
+    return (None, None, None)
 
 
-async def is_entry_sent(entry_id: str) -> bool:
-    """Проверить, была ли запись отправлена"""
+@_timed
+async def save_feed_caches(rows):
+    """Сохранение валидаторов HTTP лент: строки (url, etag, last_modified, body_hash)"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            cursor = await db.execute('SELECT 1 FROM sent_entries WHERE entry_id = ?', (entry_id,))
-            result = await cursor.fetchone()
-            return result is not None
-    except Exception:
-        return False
+        await _write_many("""
+            INSERT OR REPLACE INTO feed_cache (url, etag, last_modified, body_hash, checked_at)
+            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+        """, rows)
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении кэша ленты: {e}")
+
+
+@_timed
+async def get_media_file_ids(urls):
+    """Поиск сохраненных file_id для пакета адресов медиа: словарь url -> file_id"""
+    found = {}
+    urls = list(urls)
+    for start in range(0, len(urls), SQL_IN_CHUNK):
+        chunk = urls[start:start + SQL_IN_CHUNK]
+        placeholders = ",".join("?" * len(chunk))
+        async with _reader.execute(f"SELECT url, file_id FROM media_cache WHERE url IN ({placeholders})",
+                                   chunk) as cursor:
+            found.update(await cursor.fetchall())
+    return found
 
 
-async def increment_sent_count(count: int = 1):
-    """Увеличить счетчик отправленных новостей"""
+@_timed
+async def save_media_file_ids(rows):
+    """Сохранение file_id медиа: строки (url, kind, file_id)"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            await db.execute('''
-                UPDATE statistics 
-                SET sent_count = sent_count + ?, last_update = CURRENT_TIMESTAMP
-                WHERE id = 1
-            ''', (count,))
-            await db.commit()
-    except Exception:
-        pass
+        now = time.time()
+        await _write_many("""
+            INSERT OR REPLACE INTO media_cache (url, kind, file_id, stored_at)
+            VALUES (?, ?, ?, ?)
+        """, ((url, kind, file_id, now) for url, kind, file_id in rows))
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении file_id медиа: {e}")
+
+
+@_timed
+async def enqueue_outbox(rows):
+    """Постановка отправок в очередь
+
+    Строки (link, chat_id, category, message, photo_url, video_url, send_at);
+    send_at - время, раньше которого отправку не забирать (None - сразу).
+    """
+    now = time.time()
+    await _write_many("""
+        INSERT OR IGNORE INTO outbox (link, chat_id, category, message, photo_url, video_url,
+                                      next_retry_at, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, ((*row[:6], row[6] or now, now) for row in rows))
+
+
+@_timed
+async def claim_outbox(owner, now, lease_seconds, max_chats, limit):
+    """Аренда чатов с ожидающими отправками и выборка отправок арендованных чатов
 
+    Каждый чат обслуживает один процесс: он продлевает аренду своих чатов
+    и забирает свободные (или с истекшей арендой), пока их меньше max_chats.
+    Возвращаются строки (id, chat_id, category, message, photo_url, video_url, attempts).
+    """
+    lease_until = now + lease_seconds
+    async with _write_lock:
+        try:
+            await _writer.execute("UPDATE chat_leases SET lease_until = ? WHERE owner = ?", (lease_until, owner))
+            async with _writer.execute("SELECT COUNT(*) FROM chat_leases WHERE owner = ?", (owner,)) as cursor:
+                owned = (await cursor.fetchone())[0]
+            if owned < max_chats:
+                await _writer.execute("""
+                    INSERT INTO chat_leases (chat_id, owner, lease_until)
+                    SELECT DISTINCT outbox.chat_id, ?, ? FROM outbox
+                    LEFT JOIN chat_leases ON chat_leases.chat_id = outbox.chat_id
+                    WHERE outbox.state = 'pending' AND outbox.next_retry_at <= ?
+                      AND (chat_leases.chat_id IS NULL OR chat_leases.lease_until < ?)
+                    LIMIT ?
+                    ON CONFLICT (chat_id) DO UPDATE SET owner = excluded.owner, lease_until = excluded.lease_until
+                """, (owner, lease_until, now, now, max_chats - owned))
+            await _writer.commit()
+        except Exception:
+            await _writer.rollback()
+            raise
 
-async def get_statistics():
-    """Получить статистику"""
+    async with _reader.execute("""
+        SELECT outbox.id, outbox.chat_id, category, message, photo_url, video_url, attempts
+        FROM outbox JOIN chat_leases ON chat_leases.chat_id = outbox.chat_id
+        WHERE outbox.state = 'pending' AND outbox.next_retry_at <= ? AND chat_leases.owner = ?
+        ORDER BY outbox.id
+        LIMIT ?
+    """, (now, owner, limit)) as cursor:
+        return await cursor.fetchall()
+
+
+@_timed
+async def release_chat_leases(owner):
+    """Освобождение чатов, арендованных процессом"""
+    await _write("DELETE FROM chat_leases WHERE owner = ?", (owner,))
+
+
+@_timed
+async def complete_outbox(results):
+    """Сохранение результатов отправки: строки (state, next_retry_at, sent_at, last_error, id)"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            cursor = await db.execute('SELECT sent_count, last_update FROM statistics WHERE id = 1')
-            result = await cursor.fetchone()
-            return result if result else (0, None)
-    except Exception:
-        return (0, None)
+        await _write_many("""
+            UPDATE outbox
+            SET state = ?, attempts = attempts + 1, next_retry_at = COALESCE(?, next_retry_at),
+                sent_at = ?, last_error = ?
+            WHERE id = ?
+        """, results)
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении результатов отправки: {e}")
+
+
+@_timed
+async def get_outbox_counts():
+    """Число отправок в очереди по состояниям"""
+    async with _reader.execute("""
+        SELECT state, COUNT(*) FROM outbox WHERE state IN ('pending', 'failed') GROUP BY state
+    """) as cursor:
+        return dict(await cursor.fetchall())
+
+
+@_timed
+async def enqueue_direct_jobs(rows):
+    """Постановка новостей в личную рассылку
+
+    Строки (link, categories, message, short_message, photo_url, video_url);
+    categories - битовая маска категорий новости.
+    """
+    now = time.time()
+    await _write_many("""
+        INSERT OR IGNORE INTO direct_jobs (link, categories, message, short_message, photo_url, video_url,
+                                           created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, ((*row, now) for row in rows))
+
+
+@_timed
+async def claim_direct_jobs(owner, now, lease_seconds, limit):
+    """Аренда незавершенных заданий личной рассылки, которые не ведет другой процесс
+
+    Возвращает строки (id, categories, message, short_message, photo_url,
+    video_url, cursor) в порядке постановки.
+    """
+    async with _write_lock:
+        try:
+            async with _writer.execute("""
+                UPDATE direct_jobs SET lease_owner = ?, lease_until = ?
+                WHERE id IN (
+                    SELECT id FROM direct_jobs
+                    WHERE state = 'pending' AND (lease_until IS NULL OR lease_until < ? OR lease_owner = ?)
+                    ORDER BY id LIMIT ?
+                )
+                RETURNING id, categories, message, short_message, photo_url, video_url, cursor
+            """, (owner, now + lease_seconds, now, owner, limit)) as cursor:
+                rows = await cursor.fetchall()
+            await _writer.commit()
+        except Exception:
+            await _writer.rollback()
+            raise
+    return sorted(rows)
+
+
+@_timed
+async def advance_direct_jobs(rows, owner, lease_until):
+    """Сохранение прогресса рассылки с продлением аренды: строки (cursor, delivered, id)"""
+    await _write_many("""
+        UPDATE direct_jobs SET cursor = ?, delivered = delivered + ?, lease_until = ?
+        WHERE id = ? AND lease_owner = ?
+    """, ((cursor, delivered, lease_until, job_id, owner) for cursor, delivered, job_id in rows))
+
+
+@_timed
+async def finish_direct_jobs(job_ids):
+    """Завершение заданий личной рассылки"""
+    now = time.time()
+    await _write_many("""
+        UPDATE direct_jobs SET state = 'done', finished_at = ?, lease_owner = NULL, lease_until = NULL
+        WHERE id = ?
+    """, ((now, job_id) for job_id in job_ids))
+
+
+@_timed
+async def release_direct_jobs(owner):
+    """Освобождение заданий личной рассылки, арендованных процессом"""
+    await _write("""
+        UPDATE direct_jobs SET lease_owner = NULL, lease_until = NULL WHERE lease_owner = ? AND state = 'pending'
+    """, (owner,))
+
+
+@_timed
+async def get_direct_pending_count():
+    """Число новостей, ожидающих личной рассылки"""
+    async with _reader.execute("SELECT COUNT(*) FROM direct_jobs WHERE state = 'pending'") as cursor:
+        return (await cursor.fetchone())[0]
+
+
+@_timed
+async def add_feeds(urls, poll_interval):
+    """Добавление лент в таблицу feeds (существующие не изменяются)"""
+    await _write_many("INSERT OR IGNORE INTO feeds (url, poll_interval) VALUES (?, ?)",
+                      ((url, poll_interval) for url in urls))
+
+
+@_timed
+async def get_feeds():
+    """Получение расписания включенных лент"""
+    async with _reader.execute("""
+        SELECT url, poll_interval, next_poll_at, last_polled_at, items_rate, empty_polls
+        FROM feeds WHERE enabled = 1
+    """) as cursor:
+        return await cursor.fetchall()
+
+
+@_timed
+async def claim_feeds(urls, owner, now, lease_seconds):
+    """Аренда лент, срок опроса которых наступил и которые не опрашивает другой процесс
+
+    Возвращает множество арендованных адресов.
+    """
+    claimed = set()
+    urls = list(urls)
+    async with _write_lock:
+        try:
+            for start in range(0, len(urls), SQL_IN_CHUNK):
+                chunk = urls[start:start + SQL_IN_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                async with _writer.execute(f"""
+                    UPDATE feeds SET lease_owner = ?, lease_until = ?
+                    WHERE url IN ({placeholders}) AND enabled = 1
+                      AND (next_poll_at IS NULL OR next_poll_at <= ?)
+                      AND (lease_until IS NULL OR lease_until < ? OR lease_owner = ?)
+                    RETURNING url
+                """, (owner, now + lease_seconds, *chunk, now, now, owner)) as cursor:
+                    claimed.update(row[0] for row in await cursor.fetchall())
+            await _writer.commit()
+        except Exception:
+            await _writer.rollback()
+            raise
+    return claimed
+
+
+@_timed
+async def get_feed_schedules(urls):
+    """Расписание указанных лент: url -> (next_poll_at, lease_until)"""
+    schedules = {}
+    urls = list(urls)
+    for start in range(0, len(urls), SQL_IN_CHUNK):
+        chunk = urls[start:start + SQL_IN_CHUNK]
+        placeholders = ",".join("?" * len(chunk))
+        async with _reader.execute(f"""
+            SELECT url, next_poll_at, lease_until FROM feeds WHERE url IN ({placeholders})
+        """, chunk) as cursor:
+            schedules.update((url, (next_poll_at, lease_until)) for url, next_poll_at, lease_until
+                             in await cursor.fetchall())
+    return schedules
+
+
+@_timed
+async def get_feed_urls():
+    """Получение адресов включенных лент"""
+    async with _reader.execute("SELECT url FROM feeds WHERE enabled = 1 ORDER BY added_at, url") as cursor:
+        return [row[0] for row in await cursor.fetchall()]
+
+
+@_timed
+async def update_feed_schedules(rows):
+    """Сохранение расписания лент с освобождением аренды
+
+    Строки (poll_interval, next_poll_at, last_polled_at, items_rate, empty_polls, url).
+    """
+    try:
+        await _write_many("""
+            UPDATE feeds
+            SET poll_interval = ?, next_poll_at = ?, last_polled_at = ?, items_rate = ?, empty_polls = ?,
+                lease_owner = NULL, lease_until = NULL
+            WHERE url = ?
+        """, rows)
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении расписания лент: {e}")
+
+
+@_timed
+async def get_feed_health(urls=None):
+    """Состояние доступности лент (по умолчанию всех включенных)
+
+    Строки (url, failures, open_until, last_error, last_success_at, last_failure_at).
+    """
+    columns = "url, failures, open_until, last_error, last_success_at, last_failure_at"
+    if urls is None:
+        async with _reader.execute(f"SELECT {columns} FROM feeds WHERE enabled = 1 ORDER BY url") as cursor:
+            return await cursor.fetchall()
+    rows = []
+    urls = list(urls)
+    for start in range(0, len(urls), SQL_IN_CHUNK):
+        chunk = urls[start:start + SQL_IN_CHUNK]
+        placeholders = ",".join("?" * len(chunk))
+        async with _reader.execute(f"SELECT {columns} FROM feeds WHERE url IN ({placeholders})",
+                                   chunk) as cursor:
+            rows.extend(await cursor.fetchall())
+    return rows
+
+
+@_timed
+async def update_feed_health(rows):
+    """Сохранение состояния доступности лент
+
+    Строки (failures, open_until, last_error, last_success_at, last_failure_at, url).
+    """
+    try:
+        await _write_many("""
+            UPDATE feeds
+            SET failures = ?, open_until = ?, last_error = ?, last_success_at = ?, last_failure_at = ?
+            WHERE url = ?
+        """, rows)
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении состояния лент: {e}")
+
+
+@_timed
+async def _delete_expired_batch(table, column, cutoff):
+    """Удаление одной порции строк table, у которых column раньше cutoff"""
+    async with _write_lock:
+        cursor = await _writer.execute(f"""
+            DELETE FROM {table} WHERE rowid IN (
+                SELECT rowid FROM {table} WHERE {column} < ? LIMIT ?
+            )
+        """, (cutoff, CLEANUP_BATCH_SIZE))
+        await _writer.commit()
+        return cursor.rowcount
+
+
+async def cleanup_old_news(retention_days):
+    """Очистка старых новостей из базы данных
+
+    Новости устаревают по времени отправки (sent_ts), а не публикации:
+    иначе запись о давно опубликованной, но недавно отправленной новости
+    удалилась бы сразу, и новость ушла бы повторно. Удаление идет
+    небольшими транзакциями по индексам с паузами между ними, поэтому
+    блокировка на запись не задерживает отправку, а стоимость зависит
+    только от числа устаревших строк.
+    Вместе с новостями удаляются file_id медиа старше срока хранения.
+    """
+    try:
+        cutoff = time.time() - retention_days * 86400
+        deleted = {}
+        expired = (("sent_news", "sent_ts"), ("media_cache", "stored_at"), ("outbox", "created_at"),
+                   ("direct_jobs", "created_at"))
+        for table, column in expired:
+            while True:
+                count = await _delete_expired_batch(table, column, cutoff)
+                deleted[table] = deleted.get(table, 0) + count
+                if count < CLEANUP_BATCH_SIZE:
+                    break
+                await asyncio.sleep(CLEANUP_BATCH_PAUSE)
+        await _write("UPDATE stats SET last_cleanup = CURRENT_TIMESTAMP")
+        deleted_count = deleted["sent_news"]
+        logger.info(f"🧹 Очистка базы: удалено {deleted_count} старых новостей и {deleted['media_cache']} file_id медиа")
+        return deleted_count
+    except Exception as e:
+        logger.error(f"❌ Ошибка при очистке старых новостей: {e}")
+        return 0
+
+
+@_timed
+async def update_stats(news_count=0, subscribers_count=0):
+    """Обновление статистики"""
+    try:
+        if news_count > 0:
+            await _write("UPDATE stats SET news_count = news_count + ?, last_check = CURRENT_TIMESTAMP",
+                         (news_count,))
+        if subscribers_count > 0:
+            await _write("UPDATE stats SET subscribers_count = ?", (subscribers_count,))
+    except Exception as e:
+        logger.error(f"Ошибка при обновлении статистики: {e}")
+
+
+@_timed
+async def get_stats():
+    """Получение статистики"""
+    async with _reader.execute("SELECT news_count, last_check, subscribers_count, last_cleanup FROM stats") as cursor:
+        stats = await cursor.fetchone()
+    if stats:
+        return stats
+    return (0, None, 0, None)
@@ -0,0 +1,21 @@
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+
+def to_epoch(value):
+    """Перевод даты из ленты (RFC 822) или из SQLite (ISO, UTC) в секунды Unix
+
+    Для пустых и нераспознанных значений возвращается None.
+    """
+    if not value:
+        return None
+    try:
+        parsed = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        try:
+            parsed = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
@@ -0,0 +1,84 @@
+import logging
+import time
+from collections import OrderedDict
+
+import database
+import metrics
+from links import link_key
+
+logger = logging.getLogger(__name__)
+
+MAX_SEEN_LINKS = 100_000  # ограничение памяти под множество ссылок
+
+
+class SentLinkCache:
+    """Множество недавно отправленных ссылок с ограниченным размером
+
+    Хранятся 64-битные ключи канонических ссылок (links.link_key), поэтому
+    ссылки на одну статью с метками рассылок, другой схемой или мобильным
+    хостом считаются одной. Ключи хранятся в порядке добавления вместе
+    со временем отправки, поэтому устаревшие записи и лишние записи сверх
+    лимита снимаются с начала словаря за O(1) на элемент.
+    """
+
+    def __init__(self, retention_days, max_size=MAX_SEEN_LINKS):
+        self.retention_seconds = retention_days * 86400
+        self.max_size = max_size
+        self._keys = OrderedDict()  # link_key -> время отправки
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, link):
+        return link_key(link) in self._keys
+
+    def _remember(self, key, sent_at=None):
+        self._keys[key] = sent_at if sent_at is not None else time.time()
+        self._keys.move_to_end(key)
+        while len(self._keys) > self.max_size:
+            self._keys.popitem(last=False)
+
+    def add(self, link, sent_at=None):
+        """Добавление ссылки в множество"""
+        self._remember(link_key(link), sent_at)
+
+    def expire(self, now=None):
+        """Удаление ссылок старше срока хранения новостей"""
+        cutoff = (now if now is not None else time.time()) - self.retention_seconds
+        while self._keys:
+            key, sent_at = next(iter(self._keys.items()))
+            if sent_at >= cutoff:
+                break
+            self._keys.popitem(last=False)
+
+    async def load(self):
+        """Загрузка недавно отправленных ссылок из базы при старте"""
+        rows = await database.get_recent_sent_keys(self.retention_seconds, self.max_size)
+        for key, sent_at in rows:
+            self._remember(key, sent_at)
+        logger.info(f"🧠 Загружено {len(self._keys)} отправленных ссылок в память")
+
+    async def filter_unsent(self, links):
+        """Отбор еще не отправленных ссылок из пакета
+
+        Сначала ссылки проверяются по множеству в памяти, затем все
+        оставшиеся проверяются одним запросом к базе. Из ссылок с одной
+        канонической формой остается первая. Порядок сохраняется.
+        """
+        self.expire()
+        links = list(links)
+        unknown = {}  # link_key -> первая ссылка пакета с этим ключом
+        for link in links:
+            key = link_key(link)
+            if key not in self._keys:
+                unknown.setdefault(key, link)
+        metrics.DEDUP_CHECKED.inc(amount=len(links))
+        metrics.DEDUP_HITS.inc("memory", amount=len(links) - len(unknown))
+        if not unknown:
+            return []
+
+        already_sent = await database.find_sent_keys(unknown)
+        metrics.DEDUP_HITS.inc("db", amount=len(already_sent))
+        for key in already_sent:
+            self._remember(key)
+        return [link for key, link in unknown.items() if key not in already_sent]
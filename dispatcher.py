@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import time
+from datetime import timedelta
+
+from telegram.error import RetryAfter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Ограничения Telegram Bot API
+GLOBAL_RATE = 30  # сообщений в секунду на бота
+CHAT_RATE = 20 / 60  # сообщений в секунду в одну группу или канал
+CHAT_BURST = 3  # сообщений подряд в один чат без ожидания
+MAX_RETRY_AFTER_ATTEMPTS = 3
+CLOSE_GRACE = 10  # секунд на завершение начатых отправок при остановке
+
+
+class TokenBucket:
+    """Ограничитель частоты по алгоритму token bucket"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """Ожидание свободного токена"""
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+    def pause(self, seconds):
+        """Запрет отправки на указанное время (после ответа RetryAfter)"""
+        self._refill()
+        self._tokens = 1 - seconds * self.rate
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    """Пауза из ответа RetryAfter в секундах"""
+    delay = error.retry_after
+    if isinstance(delay, timedelta):
+        return delay.total_seconds()
+    return float(delay)
+
+
+class ChannelDispatcher:
+    """Отправка сообщений через отдельные очереди для каждого чата
+
+    Каждый чат обслуживается своим обработчиком, поэтому отправки в разные
+    каналы идут параллельно, а ответ RetryAfter приостанавливает только
+    очередь того чата, который его получил. Общая корзина токенов
+    соблюдает глобальный лимит бота, корзина чата - лимит на чат.
+    """
+
+    def __init__(self, global_rate=GLOBAL_RATE, chat_rate=CHAT_RATE, chat_burst=CHAT_BURST, global_bucket=None):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        # Корзину бота можно разделить с другими отправителями (личной рассылкой)
+        self._global_bucket = global_bucket or TokenBucket(global_rate, global_rate)
+        self._queues = {}
+        self._buckets = {}
+        self._workers = {}
+        self._busy = set()  # чаты, в которые сейчас идет отправка
+        self._closing = False
+
+    def submit(self, chat_id, send) -> asyncio.Future:
+        """Постановка отправки в очередь чата
+
+        send - функция без аргументов, возвращающая корутину отправки.
+        Результат корутины (или исключение) попадает в возвращаемый future.
+        """
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            queue = self._queues[chat_id] = asyncio.Queue()
+            self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            self._workers[chat_id] = asyncio.create_task(self._worker(chat_id))
+        future = asyncio.get_running_loop().create_future()
+        queue.put_nowait((send, future))
+        return future
+
+    def queue_sizes(self):
+        """Текущая длина очереди каждого чата"""
+        return {chat_id: queue.qsize() for chat_id, queue in self._queues.items()}
+
+    async def _worker(self, chat_id):
+        queue = self._queues[chat_id]
+        bucket = self._buckets[chat_id]
+        while not self._closing:
+            send, future = await queue.get()
+            self._busy.add(chat_id)
+            try:
+                result = await self._send_with_retry(chat_id, bucket, send)
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                self._busy.discard(chat_id)
+                queue.task_done()
+
+    async def _send_with_retry(self, chat_id, bucket, send):
+        for attempt in range(MAX_RETRY_AFTER_ATTEMPTS + 1):
+            await bucket.acquire()
+            await self._global_bucket.acquire()
+            start = time.perf_counter()
+            try:
+                result = await send()
+                metrics.SEND_SECONDS.observe(time.perf_counter() - start, chat_id)
+                return result
+            except RetryAfter as e:
+                metrics.SEND_RETRY_AFTER.inc(chat_id)
+                if attempt == MAX_RETRY_AFTER_ATTEMPTS:
+                    metrics.SEND_ERRORS.inc(chat_id, type(e).__name__)
+                    raise
+                delay = retry_after_seconds(e)
+                logger.warning(f"⏳ Telegram просит подождать {delay:.0f} с перед отправкой в {chat_id}")
+                bucket.pause(delay)
+            except Exception as e:
+                metrics.SEND_ERRORS.inc(chat_id, type(e).__name__)
+                raise
+
+    async def close(self, grace=CLOSE_GRACE):
+        """Остановка обработчиков очередей
+
+        Начатые отправки получают grace секунд на завершение, чтобы их
+        результат не потерялся; ожидающие в очередях отменяются.
+        """
+        self._closing = True
+        busy = [worker for chat_id, worker in self._workers.items() if chat_id in self._busy]
+        for chat_id, worker in self._workers.items():
+            if chat_id not in self._busy:
+                worker.cancel()
+        if busy:
+            await asyncio.wait(busy, timeout=grace)
+        for worker in self._workers.values():
+            worker.cancel()
+        await asyncio.gather(*self._workers.values(), return_exceptions=True)
+        for queue in self._queues.values():
+            while not queue.empty():
+                _, future = queue.get_nowait()
+                future.cancel()
+        self._queues.clear()
+        self._buckets.clear()
+        self._workers.clear()
+        self._closing = False
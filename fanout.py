@@ -0,0 +1,199 @@
+import asyncio
+import logging
+import time
+from bisect import bisect_right
+
+from telegram.error import BadRequest, Forbidden, RetryAfter
+
+import database
+import metrics
+from dispatcher import MAX_RETRY_AFTER_ATTEMPTS, retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 500  # подписчиков, прогресс по которым сохраняется одной транзакцией
+CONCURRENCY = 16  # личных сообщений в отправке одновременно
+ROUND_JOBS = 8  # новостей, рассылаемых за один проход по подписчикам
+POLL_INTERVAL = 10.0  # секунд между проверками заданий, если их не будят
+JOB_LEASE_SECONDS = 300  # аренда заданий процессом, продлевается после каждой порции
+MIN_CHAT_ID = -2 ** 63  # курсор задания, по которому еще никто не обслужен
+# Ответы BadRequest, после которых писать в чат бессмысленно
+GONE_ERRORS = ("chat not found", "user is deactivated", "peer_id_invalid")
+
+
+def is_chat_gone(error):
+    """Подписчик недоступен навсегда: заблокировал бота, удалил аккаунт или чат"""
+    if isinstance(error, Forbidden):
+        return True
+    return isinstance(error, BadRequest) and any(text in str(error).lower() for text in GONE_ERRORS)
+
+
+class DirectJob:
+    """Новость в личной рассылке: маска категорий, тексты, медиа и курсор по chat_id"""
+
+    __slots__ = ("id", "categories", "message", "short_message", "photo_url", "video_url", "cursor", "delivered")
+
+    def __init__(self, row):
+        self.id, self.categories, self.message, self.short_message, self.photo_url, self.video_url, cursor = row
+        self.cursor = MIN_CHAT_ID if cursor is None else cursor
+        self.delivered = 0
+
+
+class DirectFanout:
+    """Личная рассылка новостей подписчикам по их категориям
+
+    Новость хранится в direct_jobs одной строкой, а не строкой на каждого
+    получателя. Получатели берутся из обратного индекса SubscriberCache
+    (категория -> chat_id) и обходятся по возрастанию chat_id порциями по
+    CHUNK_SIZE; после каждой порции курсор задания сохраняется, поэтому
+    после перезапуска рассылка продолжается с места остановки (повторно
+    может уйти не больше одной порции). За один проход рассылается до
+    ROUND_JOBS новостей: подписчик получает все подходящие ему одним
+    сообщением (несколько - дайджестом).
+
+    Частоту ограничивает общая с каналами корзина токенов бота; ответ
+    RetryAfter приостанавливает всю рассылку. Подписчики, заблокировавшие
+    бота, отключаются одним запросом на порцию.
+
+    send(chat_id, jobs) возвращает корутину отправки; on_commit(sent)
+    вызывается внутри транзакции сохранения порции. Перед проходом и
+    перед каждой порцией подписчики сверяются с базой (subscribers.refresh):
+    подписки меняют процессы команд, и отписавшийся пользователь не должен
+    получать рассылку до конца долгого прохода.
+    """
+
+    def __init__(self, subscribers, send, bucket, owner="", on_commit=None, concurrency=CONCURRENCY,
+                 chunk_size=CHUNK_SIZE, round_jobs=ROUND_JOBS, lease_seconds=JOB_LEASE_SECONDS):
+        self.subscribers = subscribers
+        self.send = send
+        self.bucket = bucket
+        self.owner = owner
+        self.on_commit = on_commit
+        self.chunk_size = chunk_size
+        self.round_jobs = round_jobs
+        self.lease_seconds = lease_seconds
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._task = None
+
+    def wake(self):
+        """Сигнал о новых заданиях"""
+        self._idle.clear()
+        self._wakeup.set()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановка рассылки; задания остаются pending и продолжаются после запуска"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await database.release_direct_jobs(self.owner)
+
+    async def wait_idle(self):
+        """Ожидание момента, когда все задания разосланы"""
+        await self._idle.wait()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                rows = await database.claim_direct_jobs(self.owner, time.time(), self.lease_seconds,
+                                                        self.round_jobs)
+            except Exception as e:
+                logger.error(f"❌ Ошибка чтения заданий личной рассылки: {e}")
+                rows = []
+            if rows:
+                try:
+                    await self._round([DirectJob(row) for row in rows])
+                except Exception as e:
+                    logger.error(f"❌ Ошибка личной рассылки: {e}")
+                    await asyncio.sleep(POLL_INTERVAL)
+                continue
+
+            self._idle.set()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _round(self, jobs):
+        """Проход по подписчикам категорий заданий"""
+        start = time.monotonic()
+        mask = 0
+        for job in jobs:
+            mask |= job.categories
+        await self.subscribers.refresh()
+        recipients = self.subscribers.recipients(mask)
+        totals = {"sent": 0, "gone": 0, "failed": 0}
+
+        first = bisect_right(recipients, min(job.cursor for job in jobs))
+        for begin in range(first, len(recipients), self.chunk_size):
+            chunk = recipients[begin:begin + self.chunk_size]
+            await self.subscribers.refresh()
+            deliveries = []
+            for chat_id in chunk:
+                chat_mask = self.subscribers.get_mask(chat_id)
+                matched = [job for job in jobs if job.categories & chat_mask and chat_id > job.cursor]
+                if matched:
+                    deliveries.append((chat_id, matched))
+            results = await asyncio.gather(*(self._deliver(chat_id, matched) for chat_id, matched in deliveries))
+
+            delivered = dict.fromkeys((job.id for job in jobs), 0)
+            gone = []
+            for (chat_id, matched), result in zip(deliveries, results):
+                totals[result] += 1
+                metrics.DIRECT_SENDS.inc(result)
+                if result == "sent":
+                    for job in matched:
+                        delivered[job.id] += 1
+                elif result == "gone":
+                    gone.append(chat_id)
+            for job in jobs:
+                job.cursor = max(job.cursor, chunk[-1])
+                job.delivered += delivered[job.id]
+
+            async with database.batch():
+                await database.advance_direct_jobs([(job.cursor, delivered[job.id], job.id) for job in jobs],
+                                                   self.owner, time.time() + self.lease_seconds)
+                await self.subscribers.deactivate(gone)
+                if self.on_commit is not None:
+                    await self.on_commit(sum(result == "sent" for result in results))
+
+        await database.finish_direct_jobs([job.id for job in jobs])
+        elapsed = time.monotonic() - start
+        sends = sum(totals.values())
+        logger.info(
+            f"📨 Личная рассылка {len(jobs)} новостей: {totals['sent']} сообщений за {elapsed:.1f} с "
+            f"({sends / elapsed if elapsed else 0:.1f} в секунду), отключено недоступных подписчиков: "
+            f"{totals['gone']}, ошибок: {totals['failed']}"
+        )
+
+    async def _deliver(self, chat_id, jobs):
+        """Отправка подписчику: sent, gone (бот заблокирован) или failed"""
+        async with self._semaphore:
+            for attempt in range(MAX_RETRY_AFTER_ATTEMPTS + 1):
+                await self.bucket.acquire()
+                start = time.perf_counter()
+                try:
+                    await self.send(chat_id, jobs)
+                except RetryAfter as e:
+                    metrics.DIRECT_SENDS.inc("retry_after")
+                    if attempt == MAX_RETRY_AFTER_ATTEMPTS:
+                        return "failed"
+                    # Лимит личных сообщений общий для бота, поэтому пауза - для всей рассылки
+                    delay = retry_after_seconds(e)
+                    logger.warning(f"⏳ Telegram просит подождать {delay:.0f} с в личной рассылке")
+                    self.bucket.pause(delay)
+                except Exception as e:
+                    if is_chat_gone(e):
+                        return "gone"
+                    logger.debug(f"Ошибка личного сообщения {chat_id}: {e}")
+                    return "failed"
+                else:
+                    metrics.DIRECT_SEND_SECONDS.observe(time.perf_counter() - start)
+                    return "sent"
+            return "failed"
@@ -0,0 +1,180 @@
+import logging
+import xml.etree.ElementTree as ET
+
+import feedparser
+
+from dates import to_epoch
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024  # байт XML за один шаг разбора
+STOP_AFTER_SEEN = 5  # сколько уже отправленных записей подряд означает конец новых
+
+_ITEM_TAGS = {"item", "entry"}
+_SUMMARY_TAGS = ("description", "summary", "encoded", "content")
+_DATE_TAGS = ("pubDate", "published", "date", "updated")
+
+
+class FeedStreamError(Exception):
+    """Ленту не удалось разобрать потоковым парсером"""
+
+
+def _local_name(tag):
+    """Имя тега без пространства имен: {http://...}entry -> entry"""
+    return tag.rsplit("}", 1)[-1]
+
+
+class NewsItem:
+    """Запись ленты только с полями, которые использует отправка новостей
+
+    Записи создаются сразу при разборе, исходные словари feedparser и
+    элементы XML дальше не хранятся. categories - маска категорий
+    CategoryMatcher, заполняется при классификации.
+    """
+
+    __slots__ = ("link", "title", "summary", "published", "published_ts", "photo_url", "video_url",
+                 "categories")
+
+    def __init__(self, link, title, summary="", published="", photo_url=None, video_url=None):
+        self.link = link
+        self.title = title
+        self.summary = summary
+        self.published = published
+        self.published_ts = to_epoch(published)
+        self.photo_url = photo_url
+        self.video_url = video_url
+        self.categories = 0
+
+    @classmethod
+    def from_entry(cls, entry):
+        """Запись из словаря feedparser"""
+        photo_url, video_url = extract_media_from_entry(entry)
+        return cls(entry.get("link", ""), entry.get("title", ""), entry.get("summary", ""),
+                   entry.get("published", ""), photo_url, video_url)
+
+
+def _pick_media(media_content, enclosures, links):
+    """Фото и видео записи по парам (адрес, тип) из media:content, вложений и ссылок"""
+    photo_url = None
+    video_url = None
+    for url, media_type in (*media_content, *enclosures):
+        if "image" in media_type:
+            photo_url = url
+        elif "video" in media_type:
+            video_url = url
+    if not photo_url:
+        for url, media_type in links:
+            if "image" in media_type:
+                photo_url = url
+    return photo_url, video_url
+
+
+def _build_item(item):
+    """NewsItem из элемента item/entry"""
+    texts = {}
+    media_content = []
+    enclosures = []
+    links = []
+
+    for child in item:
+        name = _local_name(child.tag)
+        if name == "link":
+            href = child.get("href")
+            if href is None:
+                # RSS: ссылка в тексте элемента
+                texts.setdefault("link", (child.text or "").strip())
+                continue
+            rel = child.get("rel", "alternate")
+            links.append((href, child.get("type", "")))
+            if rel == "enclosure":
+                enclosures.append(links[-1])
+            elif rel == "alternate":
+                texts.setdefault("link", href)
+        elif name == "content" and child.get("url"):
+            media_content.append((child.get("url"), child.get("type") or child.get("medium") or ""))
+        elif name == "enclosure" and child.get("url"):
+            enclosures.append((child.get("url"), child.get("type", "")))
+            links.append(enclosures[-1])
+        elif name == "group":
+            # media:group с несколькими media:content
+            for media in child:
+                if _local_name(media.tag) == "content" and media.get("url"):
+                    media_content.append((media.get("url"), media.get("type") or media.get("medium") or ""))
+        elif child.text and name not in texts:
+            texts[name] = child.text.strip()
+
+    photo_url, video_url = _pick_media(media_content, enclosures, links)
+    return NewsItem(
+        texts.get("link", ""),
+        texts.get("title", ""),
+        next((texts[tag] for tag in _SUMMARY_TAGS if tag in texts), ""),
+        next((texts[tag] for tag in _DATE_TAGS if tag in texts), ""),
+        photo_url,
+        video_url,
+    )
+
+
+def iter_feed_entries(content, is_seen=None, stop_after_seen=STOP_AFTER_SEEN):
+    """Потоковый разбор RSS/Atom с выдачей записей по одной
+
+    Разобранные элементы сразу освобождаются. Если задан is_seen, разбор
+    прекращается после stop_after_seen уже отправленных записей подряд:
+    ленты отдают новые записи первыми, дальше идут только старые.
+    Если документ не удалось разобрать (например, из-за неизвестной
+    сущности вроде &nbsp; посреди ленты), выбрасывается FeedStreamError,
+    даже если часть записей уже выдана: весь документ нужно разобрать
+    заново feedparser.
+    """
+    parser = ET.XMLPullParser(events=("start", "end"))
+    depth = 0
+    yielded = 0
+    seen_in_row = 0
+
+    try:
+        for start in range(0, len(content), CHUNK_SIZE):
+            parser.feed(content[start:start + CHUNK_SIZE])
+            for event, element in parser.read_events():
+                if _local_name(element.tag) not in _ITEM_TAGS:
+                    continue
+                if event == "start":
+                    depth += 1
+                    continue
+                depth -= 1
+                if depth:
+                    continue
+
+                news_item = _build_item(element)
+                element.clear()
+                yielded += 1
+                yield news_item
+
+                if is_seen is not None and news_item.link:
+                    seen_in_row = seen_in_row + 1 if is_seen(news_item.link) else 0
+                    if seen_in_row >= stop_after_seen:
+                        return
+        parser.close()
+    except ET.ParseError as e:
+        raise FeedStreamError(f"{e} (после {yielded} записей)") from e
+
+
+def extract_media_from_entry(entry):
+    """Извлечение медиа (фото и видео) из записи feedparser"""
+    def pairs(field, key):
+        return [(item.get(key), item.type) for item in entry.get(field, ()) if hasattr(item, "type")]
+
+    return _pick_media(pairs("media_content", "url"), pairs("enclosures", "url"), pairs("links", "href"))
+
+
+def parse_entries(content, response_headers=None):
+    """Разбор ленты feedparser с переводом записей в NewsItem"""
+    return [NewsItem.from_entry(entry)
+            for entry in feedparser.parse(content, response_headers=response_headers).entries]
+
+
+def parse_feed(content, response_headers=None, is_seen=None):
+    """Разбор ленты потоковым парсером с откатом на feedparser; возвращает список NewsItem"""
+    try:
+        return list(iter_feed_entries(content, is_seen=is_seen))
+    except FeedStreamError as e:
+        logger.info(f"ℹ️ Потоковый разбор не удался ({e}), используется feedparser")
+    return parse_entries(content, response_headers)
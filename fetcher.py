@@ -0,0 +1,110 @@
+import asyncio
+import hashlib
+import logging
+import time
+from urllib.parse import urlsplit
+
+import httpx
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+CONNECT_TIMEOUT = 5.0  # секунд
+READ_TIMEOUT = 20.0  # секунд между пакетами ответа
+DEADLINE = 30.0  # секунд на весь запрос ленты: медленно отдающий хост не задержит цикл дольше
+MAX_CONNECTIONS = 20  # одновременных запросов на все ленты
+MAX_CONNECTIONS_PER_HOST = 2  # одновременных запросов к одному хосту
+KEEPALIVE_EXPIRY = 300  # секунд
+USER_AGENT = "Mozilla/5.0 (compatible; TelegramNewsBot/1.0)"
+
+
+def body_hash(content: bytes) -> str:
+    """Хэш тела ответа для обнаружения неизмененных лент"""
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+class FeedFetcher:
+    """Загрузка RSS-лент через общий пул keep-alive соединений"""
+
+    def __init__(self, max_connections=MAX_CONNECTIONS, max_per_host=MAX_CONNECTIONS_PER_HOST,
+                 connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT, deadline=DEADLINE):
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.deadline = deadline
+        self._client = None
+        self._global_limit = asyncio.Semaphore(max_connections)
+        self._host_limits = {}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Общий HTTP-клиент (создается при первом обращении)"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                    keepalive_expiry=KEEPALIVE_EXPIRY,
+                ),
+                headers={"User-Agent": USER_AGENT},
+                follow_redirects=True,
+            )
+        return self._client
+
+    def _host_limit(self, url: str) -> asyncio.Semaphore:
+        """Семафор, ограничивающий число запросов к одному хосту"""
+        host = urlsplit(url).hostname or ""
+        limit = self._host_limits.get(host)
+        if limit is None:
+            limit = self._host_limits[host] = asyncio.Semaphore(self.max_per_host)
+        return limit
+
+    async def fetch(self, url: str, headers: dict = None, timeout: httpx.Timeout = None,
+                    deadline: float = None) -> httpx.Response:
+        """Загрузка одной ленты с учетом лимитов на хост и на весь пул
+
+        timeout ограничивает соединение и паузы между пакетами ответа,
+        deadline - весь запрос (по умолчанию настройки загрузчика); по
+        истечении deadline выбрасывается asyncio.TimeoutError. Ответ 304
+        Not Modified возвращается как есть, остальные коды кроме 2xx
+        приводят к исключению httpx.HTTPStatusError.
+        """
+        async with self._host_limit(url), self._global_limit:
+            start = time.perf_counter()
+            try:
+                response = await asyncio.wait_for(
+                    self.client.get(url, headers=headers, timeout=timeout or self.timeout),
+                    deadline or self.deadline,
+                )
+            except Exception as e:
+                metrics.FETCH_ERRORS.inc(url, type(e).__name__)
+                raise
+            metrics.FETCH_SECONDS.observe(time.perf_counter() - start, url)
+        metrics.FETCH_RESPONSES.inc(url, str(response.status_code))
+        metrics.FETCH_BYTES.inc(url, amount=len(response.content))
+        if response.status_code != 304:
+            response.raise_for_status()
+        return response
+
+    async def head(self, url: str, timeout: float = None) -> httpx.Response:
+        """HEAD-запрос через общий пул (для проверки медиа перед отправкой)"""
+        async with self._global_limit:
+            return await self.client.head(url, timeout=timeout if timeout is not None else self.timeout)
+
+    async def fetch_conditional(self, url: str, etag: str = None, last_modified: str = None,
+                                timeout: httpx.Timeout = None, deadline: float = None) -> httpx.Response:
+        """Условный GET-запрос с валидаторами из предыдущего ответа"""
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        return await self.fetch(url, headers=headers, timeout=timeout, deadline=deadline)
+
+    async def close(self):
+        """Закрытие пула соединений"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
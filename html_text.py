@@ -0,0 +1,85 @@
+import hashlib
+import html
+import re
+from collections import OrderedDict
+from html.parser import HTMLParser
+
+CACHE_SIZE = 10_000  # очищенных текстов в кэше
+CHUNK_SIZE = 4096  # символов разметки за один шаг разбора
+
+_TAG_RE = re.compile(r"<[^>]+>")
+_SKIP_TAGS = {"script", "style"}
+
+_cache = OrderedDict()
+
+
+class _TextExtractor(HTMLParser):
+    """Потоковое извлечение текста из HTML без построения дерева"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.length = 0
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIP_TAGS:
+            self._skip_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag in _SKIP_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self.parts.append(data)
+            self.length += len(data)
+
+
+def _normalize(text):
+    """Повторная расшифровка сущностей, удаление остатков тегов и лишних пробелов"""
+    if "&" in text:
+        # Ленты нередко экранируют разметку дважды (&amp;laquo;, &lt;p&gt;)
+        text = html.unescape(text)
+    if "<" in text:
+        text = _TAG_RE.sub("", text)
+    return " ".join(text.split())
+
+
+def _extract(text, limit):
+    parser = _TextExtractor()
+    for start in range(0, len(text), CHUNK_SIZE):
+        parser.feed(text[start:start + CHUNK_SIZE])
+        # Дальше не читаем, если текста уже хватает на обрезку до limit
+        if limit is not None and parser.length > limit:
+            result = _normalize("".join(parser.parts))
+            if len(result) > limit:
+                return result
+    parser.close()
+    return _normalize("".join(parser.parts))
+
+
+def clean_html(text, limit=None):
+    """Очистка текста от HTML тегов
+
+    Текст без разметки и сущностей только нормализуется по пробелам.
+    Если задан limit, разбор останавливается, как только текста набралось
+    больше limit символов (обрезку выполняет вызывающий код).
+    Результаты кэшируются по хэшу исходного текста.
+    """
+    if not text:
+        return ""
+    if "<" not in text and "&" not in text:
+        return " ".join(text.split())
+
+    key = (hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest(), limit)
+    cached = _cache.get(key)
+    if cached is not None:
+        _cache.move_to_end(key)
+        return cached
+
+    result = _extract(text, limit)
+    _cache[key] = result
+    if len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+    return result
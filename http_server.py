@@ -0,0 +1,115 @@
+import asyncio
+import logging
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger(__name__)
+
+MAX_HEADER_SIZE = 64 * 1024  # байт
+MAX_BODY_SIZE = 10 * 1024 * 1024  # байт
+KEEPALIVE_TIMEOUT = 30  # секунд
+
+
+class Request:
+    """Входящий HTTP-запрос"""
+
+    __slots__ = ("method", "path", "query", "headers", "body")
+
+    def __init__(self, method, path, query, headers, body):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+
+
+class Response:
+    """Ответ обработчика"""
+
+    __slots__ = ("status", "body", "headers")
+
+    def __init__(self, status=200, body=b"", headers=None, content_type="text/plain; charset=utf-8"):
+        self.status = status
+        self.body = body.encode("utf-8") if isinstance(body, str) else body
+        self.headers = {"Content-Type": content_type}
+        if headers:
+            self.headers.update(headers)
+
+
+async def _read_request(reader):
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.LimitOverrunError:
+        raise ValueError("Слишком большие заголовки")
+    lines = head.decode("latin-1").split("\r\n")
+    method, target, _ = lines[0].split(" ", 2)
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get("content-length", 0))
+    if length > MAX_BODY_SIZE:
+        raise ValueError("Слишком большое тело запроса")
+    body = await reader.readexactly(length) if length else b""
+
+    url = urlsplit(target)
+    query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+    return Request(method.upper(), url.path, query, headers, body)
+
+
+def _encode_response(response, keep_alive, with_body=True):
+    reason = HTTPStatus(response.status).phrase
+    headers = dict(response.headers)
+    if with_body or "Content-Length" not in headers:
+        headers["Content-Length"] = str(len(response.body))
+    headers["Connection"] = "keep-alive" if keep_alive else "close"
+    head = f"HTTP/1.1 {response.status} {reason}\r\n"
+    head += "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+    return head.encode("latin-1") + b"\r\n" + (response.body if with_body else b"")
+
+
+async def start_http_server(handler, host="127.0.0.1", port=0):
+    """Запуск минимального асинхронного HTTP/1.1 сервера
+
+    handler - корутина, принимающая Request и возвращающая Response.
+    Поддерживаются keep-alive соединения и тела запросов с Content-Length,
+    чего достаточно для метрик, вебхуков Telegram и локальных заглушек.
+    """
+
+    async def serve_connection(reader, writer):
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(_read_request(reader), timeout=KEEPALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+                except ValueError as e:
+                    writer.write(_encode_response(Response(400, str(e)), keep_alive=False))
+                    break
+
+                try:
+                    response = await handler(request)
+                except Exception as e:
+                    logger.error(f"Ошибка обработки HTTP-запроса {request.path}: {e}")
+                    response = Response(500, "Internal Server Error")
+
+                keep_alive = request.headers.get("connection", "").lower() != "close"
+                # На HEAD отправляются только заголовки; обработчик может задать Content-Length сам
+                writer.write(_encode_response(response, keep_alive, with_body=request.method != "HEAD"))
+                try:
+                    await writer.drain()
+                except ConnectionError:
+                    break
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(serve_connection, host, port, limit=MAX_HEADER_SIZE)
+
+
+def server_port(server):
+    """Порт, на котором слушает сервер (удобно при port=0)"""
+    return server.sockets[0].getsockname()[1]
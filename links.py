@@ -0,0 +1,58 @@
+import re
+from hashlib import blake2b
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Параметры счетчиков и рассылок, которые не меняют страницу
+TRACKING_PARAMS = {
+    "fbclid", "gclid", "yclid", "ysclid", "dclid", "msclkid", "mc_cid", "mc_eid", "_openstat",
+    "from", "ref", "amp", "utm_referrer",
+}
+TRACKING_PREFIXES = ("utm_",)
+# Поддомены мобильных и AMP-версий того же сайта
+HOST_PREFIXES = ("www.", "m.", "amp.", "mobile.")
+DEFAULT_PORTS = {80, 443}
+
+_AMP_PATH = re.compile(r"/amp/?$")
+
+
+def _is_tracking(name):
+    name = name.lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+
+def canonical_link(url):
+    """Каноническая форма ссылки на статью
+
+    Схема приводится к https, хост - к нижнему регистру без www., m.,
+    amp. и стандартного порта, из пути убираются завершающие / и /amp,
+    из запроса - параметры отслеживания (остальные сортируются), якорь
+    отбрасывается. Ссылки, которые не разбираются как http(s), остаются
+    как есть.
+    """
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+    if parts.scheme.lower() not in ("http", "https") or not parts.hostname:
+        return url
+
+    host = parts.hostname
+    for prefix in HOST_PREFIXES:
+        if host.startswith(prefix) and host.count(".") > 1:
+            host = host[len(prefix):]
+            break
+    if port and port not in DEFAULT_PORTS:
+        host = f"{host}:{port}"
+
+    path = _AMP_PATH.sub("/", parts.path).rstrip("/") or "/"
+    query = urlencode(sorted((name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+                             if not _is_tracking(name)))
+    return urlunsplit(("https", host, path, query, ""))
+
+
+def link_key(url):
+    """64-битный ключ канонической ссылки (со знаком, как INTEGER в SQLite)"""
+    digest = blake2b(canonical_link(url).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True)
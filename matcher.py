@@ -0,0 +1,169 @@
+import re
+
+# Окончания, которые допускаются после коротких слов (мяч -> мяча, банк -> банком)
+SHORT_WORD_ENDINGS = ("а", "у", "е", "и", "ы", "о", "ом", "ой", "ов", "ам", "ах", "ами", "ей", "ем", "ю", "я")
+# Падежные окончания существительных и прилагательных после длинной основы
+ENDINGS = frozenset((
+    "", "а", "я", "о", "е", "ё", "у", "ю", "ы", "и", "ь", "й",
+    "ом", "ем", "ой", "ей", "ою", "ею", "ов", "ев", "ам", "ям", "ах", "ях", "ами", "ями",
+    "ий", "ый", "ая", "яя", "ое", "ее", "ые", "ие", "ого", "его", "ому", "ему", "ых", "их", "ым", "им",
+    "ыми", "ими", "ую", "юю",
+    "ья", "ье", "ью", "ьи", "ьев", "ьем", "ьям", "ьях", "ьями",
+    "ия", "ии", "ию", "ием", "иям", "иях", "иями",
+))
+# Словообразовательные суффиксы между длинной основой и окончанием (спорт -> спортивный)
+DERIVED_SUFFIXES = ("ивн", "ическ", "ческ", "ск", "н", "ьн", "йн", "альн", "ов", "ев", "ист", "к", "смен",
+                    "ник", "щик", "чик", "изм", "ость", "ств")
+MAX_DERIVED_SUFFIXES = 2  # суффиксов подряд (теннис -> теннис-ист-к-а)
+# Буквы, которые отбрасываются с конца слова для получения основы
+STEM_STRIP = "аеёиоуыэюяйь"
+VOWELS = "аеёиоуыэюя"
+MIN_STEM_LENGTH = 5  # основы короче (банк, крем) ищутся только со списком окончаний
+TOKEN_CACHE_SIZE = 100_000  # слов в кэше разбора
+
+TOKEN_RE = re.compile(r"\w+")
+_CYRILLIC = re.compile(r"[а-яё]")
+
+
+def _stem(word):
+    """Основа слова: отбрасываем конечную гласную (экономика -> экономик), вторую - если
+    основа остается длинной (искусственный -> искусственн, но хоккей -> хокке)"""
+    stem = word
+    if len(stem) > 3 and stem[-1] in STEM_STRIP:
+        stem = stem[:-1]
+        if len(stem) > MIN_STEM_LENGTH and stem[-1] in STEM_STRIP:
+            stem = stem[:-1]
+    return stem
+
+
+def _fleeting_stems(stem):
+    """Основы с беглой гласной: рынок -> рынк (рынке), деньг -> денег"""
+    if len(stem) < 4 or stem[-1] in STEM_STRIP:
+        return []
+    if stem[-2] in "оеё" and stem[-3] not in VOWELS:
+        return [stem[:-2] + stem[-1]]
+    if stem[-2] in "ьй":
+        return [stem[:-2] + "е" + stem[-1]]
+    return []
+
+
+def _is_tail(tail, suffixes=MAX_DERIVED_SUFFIXES):
+    """Допустимое продолжение длинной основы: окончание, возможно после суффиксов"""
+    if tail in ENDINGS:
+        return True
+    return suffixes > 0 and any(
+        tail.startswith(suffix) and _is_tail(tail[len(suffix):], suffixes - 1) for suffix in DERIVED_SUFFIXES)
+
+
+class CategoryMatcher:
+    """Определение категорий текста за один проход по словам
+
+    Из ключевых слов всех категорий строится словарь словоформ: латинские
+    слова (it, ai) ищутся целиком, короткие русские слова - только вместе
+    с падежными окончаниями (банк - не банкет), длинные - по основе с
+    падежным окончанием, перед которым допускаются словообразовательные
+    суффиксы (спорт -> спортивный). Для основ с беглой гласной добавляются
+    формы без нее (рынок -> рынке). Текст разбивается на слова один раз,
+    каждое слово проверяется несколькими обращениями к словарю, поэтому
+    время классификации почти не зависит от числа ключевых слов.
+    """
+
+    def __init__(self, synonyms, categories):
+        self.categories = list(categories)
+        self._all_mask = (1 << len(self.categories)) - 1
+
+        self._word_ids = {}  # нормализованное слово -> номер
+        self._exact = {}  # словоформа -> множество номеров слов
+        self._stems = {}  # основа -> множество номеров слов
+        self._word_masks = {}  # номер слова -> маска категорий для однословных ключей
+        self._phrases = {}  # номер первого слова -> [(номера следующих слов, маска)]
+        self._token_cache = {}
+
+        for index, category in enumerate(self.categories):
+            for keyword in [category, *synonyms.get(category, [])]:
+                words = keyword.lower().split()
+                if not words:
+                    continue
+                ids = tuple(self._add_word(word) for word in words)
+                bit = 1 << index
+                if len(ids) == 1:
+                    self._word_masks[ids[0]] = self._word_masks.get(ids[0], 0) | bit
+                else:
+                    self._phrases.setdefault(ids[0], []).append((ids[1:], bit))
+
+    def _add_word(self, word):
+        """Регистрация слова ключевой фразы и его словоформ"""
+        word_id = self._word_ids.get(word)
+        if word_id is not None:
+            return word_id
+        word_id = self._word_ids[word] = len(self._word_ids)
+
+        if not _CYRILLIC.search(word):
+            forms = [word]
+        else:
+            stem = _stem(word)
+            if len(stem) >= MIN_STEM_LENGTH:
+                self._stems.setdefault(stem, set()).add(word_id)
+                forms = [word]
+            else:
+                forms = [word] + [stem + ending for ending in SHORT_WORD_ENDINGS]
+            for fleeting in _fleeting_stems(stem):
+                forms += [fleeting + ending for ending in ENDINGS]
+        for form in forms:
+            self._exact.setdefault(form, set()).add(word_id)
+        return word_id
+
+    def _resolve(self, token):
+        """Номера ключевых слов, которым соответствует слово текста"""
+        cached = self._token_cache.get(token)
+        if cached is not None:
+            return cached
+
+        ids = set(self._exact.get(token, ()))
+        for prefix_length in range(MIN_STEM_LENGTH, len(token) + 1):
+            stem_ids = self._stems.get(token[:prefix_length])
+            if stem_ids and not stem_ids <= ids and _is_tail(token[prefix_length:]):
+                ids |= stem_ids
+        resolved = frozenset(ids)
+
+        if len(self._token_cache) >= TOKEN_CACHE_SIZE:
+            self._token_cache.clear()
+        self._token_cache[token] = resolved
+        return resolved
+
+    def match_mask(self, text):
+        """Битовая маска категорий, найденных в тексте"""
+        if not text:
+            return 0
+        tokens = TOKEN_RE.findall(text.lower())
+        resolve = self._resolve
+        word_masks = self._word_masks
+        phrases = self._phrases
+
+        mask = 0
+        for position, token in enumerate(tokens):
+            ids = resolve(token)
+            if not ids:
+                continue
+            for word_id in ids:
+                mask |= word_masks.get(word_id, 0)
+                for rest, bit in phrases.get(word_id, ()):
+                    following = tokens[position + 1:position + 1 + len(rest)]
+                    if len(following) == len(rest) and all(
+                            next_id in resolve(next_token) for next_id, next_token in zip(rest, following)):
+                        mask |= bit
+            if mask == self._all_mask:
+                break
+        return mask
+
+    def categories_for_mask(self, mask):
+        """Список категорий по битовой маске (в порядке объявления)"""
+        return [category for index, category in enumerate(self.categories) if mask & (1 << index)]
+
+    def match(self, text):
+        """Список категорий, найденных в тексте"""
+        return self.categories_for_mask(self.match_mask(text))
+
+    def match_many(self, texts):
+        """Пакетная классификация списка текстов"""
+        return [self.match(text) for text in texts]
@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+import httpx
+
+import database
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Ограничения Bot API на файлы, отправляемые по URL
+MAX_PHOTO_SIZE = 5 * 1024 * 1024  # байт
+MAX_VIDEO_SIZE = 20 * 1024 * 1024  # байт
+PROBE_TIMEOUT = 5.0  # секунд на HEAD-запрос
+CACHE_SIZE = 50_000  # адресов в памяти
+PROBE_RETRY_SECONDS = 300  # секунд до повторной проверки адреса, проверить который не удалось
+# Ответы, после которых адрес может заработать: ошибки сервера, таймаут и ограничение частоты
+TRANSIENT_STATUSES = (408, 425, 429)
+
+
+class MediaCache:
+    """Соответствие адресов медиа и file_id, полученных от Telegram
+
+    После первой загрузки по URL Telegram возвращает file_id, и остальные
+    каналы получают тот же файл по нему без повторного скачивания.
+    Результаты проверки адресов тоже запоминаются, чтобы не повторять HEAD,
+    но только окончательные (4xx, неподходящий тип, слишком большой файл).
+    Если проверить адрес не удалось (таймаут, ошибка соединения, 5xx),
+    медиа пропускается, а адрес проверяется снова через retry_seconds.
+    Новые file_id накапливаются и сохраняются в базе вызовом save().
+    """
+
+    def __init__(self, max_size=CACHE_SIZE, retry_seconds=PROBE_RETRY_SECONDS):
+        self.max_size = max_size
+        self.retry_seconds = retry_seconds
+        self._file_ids = OrderedDict()  # url -> file_id
+        self._checked = OrderedDict()  # url -> пригоден ли адрес для отправки
+        self._retry_at = OrderedDict()  # url -> время (monotonic) повторной проверки недоступного адреса
+        self._locks = {}
+        self._unsaved = []
+
+    def _remember(self, store, url, value):
+        store[url] = value
+        store.move_to_end(url)
+        while len(store) > self.max_size:
+            store.popitem(last=False)
+
+    def get(self, url):
+        """Сохраненный file_id или None"""
+        return self._file_ids.get(url)
+
+    def store(self, url, kind, file_id):
+        self._remember(self._file_ids, url, file_id)
+        self._remember(self._checked, url, True)
+        self._unsaved.append((url, kind, file_id))
+
+    def forget(self, url):
+        """Отметка адреса, файл по которому Telegram не принял"""
+        self._file_ids.pop(url, None)
+        self._remember(self._checked, url, False)
+
+    def _unreachable(self, url, now):
+        """Проверить адрес не удалось, и срок повторной проверки еще не наступил"""
+        retry_at = self._retry_at.get(url)
+        return retry_at is not None and retry_at > now
+
+    def rejected(self, url):
+        """Адрес, файл по которому Telegram не принял или который не прошел проверку"""
+        return self._checked.get(url) is False or self._unreachable(url, time.monotonic())
+
+    def lock(self, url):
+        """Блокировка на время первой загрузки файла по URL"""
+        lock = self._locks.get(url)
+        if lock is None:
+            lock = self._locks[url] = asyncio.Lock()
+        return lock
+
+    def release(self, url):
+        lock = self._locks.get(url)
+        if lock is not None and not lock.locked():
+            del self._locks[url]
+
+    async def save(self):
+        """Сохранение новых file_id в базе"""
+        rows, self._unsaved = self._unsaved, []
+        await database.save_media_file_ids(rows)
+
+    async def prepare(self, fetcher, media):
+        """Подготовка пакета медиа перед отправкой
+
+        media - список пар (url, вид: "photo" или "video"). Известные
+        file_id подгружаются из базы одним запросом, остальные адреса
+        проверяются HEAD-запросами параллельно. Возвращается множество
+        адресов, которые отправлять не нужно.
+        """
+        unknown = [(url, kind) for url, kind in dict(media).items() if url not in self._file_ids]
+        for url, file_id in (await database.get_media_file_ids([url for url, _ in unknown])).items():
+            self._remember(self._file_ids, url, file_id)
+        now = time.monotonic()
+        unchecked = [(url, kind) for url, kind in unknown
+                     if url not in self._file_ids and url not in self._checked and not self._unreachable(url, now)]
+        results = await asyncio.gather(*(probe_media(fetcher, url, kind) for url, kind in unchecked))
+        failed = set()
+        for (url, _), usable in zip(unchecked, results):
+            if usable is None:
+                failed.add(url)
+                self._remember(self._retry_at, url, now + self.retry_seconds)
+            else:
+                self._retry_at.pop(url, None)
+                self._remember(self._checked, url, usable)
+        return {url for url, _ in media
+                if url in failed or self._checked.get(url) is False or self._unreachable(url, now)}
+
+
+async def probe_media(fetcher, url, kind):
+    """Проверка адреса медиа HEAD-запросом: доступен, нужного типа и размера
+
+    Возвращает True или False, если ответ окончательный, и None, если
+    проверить адрес не удалось (таймаут, ошибка соединения или сервера).
+    """
+    try:
+        response = await fetcher.head(url, timeout=PROBE_TIMEOUT)
+    except (httpx.InvalidURL, httpx.UnsupportedProtocol) as e:
+        # Некорректный адрес из ленты не станет правильным при повторе
+        logger.warning(f"🖼️ Некорректный адрес медиа, будет отправлен текст: {url} ({type(e).__name__})")
+        metrics.MEDIA_PROBES.inc("invalid")
+        return False
+    except Exception as e:
+        logger.warning(f"🖼️ Медиа недоступно, будет отправлен текст: {url} ({type(e).__name__})")
+        metrics.MEDIA_PROBES.inc("unreachable")
+        return None
+
+    # Часть серверов не поддерживает HEAD; такие адреса проверит сам Telegram
+    if response.status_code in (405, 501):
+        metrics.MEDIA_PROBES.inc("unknown")
+        return True
+    if response.status_code >= 500 or response.status_code in TRANSIENT_STATUSES:
+        logger.warning(f"🖼️ Медиа временно недоступно ({response.status_code}), будет отправлен текст: {url}")
+        metrics.MEDIA_PROBES.inc("unreachable")
+        return None
+    if response.status_code >= 400:
+        logger.warning(f"🖼️ Медиа недоступно ({response.status_code}), будет отправлен текст: {url}")
+        metrics.MEDIA_PROBES.inc("dead")
+        return False
+
+    content_type = response.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type.startswith(("image/", "video/")) and not content_type.startswith("image/" if kind == "photo" else "video/"):
+        logger.warning(f"🖼️ Неподходящий тип медиа {content_type}, будет отправлен текст: {url}")
+        metrics.MEDIA_PROBES.inc("wrong_type")
+        return False
+
+    size = response.headers.get("content-length")
+    limit = MAX_PHOTO_SIZE if kind == "photo" else MAX_VIDEO_SIZE
+    if size and size.isdigit() and int(size) > limit:
+        logger.warning(f"🖼️ Медиа больше {limit // 1024 // 1024} МБ, будет отправлен текст: {url}")
+        metrics.MEDIA_PROBES.inc("too_large")
+        return False
+
+    metrics.MEDIA_PROBES.inc("ok")
+    return True
@@ -0,0 +1,195 @@
+import logging
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from http_server import Response, start_http_server
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм (секунды)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик"""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def render(self):
+        lines = self._header()
+        for label_values, value in list(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Текущее значение, которое считывается функцией в момент запроса метрик
+
+    collect() должна вернуть словарь {кортеж значений меток: значение}.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labels=(), collect=None):
+        super().__init__(name, documentation, labels)
+        self.collect = collect
+
+    def render(self):
+        lines = self._header()
+        if self.collect is None:
+            return lines
+        try:
+            values = self.collect()
+        except Exception as e:
+            logger.error(f"Ошибка при сборе метрики {self.name}: {e}")
+            return lines
+        for label_values, value in values.items():
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Распределение значений по корзинам"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+
+    def observe(self, value, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            # [счетчики по корзинам..., +Inf, сумма]
+            series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        """Замер длительности блока"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def render(self):
+        lines = self._header()
+        for label_values, series in list(self._series.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), series):
+                cumulative += count
+                labels = _format_labels(self.labels, label_values, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {series[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Набор метрик, отдаваемых в формате Prometheus"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=(), collect=None):
+        return self.register(Gauge(name, documentation, labels, collect))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+FETCH_SECONDS = registry.histogram("news_fetch_seconds", "Время загрузки RSS-ленты", ["feed"])
+FETCH_BYTES = registry.counter("news_fetch_bytes_total", "Байт получено из RSS-ленты", ["feed"])
+FETCH_RESPONSES = registry.counter("news_fetch_responses_total", "Ответы RSS-лент по кодам", ["feed", "status"])
+FETCH_ERRORS = registry.counter("news_fetch_errors_total", "Ошибки загрузки RSS-ленты по типу", ["feed", "error"])
+FEED_SKIPS = registry.counter("news_feed_skips_total", "Пропуски опроса ленты, отключенной после ошибок", ["feed"])
+PARSE_SECONDS = registry.histogram("news_parse_seconds", "Время разбора RSS-ленты", ["feed"])
+CLEAN_HTML_SECONDS = registry.histogram("news_clean_html_seconds", "Время очистки текста от HTML")
+CLASSIFY_SECONDS = registry.histogram("news_classify_seconds", "Время определения категорий новости")
+DEDUP_CHECKED = registry.counter("news_dedup_checked_total", "Ссылок проверено на повтор")
+DEDUP_HITS = registry.counter("news_dedup_hits_total", "Ссылок, оказавшихся повторами", ["source"])
+SIMILARITY_LOOKUP_SECONDS = registry.histogram("news_similarity_lookup_seconds",
+                                               "Время поиска похожей новости в LSH-индексе")
+SIMILARITY_INDEX_ENTRIES = registry.gauge("news_similarity_index_entries", "Отпечатков в LSH-индексе")
+SIMILARITY_INDEX_BYTES = registry.gauge("news_similarity_index_bytes", "Память LSH-индекса, байт")
+MEDIA_PROBES = registry.counter("news_media_probes_total", "Проверки адресов медиа по результату", ["result"])
+MEDIA_SENDS = registry.counter("telegram_media_sends_total", "Отправки медиа по способу (url или file_id)", ["source"])
+SEND_SECONDS = registry.histogram("telegram_send_seconds", "Время отправки сообщения в Telegram", ["chat"])
+SEND_ERRORS = registry.counter("telegram_errors_total", "Ошибки отправки в Telegram", ["chat", "error"])
+SEND_RETRY_AFTER = registry.counter("telegram_retry_after_total", "Ответы 429 (RetryAfter) от Telegram", ["chat"])
+GROUPED_NEWS = registry.counter("telegram_grouped_news_total", "Новостей, отправленных альбомом или дайджестом",
+                                ["kind"])
+SEND_QUEUE_DEPTH = registry.gauge("telegram_send_queue_depth", "Сообщений в очереди отправки", ["chat"])
+WEBHOOK_UPDATES = registry.counter("telegram_webhook_updates_total", "Обновления, полученные вебхуком, по результату",
+                                   ["result"])
+# Личная рассылка идет в тысячи чатов, поэтому метрики без метки чата
+DIRECT_SENDS = registry.counter("telegram_direct_sends_total", "Личные сообщения подписчикам по результату",
+                                ["result"])
+DIRECT_SEND_SECONDS = registry.histogram("telegram_direct_send_seconds", "Время отправки личного сообщения")
+DB_QUERY_SECONDS = registry.histogram("db_query_seconds", "Время запросов к базе данных", ["query"])
+
+
+async def start_metrics_server(host, port):
+    """Запуск HTTP-сервера с метриками на /metrics"""
+
+    async def handle(request):
+        if request.path != "/metrics":
+            return Response(404, "Not Found")
+        return Response(200, registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+    server = await start_http_server(handle, host, port)
+    logger.info(f"📈 Метрики доступны на http://{host}:{port}/metrics")
+    return server
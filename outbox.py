@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import random
+import time
+
+from telegram.error import BadRequest, Forbidden
+
+import database
+
+logger = logging.getLogger(__name__)
+
+FETCH_BATCH = 200  # строк очереди, забираемых за раз
+POLL_INTERVAL = 5.0  # секунд между проверками очереди, если ее не будят
+GROUP_COMMIT_SIZE = 50  # результатов отправки в одной транзакции
+GROUP_COMMIT_DELAY = 0.5  # секунд ожидания перед фиксацией неполной группы
+MAX_ATTEMPTS = 5  # попыток до перевода отправки в failed
+RETRY_BASE_DELAY = 30  # секунд до первой повторной попытки, дальше вдвое больше
+MAX_RETRY_DELAY = 3600  # секунд
+CHAT_LEASE_SECONDS = 60  # аренда чата процессом доставки, продлевается при каждой выборке
+MAX_CHATS = 1000  # чатов, одновременно обслуживаемых одним процессом
+
+
+def retry_delay(attempts):
+    """Задержка перед следующей попыткой с экспоненциальным ростом и разбросом"""
+    delay = min(MAX_RETRY_DELAY, RETRY_BASE_DELAY * 2 ** (attempts - 1))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def is_permanent(error):
+    """Ошибки, которые не исправятся при повторе (бот удален из канала, неверный запрос)"""
+    return isinstance(error, (BadRequest, Forbidden))
+
+
+class Outbox:
+    """Доставка новостей из таблицы outbox
+
+    При разборе лент для каждой пары (новость, канал) в одной транзакции
+    с отметкой новости создается строка pending. Обработчик забирает
+    строки, срок которых наступил, ставит их в очереди диспетчера каналов
+    и сохраняет результаты группами: sent, повтор с отложенным
+    next_retry_at или failed после MAX_ATTEMPTS попыток. После перезапуска
+    доставка продолжается с незавершенных строк.
+
+    Доставкой могут заниматься несколько процессов: каждый арендует в базе
+    чаты (owner - имя процесса) и отправляет только в свои, поэтому строка
+    не уходит дважды, а лимит частоты чата соблюдает один диспетчер.
+
+    make_send(row) возвращает функцию отправки для строки
+    (id, chat_id, category, message, photo_url, video_url, attempts);
+    on_commit(delivered) вызывается внутри транзакции с результатами.
+    Если задан group(chat_id, rows), строки одного чата разбиваются им на
+    группы, и группа из нескольких строк отправляется одним вызовом
+    make_group_send(rows) (альбом или дайджест) с общим результатом.
+    """
+
+    def __init__(self, dispatcher, make_send, on_commit=None, owner="", max_chats=MAX_CHATS,
+                 lease_seconds=CHAT_LEASE_SECONDS, group=None, make_group_send=None):
+        self.dispatcher = dispatcher
+        self.make_send = make_send
+        self.on_commit = on_commit
+        self.group = group
+        self.make_group_send = make_group_send
+        self.owner = owner
+        self.max_chats = max_chats
+        self.lease_seconds = lease_seconds
+        self._in_flight = {}  # id строки -> число попыток до текущей
+        self._results = []  # (state, next_retry_at, sent_at, last_error, id)
+        self._delivered = 0
+        self._wakeup = asyncio.Event()
+        self._results_ready = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._tasks = []
+
+    def wake(self):
+        """Сигнал о новых строках в очереди"""
+        self._idle.clear()
+        self._wakeup.set()
+
+    def start(self):
+        """Запуск обработчика очереди и записи результатов"""
+        self._tasks = [asyncio.create_task(self._run()), asyncio.create_task(self._commit_loop())]
+
+    async def stop(self):
+        """Остановка обработчика с сохранением уже полученных результатов"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self._commit()
+        await database.release_chat_leases(self.owner)
+
+    async def wait_idle(self):
+        """Ожидание момента, когда очередь пуста и все результаты сохранены"""
+        await self._idle.wait()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                rows = await database.claim_outbox(self.owner, time.time(), self.lease_seconds, self.max_chats,
+                                                   FETCH_BATCH + len(self._in_flight))
+            except Exception as e:
+                logger.error(f"❌ Ошибка чтения очереди отправки: {e}")
+                rows = []
+            rows = [row for row in rows if row[0] not in self._in_flight]
+            for chat_rows in self._groups(rows):
+                self._submit(chat_rows)
+
+            if not rows:
+                if not self._in_flight and not self._results:
+                    self._idle.set()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+
+    def _groups(self, rows):
+        """Строки, отправляемые одним вызовом"""
+        if self.group is None:
+            return [[row] for row in rows]
+        by_chat = {}
+        for row in rows:
+            by_chat.setdefault(row[1], []).append(row)
+        return [group for chat_id, chat_rows in by_chat.items() for group in self.group(chat_id, chat_rows)]
+
+    def _submit(self, rows):
+        chat_id = rows[0][1]
+        for row in rows:
+            self._in_flight[row[0]] = row[-1]
+        send = self.make_send(rows[0]) if len(rows) == 1 else self.make_group_send(rows)
+        future = self.dispatcher.submit(chat_id, send)
+        future.add_done_callback(lambda done: self._record([row[0] for row in rows], chat_id, done))
+
+    def _record(self, row_ids, chat_id, future):
+        now = time.time()
+        if future.cancelled():
+            # Остановка бота: строки остаются pending и будут отправлены после запуска
+            for row_id in row_ids:
+                self._in_flight.pop(row_id, None)
+            return
+        error = future.exception()
+        for row_id in row_ids:
+            attempts = self._in_flight.get(row_id, 0) + 1
+            if error is None:
+                self._results.append(("sent", None, now, None, row_id))
+                self._delivered += 1
+            elif is_permanent(error) or attempts >= MAX_ATTEMPTS:
+                logger.error(f"❌ Отправка в {chat_id} не удалась окончательно после {attempts} попыток: {error}")
+                self._results.append(("failed", None, None, str(error), row_id))
+            else:
+                delay = retry_delay(attempts)
+                logger.warning(f"🔁 Ошибка отправки в {chat_id}: {error}, повтор через {delay:.0f} с")
+                self._results.append(("pending", now + delay, None, str(error), row_id))
+        self._results_ready.set()
+
+    async def _commit_loop(self):
+        while True:
+            await self._results_ready.wait()
+            if len(self._results) < GROUP_COMMIT_SIZE:
+                await asyncio.sleep(GROUP_COMMIT_DELAY)
+            self._results_ready.clear()
+            if not await self._commit():
+                await asyncio.sleep(POLL_INTERVAL)
+                continue
+            self.wake()
+
+    async def _commit(self):
+        """Сохранение накопленных результатов одной транзакцией; False - сохранить не удалось"""
+        results, self._results = self._results, []
+        delivered, self._delivered = self._delivered, 0
+        if not results:
+            return True
+        try:
+            async with database.batch():
+                await database.complete_outbox(results)
+                if self.on_commit is not None:
+                    await self.on_commit(delivered)
+        except Exception as e:
+            # Результаты сохранятся со следующей группой, строки пока остаются в обработке
+            logger.error(f"❌ Ошибка при сохранении результатов отправки: {e}")
+            self._results[:0] = results
+            self._delivered += delivered
+            self._results_ready.set()
+            return False
+        # Строки покидают обработку только после фиксации, иначе их заберут повторно
+        for *_, row_id in results:
+            self._in_flight.pop(row_id, None)
+        return True
@@ -0,0 +1,57 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from feed_stream import parse_feed
+
+logger = logging.getLogger(__name__)
+
+_WARMUP_FEED = (
+    b"<?xml version='1.0' encoding='utf-8'?><rss version='2.0'><channel><title>warmup</title>"
+    b"<item><title>warmup</title><link>https://example.com/warmup</link>"
+    b"<description>warmup</description><enclosure url='https://example.com/warmup.jpg' type='image/jpeg'/>"
+    b"</item></channel></rss>"
+)
+
+
+def _warm_up():
+    """Импорт парсеров и пробный разбор, чтобы первая лента не ждала запуска процесса"""
+    parse_feed(_WARMUP_FEED)
+    return os.getpid()
+
+
+class FeedParsePool:
+    """Пул процессов для разбора лент
+
+    Разбор XML - чисто процессорная работа на Python, которая в пуле потоков
+    держит GIL и задерживает обработку команд. В пуле процессов ленты
+    разбираются параллельно на всех ядрах, а в цикл событий возвращаются
+    только компактные записи NewsItem. Процессы запускаются через spawn:
+    дочерний процесс не наследует потоки и соединения родителя.
+    """
+
+    def __init__(self, workers=None, warmup=True):
+        self.workers = workers or os.cpu_count() or 1
+        self.warmup = warmup
+        self._executor = None
+
+    async def start(self):
+        self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context("spawn"))
+        if self.warmup:
+            loop = asyncio.get_running_loop()
+            pids = await asyncio.gather(*(loop.run_in_executor(self._executor, _warm_up)
+                                          for _ in range(self.workers)))
+            logger.info(f"🧩 Запущено процессов разбора лент: {len(set(pids))}")
+
+    async def parse(self, content, response_headers=None):
+        """Записи ленты (NewsItem), разобранные в пуле процессов"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, parse_feed, content, response_headers)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
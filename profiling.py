@@ -0,0 +1,237 @@
+import asyncio
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from functools import wraps
+
+logger = logging.getLogger(__name__)
+
+TARGETS = ("feeds", "handlers")  # циклы проверки лент и обработчики команд
+MODES = ("cprofile", "sample")  # детерминированный профиль или выборки стека
+MAX_RUNS = 100  # циклов проверки лент в одном профиле
+MAX_SECONDS = 3600  # длительность окна профилирования обработчиков
+SAMPLE_INTERVAL = 0.005  # секунд между выборками стека
+TOP_N = 15  # строк в сводке
+SUMMARY_LIMIT = 4000  # символов сводки (сообщение Telegram - до 4096)
+# Модули и функции, в которых поток ждет работы или ввода-вывода; такие выборки считаются простоем
+IDLE_FILES = ("threading.py", "queue.py", "selectors.py")
+IDLE_FUNCTIONS = {("thread.py", "_worker"), ("core.py", "_connection_worker_thread")}
+
+
+def _is_idle(code):
+    filename = os.path.basename(code.co_filename)
+    return filename in IDLE_FILES or (filename, code.co_name) in IDLE_FUNCTIONS
+
+
+def _frame_name(code):
+    path = code.co_filename.replace("\\", "/").rsplit("/", 2)
+    return f"{code.co_qualname} ({'/'.join(path[-2:])}:{code.co_firstlineno})"
+
+
+class _Sampler(threading.Thread):
+    """Поток, снимающий стеки всех потоков каждые interval секунд, пока active()"""
+
+    def __init__(self, interval, active):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.interval = interval
+        self.active = active
+        self.stacks = Counter()  # свернутый стек -> число выборок
+        self.idle = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        own = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            if not self.active():
+                continue
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                if _is_idle(frame.f_code):
+                    self.idle += 1
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class ProfileSession:
+    """Профилирование следующих runs вызовов цели или всех вызовов до момента until
+
+    Режим cprofile включает cProfile на время вызовов цели, sample - снимает
+    стеки потоком _Sampler. Профилировщик видит весь поток цикла событий,
+    поэтому в профиль попадают и задачи, выполнявшиеся одновременно с целью.
+    """
+
+    def __init__(self, target, mode, runs=None, until=None, on_done=None):
+        self.target = target
+        self.mode = mode
+        self.runs = runs
+        self.until = until
+        self.on_done = on_done
+        self.completed = 0
+        self.started_at = time.monotonic()
+        self.active = 0  # вызовов цели, выполняющихся сейчас
+        self._profile = cProfile.Profile() if mode == "cprofile" else None
+        self._sampler = _Sampler(SAMPLE_INTERVAL, lambda: self.active > 0) if mode == "sample" else None
+        if self._sampler is not None:
+            self._sampler.start()
+
+    def enter(self):
+        self.active += 1
+        if self._profile is not None and self.active == 1:
+            self._profile.enable()
+
+    def exit(self):
+        self.active -= 1
+        if self._profile is not None and self.active == 0:
+            self._profile.disable()
+        self.completed += 1
+
+    @property
+    def done(self):
+        if self.runs is not None:
+            return self.completed >= self.runs
+        return time.monotonic() >= self.until
+
+    def finish(self, directory):
+        """Остановка и запись профиля; возвращается (путь к файлу, сводка)"""
+        os.makedirs(directory, exist_ok=True)
+        name = f"{self.target}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        if self._profile is not None:
+            if self.active:
+                self._profile.disable()
+            path = os.path.join(directory, name + ".prof")
+            self._profile.dump_stats(path)
+            summary = self._cprofile_summary()
+        else:
+            self._sampler.stop()
+            path = os.path.join(directory, name + ".collapsed")
+            with open(path, "w", encoding="utf-8") as file:
+                for stack, count in self._sampler.stacks.most_common():
+                    file.write(f"{stack} {count}\n")
+            summary = self._sample_summary()
+        header = (f"🔬 Профиль {self.target} ({self.mode}): вызовов {self.completed}, "
+                  f"{time.monotonic() - self.started_at:.1f} с\n📁 {path}\n\n")
+        return path, (header + summary)[:SUMMARY_LIMIT]
+
+    def _cprofile_summary(self):
+        stats = pstats.Stats(self._profile, stream=io.StringIO())
+        if not stats.stats:
+            return "Вызовов не было"
+        rows = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:TOP_N]
+        lines = [f"Всего {stats.total_tt * 1000:.0f} мс, по собственному времени:",
+                 "собств. мс | с вложенными | вызовов"]
+        for (filename, line, function), (_, calls, own, cumulative, _) in rows:
+            short = filename.replace("\\", "/").rsplit("/", 1)[-1]
+            lines.append(f"{own * 1000:.1f} | {cumulative * 1000:.1f} | {calls} {function} ({short}:{line})")
+        return "\n".join(lines)
+
+    def _sample_summary(self):
+        stacks = self._sampler.stacks
+        busy = sum(stacks.values())
+        if not busy:
+            return f"Выборок с работой нет (потоков в ожидании: {self._sampler.idle})"
+        own = Counter()
+        inclusive = Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(";")[1:]
+            own[frames[-1]] += count
+            for frame in set(frames):
+                inclusive[frame] += count
+        lines = [f"Выборок с работой {busy}, потоков в ожидании {self._sampler.idle}, по собственному времени:"]
+        lines += [f"{count / busy * 100:.1f}% {frame}" for frame, count in own.most_common(TOP_N)]
+        lines.append("\nС вложенными вызовами:")
+        lines += [f"{count / busy * 100:.1f}% {frame}" for frame, count in inclusive.most_common(TOP_N)]
+        return "\n".join(lines)
+
+
+class Profiler:
+    """Профилирование по запросу для циклов проверки лент и обработчиков
+
+    Функции цели оборачиваются декоратором profiled(target). Пока
+    профилирование выключено, обертка только проверяет, что сессии нет.
+    Одновременно идет не больше одной сессии; по ее окончании профиль
+    записывается в directory, а сводка передается в on_done.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.session = None
+        self._timer = None
+        self._tasks = set()
+
+    def start(self, target, mode, runs=None, seconds=None, on_done=None):
+        """Включение профилирования следующих runs вызовов или вызовов за seconds секунд"""
+        if self.session is not None:
+            raise RuntimeError(f"уже идет профилирование {self.session.target}")
+        until = None
+        if seconds is not None:
+            until = time.monotonic() + seconds
+            self._timer = asyncio.get_running_loop().call_later(seconds, self._finish_if_idle)
+        self.session = ProfileSession(target, mode, runs=runs, until=until, on_done=on_done)
+        logger.info(f"🔬 Включено профилирование {target} ({mode}): "
+                    + (f"{runs} вызовов" if runs is not None else f"{seconds} с"))
+        return self.session
+
+    def stop(self):
+        """Досрочное завершение текущей сессии"""
+        if self.session is not None:
+            self._finish()
+
+    def profiled(self, target):
+        """Декоратор корутины, вызовы которой профилируются при активной сессии target"""
+
+        def decorator(func):
+            @wraps(func)
+            async def wrapper(*args, **kwargs):
+                session = self.session
+                if session is None or session.target != target:
+                    return await func(*args, **kwargs)
+                session.enter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    session.exit()
+                    if session is self.session and session.done and not session.active:
+                        self._finish()
+
+            return wrapper
+
+        return decorator
+
+    def _finish_if_idle(self):
+        # Окно истекло во время вызова - сессия завершится при выходе из него
+        self._timer = None
+        if self.session is not None and not self.session.active:
+            self._finish()
+
+    def _finish(self):
+        session, self.session = self.session, None
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        try:
+            _, summary = session.finish(self.directory)
+        except Exception as e:
+            logger.error(f"❌ Не удалось сохранить профиль: {e}")
+            return
+        logger.info(summary)
+        if session.on_done is not None:
+            task = asyncio.get_running_loop().create_task(session.on_done(summary))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
@@ -0,0 +1,196 @@
+import asyncio
+import heapq
+import logging
+import random
+import time
+
+import database
+
+logger = logging.getLogger(__name__)
+
+MIN_POLL_INTERVAL = 300  # секунд
+MAX_POLL_INTERVAL = 6 * 3600  # секунд
+TARGET_ITEMS_PER_POLL = 3  # к очередному опросу в ленте должно накопиться примерно столько новостей
+EMPTY_POLL_BACKOFF = 1.5  # рост интервала для лент, в которых давно нет новостей
+ERROR_BACKOFF = 2.0  # рост интервала для недоступных лент
+RATE_SMOOTHING = 0.3  # вес последнего опроса в скользящей оценке частоты публикаций
+JITTER = 0.1  # случайный разброс интервала, чтобы ленты не опрашивались одновременно
+INITIAL_SPREAD = 60  # секунд на разнесение первых опросов после запуска
+MAX_CONCURRENT_POLLS = 10  # лент в обработке одновременно
+FEED_LEASE_SECONDS = 600  # аренда ленты на время опроса другими процессами не перехватывается
+
+
+class FeedState:
+    """Состояние расписания одной ленты"""
+
+    __slots__ = ("url", "poll_interval", "next_poll_at", "last_polled_at", "items_rate", "empty_polls")
+
+    def __init__(self, url, poll_interval, next_poll_at, last_polled_at=None, items_rate=0.0, empty_polls=0):
+        self.url = url
+        self.poll_interval = poll_interval
+        self.next_poll_at = next_poll_at
+        self.last_polled_at = last_polled_at
+        self.items_rate = items_rate
+        self.empty_polls = empty_polls
+
+    def as_row(self):
+        return (self.poll_interval, self.next_poll_at, self.last_polled_at, self.items_rate,
+                self.empty_polls, self.url)
+
+
+def next_interval(state, new_items, now):
+    """Новый интервал опроса по наблюдаемой частоте публикаций
+
+    new_items - число новых записей при последнем опросе (0 для ответа 304)
+    или None, если лента была недоступна.
+    """
+    interval = state.poll_interval
+    if new_items is None:
+        interval *= ERROR_BACKOFF
+    else:
+        elapsed = now - state.last_polled_at if state.last_polled_at else interval
+        rate = new_items / max(elapsed, 1)
+        state.items_rate = RATE_SMOOTHING * rate + (1 - RATE_SMOOTHING) * state.items_rate
+        state.empty_polls = 0 if new_items else state.empty_polls + 1
+        if new_items == 0 and state.empty_polls > 1:
+            interval *= EMPTY_POLL_BACKOFF
+        elif state.items_rate > 0:
+            interval = TARGET_ITEMS_PER_POLL / state.items_rate
+    interval = min(MAX_POLL_INTERVAL, max(MIN_POLL_INTERVAL, interval))
+    return int(interval * random.uniform(1 - JITTER, 1 + JITTER))
+
+
+class FeedScheduler:
+    """Опрос лент по приоритетной очереди со своим интервалом для каждой ленты
+
+    Ленты хранятся в куче по времени следующего опроса. Планировщик спит
+    до ближайшего срока, забирает все ленты, срок которых наступил (в пределах
+    бюджета одновременных опросов), и передает их одним пакетом в poll.
+    poll(urls) должен вернуть словарь url -> число новых записей или None.
+
+    Если ленты опрашивают несколько процессов, перед опросом ленты
+    арендуются в базе (owner - имя процесса): ленту, арендованную другим
+    процессом, планировщик откладывает до окончания аренды и затем берет
+    из базы уже обновленное расписание.
+
+    Если задан breaker (FeedBreaker), ленту, отключенную после ошибок,
+    планировщик не берет раньше окончания срока отключения.
+    """
+
+    def __init__(self, poll, default_interval, max_concurrent=MAX_CONCURRENT_POLLS, owner="",
+                 lease_seconds=FEED_LEASE_SECONDS, breaker=None):
+        self.poll = poll
+        self.default_interval = default_interval
+        self.max_concurrent = max_concurrent
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self.breaker = breaker
+        self._states = {}
+        self._heap = []
+        self._in_flight = 0
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._batches = set()
+
+    def __len__(self):
+        return len(self._states)
+
+    async def load(self, seed_urls):
+        """Загрузка лент из базы (новые ленты из seed_urls добавляются в таблицу)"""
+        await database.add_feeds(seed_urls, self.default_interval)
+        now = time.time()
+        for url, poll_interval, next_poll_at, last_polled_at, items_rate, empty_polls in await database.get_feeds():
+            if next_poll_at is None:
+                next_poll_at = now + random.uniform(0, INITIAL_SPREAD)
+            self._push(FeedState(url, poll_interval or self.default_interval, next_poll_at,
+                                 last_polled_at, items_rate or 0.0, empty_polls or 0))
+        logger.info(f"🗓️ В расписании {len(self._states)} лент")
+
+    def _push(self, state):
+        self._states[state.url] = state
+        heapq.heappush(self._heap, (state.next_poll_at, state.url))
+        self._wakeup.set()
+
+    def start(self):
+        """Запуск цикла планировщика"""
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановка планировщика и текущих опросов"""
+        tasks = [task for task in (self._task, *self._batches) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            delay = self._heap[0][0] - time.time() if self._heap else None
+            if self._in_flight >= self.max_concurrent:
+                # Все слоты заняты: ждем освобождения, а не срока просроченной ленты
+                delay = None
+            if delay is None or delay > 0 or self._in_flight >= self.max_concurrent:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                if self._in_flight >= self.max_concurrent or not self._heap:
+                    continue
+
+            now = time.time()
+            due = []
+            while self._heap and self._heap[0][0] <= now and self._in_flight + len(due) < self.max_concurrent:
+                _, url = heapq.heappop(self._heap)
+                if url in self._states:
+                    due.append(url)
+            if due:
+                self._in_flight += len(due)
+                task = asyncio.create_task(self._poll_batch(due))
+                self._batches.add(task)
+                task.add_done_callback(self._batches.discard)
+
+    async def _claim(self, urls):
+        """Аренда лент; ленты, занятые другим процессом, переносятся на срок из базы"""
+        try:
+            claimed = await database.claim_feeds(urls, self.owner, time.time(), self.lease_seconds)
+        except Exception as e:
+            logger.error(f"❌ Ошибка при аренде лент: {e}")
+            claimed = set()
+        lost = [url for url in urls if url not in claimed]
+        if lost:
+            now = time.time()
+            schedules = await database.get_feed_schedules(lost)
+            for url in lost:
+                next_poll_at, lease_until = schedules.get(url, (None, None))
+                state = self._states[url]
+                state.next_poll_at = max(next_poll_at or now, lease_until or now, now + 1)
+                self._push(state)
+        return [url for url in urls if url in claimed]
+
+    async def _poll_batch(self, urls):
+        batch_size = len(urls)
+        results = {}
+        try:
+            urls = await self._claim(urls)
+            if urls:
+                results = await self.poll(urls)
+        except Exception as e:
+            logger.error(f"❌ Ошибка при опросе лент: {e}")
+        finally:
+            self._in_flight -= batch_size
+            self._wakeup.set()
+
+        now = time.time()
+        states = []
+        for url in urls:
+            state = self._states[url]
+            state.poll_interval = next_interval(state, results.get(url), now)
+            state.last_polled_at = now
+            state.next_poll_at = now + state.poll_interval
+            retry_at = self.breaker.retry_at(url) if self.breaker is not None else None
+            if retry_at is not None:
+                state.next_poll_at = max(state.next_poll_at, retry_at)
+            states.append(state)
+            self._push(state)
+        await database.update_feed_schedules(state.as_row() for state in states)
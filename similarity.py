@@ -0,0 +1,159 @@
+import logging
+import re
+import sys
+import time
+from collections import OrderedDict
+from hashlib import blake2b
+
+import database
+
+logger = logging.getLogger(__name__)
+
+FINGERPRINT_BITS = 64
+BANDS = 7  # полос LSH-индекса (по 9-10 бит)
+MAX_DISTANCE = 6  # различающихся бит, при которых тексты считаются одной историей
+STEM_LENGTH = 5  # букв слова, учитываемых в признаке (убирает падежные окончания)
+MIN_TOKENS = 8  # более короткие тексты не сравниваются
+
+TOKEN_RE = re.compile(r"\w+")
+_LANE_BITS = 16  # ширина счетчика одного бита при суммировании признаков
+_LANE_MASK = (1 << _LANE_BITS) - 1
+
+# Байт -> 8 счетчиков по 16 бит: сложение таких чисел считает единицы
+# сразу в восьми позициях отпечатков всех признаков
+_SPREAD = [
+    sum(((byte >> bit) & 1) << (bit * _LANE_BITS) for bit in range(8))
+    for byte in range(256)
+]
+
+
+def _band_slices():
+    """Границы полос отпечатка: (сдвиг, маска)"""
+    slices, offset = [], 0
+    for band in range(BANDS):
+        width = FINGERPRINT_BITS // BANDS + (1 if band < FINGERPRINT_BITS % BANDS else 0)
+        slices.append((offset, (1 << width) - 1))
+        offset += width
+    return slices
+
+
+_BAND_SLICES = _band_slices()
+
+
+def _feature_hash(feature):
+    return int.from_bytes(blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def simhash(text):
+    """64-битный SimHash по множеству основ слов текста
+
+    Возвращает None, если в тексте меньше MIN_TOKENS слов: у коротких
+    текстов отпечатки слишком часто совпадают случайно.
+    """
+    tokens = TOKEN_RE.findall(text.lower())
+    if len(tokens) < MIN_TOKENS:
+        return None
+    features = {token[:STEM_LENGTH] for token in tokens}
+
+    counts = [0] * 8  # по одному числу со счетчиками на каждый байт отпечатка
+    for feature in features:
+        value = _feature_hash(feature)
+        for byte_index in range(8):
+            counts[byte_index] += _SPREAD[(value >> (byte_index * 8)) & 0xFF]
+
+    threshold = len(features) / 2
+    fingerprint = 0
+    for byte_index, lanes in enumerate(counts):
+        for bit in range(8):
+            if (lanes >> (bit * _LANE_BITS)) & _LANE_MASK > threshold:
+                fingerprint |= 1 << (byte_index * 8 + bit)
+    return fingerprint
+
+
+def _bands(fingerprint):
+    return [(fingerprint >> offset) & mask for offset, mask in _BAND_SLICES]
+
+
+class NearDuplicateIndex:
+    """LSH-индекс отпечатков отправленных новостей за срок хранения
+
+    Отпечаток делится на BANDS полос; два отпечатка, отличающиеся не более
+    чем в MAX_DISTANCE < BANDS битах, совпадают хотя бы в одной полосе,
+    поэтому поиск проверяет только отпечатки из тех же корзин, а не все.
+    """
+
+    def __init__(self, retention_days, max_distance=MAX_DISTANCE):
+        self.retention_seconds = retention_days * 86400
+        self.max_distance = max_distance
+        self._added = OrderedDict()  # отпечаток -> время добавления, в порядке добавления
+        self._buckets = [{} for _ in range(BANDS)]  # значение полосы -> множество отпечатков
+        self._synced_at = None  # время последней загрузки из базы
+
+    def __len__(self):
+        return len(self._added)
+
+    def add(self, fingerprint, added_at=None):
+        if fingerprint in self._added:
+            self._added.move_to_end(fingerprint)
+        else:
+            for band, key in enumerate(_bands(fingerprint)):
+                self._buckets[band].setdefault(key, set()).add(fingerprint)
+        self._added[fingerprint] = added_at if added_at is not None else time.time()
+
+    def discard(self, fingerprint):
+        if self._added.pop(fingerprint, None) is None:
+            return
+        for band, key in enumerate(_bands(fingerprint)):
+            bucket = self._buckets[band][key]
+            bucket.discard(fingerprint)
+            if not bucket:
+                del self._buckets[band][key]
+
+    def find(self, fingerprint):
+        """Ближайший сохраненный отпечаток в пределах max_distance или None"""
+        best, best_distance = None, self.max_distance + 1
+        for band, key in enumerate(_bands(fingerprint)):
+            for candidate in self._buckets[band].get(key, ()):
+                distance = (candidate ^ fingerprint).bit_count()
+                if distance < best_distance:
+                    best, best_distance = candidate, distance
+        return best
+
+    def expire(self, now=None):
+        """Удаление отпечатков старше срока хранения новостей"""
+        cutoff = (now if now is not None else time.time()) - self.retention_seconds
+        while self._added:
+            fingerprint, added_at = next(iter(self._added.items()))
+            if added_at >= cutoff:
+                break
+            self.discard(fingerprint)
+
+    def memory_bytes(self):
+        """Приблизительный объем памяти индекса"""
+        total = sys.getsizeof(self._added) + len(self._added) * (2 * sys.getsizeof(1 << 63))
+        for buckets in self._buckets:
+            total += sys.getsizeof(buckets)
+            total += sum(sys.getsizeof(bucket) for bucket in buckets.values())
+        return total
+
+    async def load(self):
+        """Загрузка отпечатков недавно отправленных новостей из базы"""
+        self._synced_at = time.time()
+        for fingerprint, sent_at in await database.get_recent_fingerprints(self.retention_seconds):
+            self.add(fingerprint, sent_at)
+        logger.info(
+            f"🧬 Загружено {len(self)} отпечатков новостей "
+            f"({self.memory_bytes() / 1024 / 1024:.1f} МБ)"
+        )
+
+    async def refresh(self):
+        """Догрузка отпечатков, сохраненных с последней загрузки другими процессами"""
+        if self._synced_at is None:
+            return await self.load()
+        now = time.time()
+        # Небольшой запас перекрывает записи, зафиксированные во время прошлой загрузки
+        max_age = min(self.retention_seconds, now - self._synced_at + 60)
+        self._synced_at = now
+        for fingerprint, sent_at in await database.get_recent_fingerprints(max_age):
+            if fingerprint not in self._added:
+                self.add(fingerprint, sent_at)
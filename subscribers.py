@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+import database
+
+logger = logging.getLogger(__name__)
+
+SELECTION_TTL = 1800  # секунд хранения незавершенного выбора категорий
+MAX_SELECTIONS = 10_000  # одновременно хранимых выборов
+
+
+class SubscriberCache:
+    """Активные подписчики в памяти с записью через базу
+
+    Для каждого активного подписчика хранится маска категорий (бит на
+    категорию в порядке categories), а для каждой категории - множество
+    chat_id ее подписчиков (обратный индекс для личной рассылки). Чтение
+    не обращается к базе, запись сначала идет в базу, затем в память.
+
+    Подписки могут менять и другие процессы (несколько --role commands,
+    экземпляры вебхука, отключение подписчиков процессом доставки). Каждая
+    запись в subscribers увеличивает номер версии в базе (триггер), и
+    refresh() перед чтением сверяет его с номером, отраженным в памяти;
+    при расхождении перечитываются только измененные строки.
+    """
+
+    def __init__(self, categories):
+        self.categories = list(categories)
+        self._bits = {category: 1 << index for index, category in enumerate(self.categories)}
+        self._masks = {}  # chat_id -> маска категорий
+        self._members = [set() for _ in self.categories]  # номер категории -> chat_id подписчиков
+        self.version = None  # номер версии подписчиков в базе, отраженный в памяти
+        self._refresh_lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self._masks)
+
+    def __contains__(self, chat_id):
+        return chat_id in self._masks
+
+    @property
+    def active_count(self):
+        return len(self._masks)
+
+    def _mask(self, filters):
+        mask = 0
+        for name in filters:
+            mask |= self._bits.get(name, 0)
+        return mask
+
+    def _index(self, chat_id, mask, add):
+        index = 0
+        while mask:
+            if mask & 1:
+                if add:
+                    self._members[index].add(chat_id)
+                else:
+                    self._members[index].discard(chat_id)
+            mask >>= 1
+            index += 1
+
+    def _set(self, chat_id, mask):
+        previous = self._masks.pop(chat_id, None)
+        if previous is not None:
+            self._index(chat_id, previous, False)
+        if mask:
+            self._masks[chat_id] = mask
+            self._index(chat_id, mask, True)
+
+    def categories_for_mask(self, mask):
+        return [category for category in self.categories if mask & self._bits[category]]
+
+    def get_filters(self, chat_id):
+        """Категории подписчика (пустой список, если он не подписан)"""
+        return self.categories_for_mask(self._masks.get(chat_id, 0))
+
+    def get_mask(self, chat_id):
+        """Маска категорий подписчика (0, если он не подписан)"""
+        return self._masks.get(chat_id, 0)
+
+    def category_counts(self):
+        """Число активных подписчиков по категориям"""
+        return {category: len(members) for category, members in zip(self.categories, self._members)}
+
+    def recipients(self, mask):
+        """Отсортированные chat_id подписчиков хотя бы одной категории из маски"""
+        selected = [members for index, members in enumerate(self._members) if mask & (1 << index)]
+        return sorted(set().union(*selected))
+
+    async def load(self):
+        """Загрузка активных подписчиков из базы"""
+        # Версия читается до строк: запись между запросами приведет к лишнему, но не пропущенному обновлению
+        version = await database.get_subscribers_version()
+        rows = await database.get_active_subscribers()
+        self._masks.clear()
+        self._members = [set() for _ in self.categories]
+        for chat_id, filters in rows:
+            self._set(chat_id, self._mask((filters or "").split()))
+        self.version = version
+        logger.info(f"👥 Загружено {self.active_count} активных подписчиков в память")
+
+    async def refresh(self):
+        """Применение изменений подписок, сделанных после загрузки (в том числе другими процессами)"""
+        async with self._refresh_lock:
+            if self.version is None:
+                await self.load()
+                return
+            version = await database.get_subscribers_version()
+            if version == self.version:
+                return
+            changes = await database.get_subscriber_changes(self.version)
+            for chat_id, filters, is_active in changes:
+                self._set(chat_id, self._mask((filters or "").split()) if is_active else 0)
+            self.version = version
+            logger.debug(f"👥 Применено изменений подписчиков из базы: {len(changes)}")
+
+    async def subscribe(self, chat_id, username, first_name, last_name, filters):
+        """Сохранение подписки в базе и в памяти"""
+        if await database.add_subscriber(chat_id, username, first_name, last_name, filters):
+            self._set(chat_id, self._mask(filters))
+
+    async def unsubscribe(self, chat_id):
+        """Отписка в базе и в памяти"""
+        if await database.remove_subscriber(chat_id):
+            self._set(chat_id, 0)
+
+    async def deactivate(self, chat_ids):
+        """Отключение недоступных подписчиков (бот заблокирован) одним запросом"""
+        chat_ids = list(chat_ids)
+        if chat_ids and await database.deactivate_subscribers(chat_ids):
+            for chat_id in chat_ids:
+                self._set(chat_id, 0)
+
+
+class SelectionStore:
+    """Незавершенный выбор категорий с ограничением по времени и размеру
+
+    Записи старше ttl секунд считаются отсутствующими, при переполнении
+    вытесняются самые давно использованные.
+    """
+
+    def __init__(self, ttl=SELECTION_TTL, max_size=MAX_SELECTIONS):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items = OrderedDict()  # chat_id -> (время последнего обращения, список категорий)
+
+    def __len__(self):
+        return len(self._items)
+
+    def _expire(self, now):
+        cutoff = now - self.ttl
+        while self._items:
+            touched_at, _ = next(iter(self._items.values()))
+            if touched_at >= cutoff:
+                break
+            self._items.popitem(last=False)
+
+    def get(self, chat_id):
+        """Текущий выбор пользователя или None"""
+        now = time.monotonic()
+        self._expire(now)
+        item = self._items.get(chat_id)
+        if item is None:
+            return None
+        self._items[chat_id] = (now, item[1])
+        self._items.move_to_end(chat_id)
+        return item[1]
+
+    def set(self, chat_id, filters):
+        """Сохранение копии выбора; возвращается сохраненный список"""
+        now = time.monotonic()
+        self._expire(now)
+        selection = list(filters)
+        self._items[chat_id] = (now, selection)
+        self._items.move_to_end(chat_id)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+        return selection
+
+    def pop(self, chat_id):
+        item = self._items.pop(chat_id, None)
+        return item[1] if item else None
@@ -0,0 +1,14 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_import_has_no_side_effects(tmp_path):
+    # Так модуль импортируют процессы разбора лент (spawn), тесты и бенчмарки
+    code = "import logging, bot; print(len(logging.getLogger().handlers))"
+    output = subprocess.run([sys.executable, "-c", code], cwd=tmp_path, env={**os.environ, "PYTHONPATH": ROOT},
+                            capture_output=True, text=True, check=True).stdout
+    assert output.split() == ["0"]
+    assert not (tmp_path / "bot.log").exists()
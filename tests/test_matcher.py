@@ -0,0 +1,59 @@
+import pytest
+
+from bench_matcher import SYNONYMS, check_filter_match
+from matcher import CategoryMatcher
+
+# Заголовки, на которых прежний поиск подстрок определял категории верно
+SAMPLE = [
+    "Сборная России по футболу сыграет товарищеский матч",
+    "Хоккей: ЦСКА обыграл СКА в овертайме",
+    "Олимпиада в Париже: итоги первого дня",
+    "Спортивный праздник прошел в парке",
+    "Изменения в законе вступят в силу с января",
+    "Инвестиции в экономику региона выросли вдвое",
+    "Рынок жилья замер в ожидании решения по ставке",
+    "Президент подписал указ о выборах в парламент",
+    "Правительство утвердило бюджет на следующий год",
+    "Губернатор рассказал о планах на лето",
+    "Новые гаджеты для программирования представили на выставке",
+    "Искусственный интеллект научили писать стихи",
+    "Рецепты для здоровья: что есть на завтрак",
+    "Артисты театра выйдут на сцену после ремонта",
+    "Как выбрать крем от морщин и не ошибиться",
+    "Жена узнала об измене мужа из соцсетей",
+    "В Петербурге открылся новый мост через Неву",
+    "Погода на выходные: снег и гололед",
+    "",
+]
+
+# Где прежний поиск ошибался: подстрока внутри другого слова или
+# словоформа, не содержащая ключевое слово целиком
+CORRECTED = {
+    "В Кремле заявили о переговорах": [],
+    "Банкет в честь юбилея города": [],
+    "Цены на рынке выросли": ["экономика"],
+    "Пенсионерам не хватает денег на лекарства": ["экономика"],
+    "Банк обязан раскрыть отчетность": ["экономика"],
+    "Теннисистка вышла в финал турнира": ["спорт"],
+    "Хоккеисты вернулись домой": ["спорт"],
+}
+
+
+@pytest.fixture(scope="module")
+def matcher():
+    return CategoryMatcher(SYNONYMS, SYNONYMS.keys())
+
+
+def legacy_match(text):
+    return [name for name in SYNONYMS if check_filter_match(text, name, SYNONYMS)]
+
+
+@pytest.mark.parametrize("text", SAMPLE)
+def test_matches_legacy_on_sample(matcher, text):
+    assert matcher.match(text) == legacy_match(text)
+
+
+@pytest.mark.parametrize("text, expected", CORRECTED.items())
+def test_corrects_legacy_mistakes(matcher, text, expected):
+    assert matcher.match(text) == expected
+    assert legacy_match(text) != expected
@@ -0,0 +1,74 @@
+import asyncio
+
+import httpx
+
+import database
+from media import MediaCache
+
+
+class FakeFetcher:
+    """HEAD-запросы по заранее заданным ответам: код статуса или исключение"""
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.requests = []
+
+    async def head(self, url, timeout=None):
+        self.requests.append(url)
+        answer = self.answers[url]
+        if isinstance(answer, Exception):
+            raise answer
+        return httpx.Response(answer, headers={"content-type": "image/jpeg"})
+
+
+def run_prepare(tmp_path, cache, fetcher, media, rounds):
+    async def scenario():
+        await database.connect(str(tmp_path / "bot.db"))
+        try:
+            results = []
+            for _ in range(rounds):
+                results.append(await cache.prepare(fetcher, media))
+            return results
+        finally:
+            await database.close()
+
+    return asyncio.run(scenario())
+
+
+def test_transient_failures_are_not_cached(tmp_path):
+    timeout, server_error = "https://a.example/1.jpg", "https://b.example/2.jpg"
+    fetcher = FakeFetcher({timeout: httpx.ConnectTimeout("timed out"), server_error: 503})
+    cache = MediaCache(retry_seconds=0)
+    media = [(timeout, "photo"), (server_error, "photo")]
+
+    first = run_prepare(tmp_path, cache, fetcher, media, rounds=1)[0]
+    fetcher.answers = {timeout: 200, server_error: 200}
+    second = run_prepare(tmp_path, cache, fetcher, media, rounds=1)[0]
+
+    assert first == {timeout, server_error}
+    assert second == set()
+    assert fetcher.requests == [timeout, server_error, timeout, server_error]
+
+
+def test_transient_failure_is_retried_after_delay(tmp_path):
+    url = "https://a.example/1.jpg"
+    fetcher = FakeFetcher({url: httpx.ConnectError("refused")})
+    cache = MediaCache()
+
+    results = run_prepare(tmp_path, cache, fetcher, [(url, "photo")], rounds=3)
+
+    assert results == [{url}] * 3
+    assert fetcher.requests == [url]
+    assert cache.rejected(url)
+
+
+def test_definite_failures_are_cached(tmp_path):
+    missing, invalid = "https://a.example/404.jpg", "ftp://a.example/1.jpg"
+    fetcher = FakeFetcher({missing: 404, invalid: httpx.UnsupportedProtocol("ftp")})
+    cache = MediaCache(retry_seconds=0)
+    media = [(missing, "photo"), (invalid, "photo")]
+
+    results = run_prepare(tmp_path, cache, fetcher, media, rounds=2)
+
+    assert results == [{missing, invalid}] * 2
+    assert fetcher.requests == [missing, invalid]
@@ -0,0 +1,53 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+import database
+
+
+def schema(path):
+    with sqlite3.connect(path) as conn:
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+    return tables, version
+
+
+async def connect_and_close(path):
+    await database.connect(path)
+    await database.close()
+
+
+def test_interrupted_migration_is_rolled_back(tmp_path, monkeypatch):
+    path = str(tmp_path / "bot.db")
+    asyncio.run(connect_and_close(path))
+
+    async def _migrate_crashing():
+        """Миграция, прерванная после изменения схемы"""
+        await database._writer.execute("CREATE TABLE sent_news_new (id INTEGER)")
+        await database._writer.execute("ALTER TABLE feeds ADD COLUMN extra TEXT")
+        raise RuntimeError("процесс остановлен")
+
+    monkeypatch.setattr(database, "MIGRATIONS", database.MIGRATIONS + (_migrate_crashing,))
+    with pytest.raises(RuntimeError):
+        asyncio.run(connect_and_close(path))
+    tables, version = schema(path)
+    assert "sent_news_new" not in tables
+    assert version == len(database.MIGRATIONS) - 1
+    with sqlite3.connect(path) as conn:
+        assert "extra" not in {row[1] for row in conn.execute("PRAGMA table_info(feeds)")}
+
+    monkeypatch.undo()
+    asyncio.run(connect_and_close(path))
+    assert schema(path)[1] == len(database.MIGRATIONS)
+
+
+def test_migrations_can_be_reapplied(tmp_path):
+    # Схема уже изменена, а номер версии не сохранился (база из старой версии бота)
+    path = str(tmp_path / "bot.db")
+    asyncio.run(connect_and_close(path))
+    with sqlite3.connect(path) as conn:
+        conn.execute("PRAGMA user_version = 1")
+
+    asyncio.run(connect_and_close(path))
+    assert schema(path)[1] == len(database.MIGRATIONS)
@@ -0,0 +1,67 @@
+import asyncio
+import sqlite3
+import types
+
+import bot
+import database
+from breaker import FeedBreaker
+from dedup import SentLinkCache
+from fakes import FakeFeedServer, make_rss
+from fetcher import FeedFetcher
+from similarity import NearDuplicateIndex
+
+ITEMS = 5
+
+
+async def count_rows(table):
+    async with database._reader.execute(f"SELECT COUNT(*) FROM {table}") as cursor:
+        return (await cursor.fetchone())[0]
+
+
+async def failed_then_retried_cycle(path, monkeypatch):
+    feed_server = await FakeFeedServer({"feed": make_rss("feed", ITEMS)}).start()
+    url = feed_server.url("feed")
+    monkeypatch.setattr(bot, "feed_fetcher", FeedFetcher())
+    monkeypatch.setattr(bot, "feed_breaker", FeedBreaker())
+    monkeypatch.setattr(bot, "sent_links", SentLinkCache(bot.NEWS_RETENTION_DAYS))
+    monkeypatch.setattr(bot, "near_duplicates", NearDuplicateIndex(bot.NEWS_RETENTION_DAYS))
+    monkeypatch.setattr(bot, "outbox", None)
+    monkeypatch.setattr(bot, "direct_fanout", None)
+    application = types.SimpleNamespace()
+
+    await database.connect(path)
+    try:
+        await database.add_feeds([url], bot.CHECK_INTERVAL)
+        flush = database._flush
+
+        async def locked(pending):
+            raise sqlite3.OperationalError("database is locked")
+
+        monkeypatch.setattr(database, "_flush", locked)
+        try:
+            await bot.process_feeds(application, [url])
+        except sqlite3.OperationalError:
+            pass
+        else:
+            raise AssertionError("ошибка фиксации не дошла до вызывающего")
+        failed = (await count_rows("sent_news"), await count_rows("outbox"), len(bot.sent_links))
+
+        monkeypatch.setattr(database, "_flush", flush)
+        counts = await bot.process_feeds(application, [url])
+        retried = (counts[url], await count_rows("sent_news"), await count_rows("outbox"))
+        return failed, retried
+    finally:
+        await database.close()
+        await bot.feed_fetcher.close()
+        await feed_server.stop()
+
+
+def test_failed_commit_is_retried_next_cycle(tmp_path, monkeypatch):
+    failed, retried = asyncio.run(failed_then_retried_cycle(str(tmp_path / "bot.db"), monkeypatch))
+
+    # Ничего не записано, и кэш дублей не считает новости отправленными
+    assert failed == (0, 0, 0)
+    new_items, sent_news, outbox_rows = retried
+    assert new_items == ITEMS
+    assert sent_news == ITEMS
+    assert outbox_rows > 0
@@ -0,0 +1,61 @@
+import asyncio
+import sqlite3
+
+import database
+from subscribers import SubscriberCache
+
+CATEGORIES = ["спорт", "экономика", "политика"]
+
+
+def test_refresh_applies_changes_from_other_processes(tmp_path):
+    path = str(tmp_path / "bot.db")
+
+    async def scenario():
+        await database.connect(path)
+        try:
+            commands = SubscriberCache(CATEGORIES)
+            deliver = SubscriberCache(CATEGORIES)
+            await commands.load()
+            await deliver.load()
+
+            await commands.subscribe(1, "one", "One", None, ["спорт"])
+            await commands.subscribe(2, "two", "Two", None, ["спорт", "экономика"])
+            await deliver.refresh()
+            subscribed = deliver.recipients(deliver.get_mask(2))
+
+            # Отдельный процесс (другое соединение с базой) меняет и отключает подписки
+            with sqlite3.connect(path) as conn:
+                conn.execute("UPDATE subscribers SET filters = 'политика' WHERE chat_id = 2")
+                conn.execute("UPDATE subscribers SET is_active = 0 WHERE chat_id = 1")
+            await deliver.refresh()
+            await commands.refresh()
+            return subscribed, [(cache.get_filters(1), cache.get_filters(2), cache.recipients(0b111),
+                                 cache.version) for cache in (deliver, commands)]
+        finally:
+            await database.close()
+
+    subscribed, caches = asyncio.run(scenario())
+    assert subscribed == [1, 2]
+    assert caches[0] == caches[1] == ([], ["политика"], [2], 4)
+
+
+def test_refresh_without_changes_keeps_cache(tmp_path, monkeypatch):
+    path = str(tmp_path / "bot.db")
+
+    async def scenario():
+        await database.connect(path)
+        try:
+            cache = SubscriberCache(CATEGORIES)
+            await cache.subscribe(1, "one", "One", None, ["спорт"])
+            await cache.refresh()
+
+            async def unexpected(since_version):
+                raise AssertionError("перечитывание без изменений")
+
+            monkeypatch.setattr(database, "get_subscriber_changes", unexpected)
+            await cache.refresh()
+            return cache.get_filters(1)
+        finally:
+            await database.close()
+
+    assert asyncio.run(scenario()) == ["спорт"]
@@ -0,0 +1,32 @@
+import asyncio
+from types import SimpleNamespace
+
+from webhook import ChatOrderedUpdateProcessor
+
+
+def make_update(chat_id):
+    return SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id))
+
+
+def test_busy_chat_does_not_block_other_chats():
+    async def scenario():
+        processor = ChatOrderedUpdateProcessor(max_concurrent_updates=2)
+        release = asyncio.Event()
+        order = []
+
+        async def handle(name, wait):
+            if wait:
+                await release.wait()
+            order.append(name)
+
+        # Пять обновлений одного чата: первое зависло, остальные ждут своей очереди
+        busy = [asyncio.create_task(processor.process_update(make_update(1), handle(f"a{number}", True)))
+                for number in range(5)]
+        await asyncio.sleep(0)
+        await asyncio.wait_for(processor.process_update(make_update(2), handle("b", False)), timeout=1)
+
+        release.set()
+        await asyncio.gather(*busy)
+        return order
+
+    assert asyncio.run(scenario()) == ["b", "a0", "a1", "a2", "a3", "a4"]
@@ -0,0 +1,151 @@
+import asyncio
+import hmac
+import json
+import logging
+import signal
+from urllib.parse import urlsplit
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+import metrics
+from http_server import Response, start_http_server
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+UPDATE_CONCURRENCY = 64  # обновлений в обработке одновременно
+MAX_PENDING_UPDATES = 10_000  # обновлений в очереди, сверх которых запросы отклоняются с 503
+MAX_CONNECTIONS = 40  # одновременных соединений Telegram с вебхуком
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка обновлений с сохранением порядка внутри чата
+
+    Обновления разных чатов обрабатываются одновременно (не больше
+    max_concurrent_updates), обновления одного чата - по очереди, чтобы
+    нажатия кнопок выбора категорий не перемешивались.
+
+    Семафор PTB берется до вызова do_process_update, и обновления,
+    ждущие блокировки своего чата, занимали бы в нем места: очередь
+    одного чата останавливала бы все остальные. Поэтому семафору PTB
+    отдается предел ожидающих обновлений (max_waiting), а число
+    обрабатываемых ограничивает собственный семафор, который берется
+    уже после блокировки чата.
+    """
+
+    def __init__(self, max_concurrent_updates=UPDATE_CONCURRENCY, max_waiting=MAX_PENDING_UPDATES):
+        if max_concurrent_updates < 1:
+            raise ValueError("max_concurrent_updates должно быть положительным")
+        super().__init__(max(max_waiting, max_concurrent_updates))
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        self._locks = {}  # chat_id -> [блокировка, число ожидающих обновлений]
+
+    async def do_process_update(self, update, coroutine):
+        chat = getattr(update, "effective_chat", None)
+        if chat is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        entry = self._locks.get(chat.id)
+        if entry is None:
+            entry = self._locks[chat.id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0], self._slots:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[chat.id]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+def make_webhook_handler(application, path, secret_token, max_pending=MAX_PENDING_UPDATES):
+    """Обработчик HTTP-запросов Telegram для http_server
+
+    Тело запроса - одно обновление или JSON-массив обновлений. Обновления
+    ставятся в update_queue приложения, и ответ возвращается сразу, не
+    дожидаясь обработки. При переполнении очереди отвечает 503, и Telegram
+    повторит доставку позже. Запросы без заголовка с secret_token
+    отклоняются: без него кто угодно мог бы подделать обновление от имени
+    любого пользователя.
+    """
+    if not secret_token:
+        raise ValueError("для вебхука нужен секрет")
+
+    async def handle(request):
+        if request.path != path:
+            return Response(404, "Not Found")
+        if request.method != "POST":
+            return Response(405, "Method Not Allowed", headers={"Allow": "POST"})
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret_token):
+            metrics.WEBHOOK_UPDATES.inc("forbidden")
+            return Response(403, "Forbidden")
+
+        try:
+            payload = json.loads(request.body)
+            items = payload if isinstance(payload, list) else [payload]
+            updates = [Update.de_json(item, application.bot) for item in items]
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning(f"⚠️ Некорректное обновление во входящем запросе: {e}")
+            metrics.WEBHOOK_UPDATES.inc("invalid")
+            return Response(400, "Bad Request")
+
+        if application.update_queue.qsize() + len(updates) > max_pending:
+            metrics.WEBHOOK_UPDATES.inc("busy", amount=len(updates))
+            return Response(503, "Service Unavailable", headers={"Retry-After": "1"})
+        for update in updates:
+            application.update_queue.put_nowait(update)
+        metrics.WEBHOOK_UPDATES.inc("accepted", amount=len(updates))
+        return Response(200, "OK")
+
+    return handle
+
+
+async def start_webhook_server(application, host, port, path, secret_token):
+    """Запуск HTTP-сервера, принимающего обновления для application"""
+    return await start_http_server(make_webhook_handler(application, path, secret_token), host, port)
+
+
+async def run_webhook(application, url, host, port, secret_token):
+    """Работа бота через вебхук до SIGINT/SIGTERM
+
+    Повторяет жизненный цикл run_polling (initialize, post_init, start, ...),
+    но вместо Updater обновления принимает встроенный HTTP-сервер, а
+    Telegram узнает адрес из setWebhook.
+    """
+    path = urlsplit(url).path or "/"
+    await application.initialize()
+    server = None
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        server = await start_webhook_server(application, host, port, path, secret_token)
+        await application.bot.set_webhook(url, secret_token=secret_token,
+                                          allowed_updates=Update.ALL_TYPES, max_connections=MAX_CONNECTIONS)
+        logger.info(f"🌐 Вебхук {url} принимает обновления на {host}:{port}")
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+        await stop.wait()
+        logger.info("🛑 Остановка вебхука...")
+    finally:
+        if server is not None:
+            server.close()
+        if application.running:
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)